@@ -1,3 +1,334 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from unittest import TestCase
 
-# Create your tests here.
+import django
+from django.conf import settings
+
+# The model package needs the app registry, none of these tests touch a database.
+if not settings.configured:
+    settings.configure(
+        INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes", "vega"]
+    )
+    django.setup()
+
+from vega import constants  # noqa: E402
+from vega.downloads import DataFileDownloader, DownloadError  # noqa: E402
+from vega.models._accounting import PositionAccount  # noqa: E402
+from vega.models._metrics import RiskMetrics  # noqa: E402
+from vega.models._prices import PriceCache  # noqa: E402
+
+BUY, SELL = constants.OrderAction.BUY, constants.OrderAction.SELL
+
+START = datetime.datetime(2026, 1, 5, 15, tzinfo=datetime.timezone.utc)
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Serves `server.content` with an ETag, answering conditional and Range requests.
+    """
+
+    server: "FileServer"
+
+    def do_GET(self) -> None:
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content = server.content
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        ranged = self.headers.get("Range")
+
+        if ranged and self.headers.get("If-Range") == etag:
+            start = int(ranged.removeprefix("bytes=").split("-")[0])
+
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.end_headers()
+                return
+
+        body = content[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if server.truncate:
+            # Drop the connection half way, once.
+            server.truncate = False
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class FileServer(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.content = b""
+        self.truncate = False
+        self.requests: List[Dict[str, str]] = []
+
+
+class DataFileDownloaderTests(TestCase):
+    """Downloads from a local HTTP server."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = FileServer()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.target = os.path.join(self.directory.name, "symbols.txt")
+        self.server.content = os.urandom(256 * 1024)
+        self.server.truncate = False
+        self.server.requests = []
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def downloader(self, **kwargs: Any) -> DataFileDownloader:
+        url = f"http://127.0.0.1:{self.server.server_port}/symbols.txt"
+
+        return DataFileDownloader(url, self.target, chunk_size=16 * 1024, backoff=0, **kwargs)
+
+    def read_target(self) -> bytes:
+        with open(self.target, "rb") as handle:
+            return handle.read()
+
+    def test_unchanged_file_is_skipped(self) -> None:
+        downloader = self.downloader()
+
+        self.assertTrue(downloader.fetch())
+        self.assertFalse(downloader.fetch())
+        self.assertEqual(self.read_target(), self.server.content)
+        self.assertIn("If-None-Match", self.server.requests[-1])
+
+    def test_interrupted_download_is_resumed(self) -> None:
+        self.server.truncate = True
+
+        self.assertTrue(self.downloader().fetch())
+        self.assertEqual(self.read_target(), self.server.content)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertNotIn("Range", self.server.requests[0])
+        self.assertEqual(
+            self.server.requests[1]["Range"], f"bytes={len(self.server.content) // 2}-"
+        )
+        self.assertFalse(os.path.exists(f"{self.target}.part"))
+
+    def test_unsatisfiable_range_restarts(self) -> None:
+        downloader = self.downloader()
+        self.server.truncate = True
+        # The first attempt is cut off and the resumed one is answered with 416.
+        downloader.retries = 1
+
+        with self.assertRaises(DownloadError):
+            downloader.fetch()
+
+        with open(downloader.partial_file, "ab") as handle:
+            handle.write(os.urandom(len(self.server.content)))
+
+        downloader.retries = 3
+
+        self.assertTrue(downloader.fetch())
+        self.assertEqual(self.read_target(), self.server.content)
+        self.assertIn("Range", self.server.requests[1])
+        self.assertNotIn("Range", self.server.requests[2])
+
+    def test_checksum_mismatch_fails(self) -> None:
+        downloader = self.downloader(checksum="0" * 64)
+
+        with self.assertRaises(DownloadError):
+            downloader.fetch()
+
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(downloader.partial_file))
+        self.assertFalse(os.path.exists(downloader.state_file))
+
+
+class PositionAccountTests(TestCase):
+    """Average cost accounting replayed from fills."""
+
+    def account(self, *fills: tuple) -> PositionAccount:
+        return PositionAccount(
+            (action, START + datetime.timedelta(days=day), Decimal(price), amount, Decimal(fees))
+            for day, (action, price, amount, fees) in enumerate(fills)
+        )
+
+    def test_entry_is_volume_weighted(self) -> None:
+        account = self.account((BUY, "10", 10, "1"), (BUY, "14", 30, "3"))
+        stats = account.stats()
+
+        self.assertEqual(stats["entry_price"], Decimal("13"))
+        self.assertEqual(stats["average_cost"], Decimal("13"))
+        self.assertEqual((stats["entry_amount"], stats["entry_fees"]), (40, Decimal("4")))
+        self.assertEqual((stats["open_amount"], stats["real_pnl"]), (40, None))
+
+    def test_partial_exits_realize_net_of_prorated_entry_fees(self) -> None:
+        account = self.account(
+            (BUY, "10", 10, "1"),
+            (BUY, "14", 30, "3"),
+            (SELL, "15", 10, "0.50"),
+            (SELL, "12", 20, "1"),
+        )
+
+        # (15 - 13) * 10 - 0.50 - 4 * 10 / 40 and (12 - 13) * 20 - 1 - 3 * 20 / 30
+        self.assertEqual(account.realized, [Decimal("18.5"), Decimal("-23")])
+        self.assertEqual(account.real_pnl, Decimal("-4.5"))
+        self.assertEqual((account.open_amount, account.open_fees), (10, Decimal("1")))
+
+        # the open 10 at a cost of 13 carry the remaining entry fee
+        self.assertEqual(account.unreal_pnl(Decimal("16")), Decimal("29"))
+        self.assertEqual(account.unreal_pnl(), Decimal("-11"))
+        self.assertEqual(account.stats(Decimal("16.004"))["mark_price"], Decimal("16.00"))
+
+    def test_short_gains_when_the_price_falls(self) -> None:
+        account = self.account((SELL, "20", 10, "1"), (BUY, "18", 4, "0.40"))
+
+        # (18 - 20) * 4 * -1 - 0.40 - 1 * 4 / 10
+        self.assertEqual(account.real_pnl, Decimal("7.2"))
+        self.assertEqual(account.unreal_pnl(Decimal("21")), Decimal("-6.6"))
+
+    def test_reentry_moves_the_average_cost_not_the_vwap(self) -> None:
+        account = self.account(
+            (BUY, "10", 10, "0"),
+            (SELL, "12", 5, "0"),
+            (BUY, "16", 5, "0"),
+        )
+        stats = account.stats()
+
+        # the entry price averages every entry fill, the cost only the amount still open
+        self.assertEqual(stats["entry_price"], Decimal("12"))
+        self.assertEqual(stats["average_cost"], Decimal("13"))
+        self.assertEqual(stats["real_pnl"], Decimal("10"))
+
+        account.add(SELL, START + datetime.timedelta(days=3), Decimal("13"), 10)
+
+        self.assertEqual(account.realized, [Decimal("10"), Decimal("0")])
+        self.assertEqual(account.real_pnl, Decimal("10"))
+        self.assertEqual((account.open_amount, account.unreal_pnl()), (0, Decimal("0")))
+
+
+class RiskMetricsTests(TestCase):
+    """Closed form metrics of the position totals."""
+
+    def totals(self, wins: List[int], losses: List[int]) -> Dict[str, Dict[str, Any]]:
+        # a quarter year over 4 positions, 16 holding periods a year
+        holding = datetime.timedelta(days=365.25 / 16)
+
+        return {
+            result_type: {
+                "position_count": len(amounts),
+                "amount_sum": sum(amounts),
+                "amount_sumsq": sum(amount * amount for amount in amounts),
+                "duration_sum": holding * len(amounts),
+            }
+            for result_type, amounts in (
+                (constants.ResultType.WIN, wins),
+                (constants.ResultType.LOSS, losses),
+            )
+        }
+
+    def test_closed_forms(self) -> None:
+        metrics = RiskMetrics(self.totals([6, 6], [-2, -2]))
+
+        # mean 2, variance 80 / 4 - 2 ** 2, downside deviation sqrt(8 / 4)
+        self.assertEqual((metrics.count, metrics.mean, metrics.stdev), (4, 2, 4))
+        self.assertEqual(metrics.downside_deviation, Decimal(2).sqrt())
+        self.assertEqual(metrics.periods_per_year, 16)
+        self.assertEqual(
+            metrics.calculate(Decimal("30"), Decimal("-10")),
+            {
+                "sharpe_ratio": Decimal("2.0000"),
+                "sortino_ratio": Decimal("5.6569"),
+                "calmar_ratio": Decimal("3.0000"),
+                "profit_factor": Decimal("3.0000"),
+                "expectancy": Decimal("2.00"),
+                "payoff_ratio": Decimal("3.0000"),
+            },
+        )
+
+    def test_undefined_metrics_are_none(self) -> None:
+        metrics = RiskMetrics(self.totals([5, 5], []))
+
+        # no losses and no variance
+        self.assertEqual(metrics.stdev, 0)
+        self.assertEqual(
+            metrics.calculate(Decimal("30"), Decimal("0")),
+            {
+                "sharpe_ratio": None,
+                "sortino_ratio": None,
+                "calmar_ratio": None,
+                "profit_factor": None,
+                "expectancy": Decimal("5.00"),
+                "payoff_ratio": None,
+            },
+        )
+        self.assertEqual(set(RiskMetrics({}).calculate().values()), {None})
+
+
+class PriceCacheTests(TestCase):
+    """Prices expiring on a fake clock."""
+
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.cache = PriceCache(ttl=10, clock=lambda: self.now)
+
+    def test_prices_expire_after_ttl(self) -> None:
+        self.cache.set(1, Decimal("10.5"))
+        self.now = 5
+        self.cache.set(2, Decimal("20"))
+
+        self.now = 9.9
+        self.assertEqual(self.cache.snapshot(), {1: Decimal("10.5"), 2: Decimal("20")})
+
+        self.now = 10
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.snapshot(), {2: Decimal("20")})
+
+        # setting a price again renews it
+        self.cache.set(2, Decimal("21"))
+        self.now = 19.9
+        self.assertEqual(self.cache.get(2), Decimal("21"))
+        self.now = 25
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_drain_stores_waiting_prices(self) -> None:
+        prices: queue.Queue = queue.Queue()
+
+        for symbol_id in range(5):
+            prices.put((symbol_id, f"{symbol_id}.25"))
+
+        self.assertEqual(self.cache.drain(prices, limit=3), 3)
+        self.assertEqual(prices.qsize(), 2)
+        self.assertEqual(self.cache.drain(prices), 2)
+        self.assertEqual(self.cache.drain(prices), 0)
+        self.assertEqual(
+            self.cache.snapshot(),
+            {symbol_id: Decimal(f"{symbol_id}.25") for symbol_id in range(5)},
+        )
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import time
+from http.client import HTTPException
+from typing import Any, Callable, Dict, Optional
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+from zipfile import BadZipFile, ZipFile
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DataFileDownloader(object):
+    """
+    Streams a remote file to disk in chunks, resuming and revalidating between runs.
+
+    Progress is checkpointed in a `<target>.json` sidecar holding the validators
+    (ETag / Last-Modified) of the copy on disk.  A finished copy is revalidated with
+    a conditional GET and skipped when the server answers 304, an interrupted copy is
+    resumed with a Range request, and a fresh copy is only moved into place once its
+    sha256 (and zip CRCs, for archives) have been verified.
+
+    Args:
+        url (str): Location of the remote file.
+        target (str): Path the verified file is stored at.
+        checksum (Optional[str]): Expected sha256 hex digest, when known in advance.
+        chunk_size (int): Bytes read from the response per write.
+        retries (int): Attempts made before giving up on a transient failure.
+        backoff (float): Seconds waited before the first retry, doubled on each retry.
+        opener (Callable): Used to open requests, `urllib.request.urlopen` by default.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        target: str,
+        checksum: Optional[str] = None,
+        chunk_size: int = 64 * 1024,
+        retries: int = 3,
+        backoff: float = 1.0,
+        opener: Callable[..., Any] = urlopen,
+    ) -> None:
+        self.url = url
+        self.target = target
+        self.checksum = checksum
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.opener = opener
+
+    @property
+    def partial_file(self) -> str:
+        return f"{self.target}.part"
+
+    @property
+    def state_file(self) -> str:
+        return f"{self.target}.json"
+
+    def load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_file, "r") as handle:
+                state = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+        return state if state.get("url") == self.url else {}
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        state["url"] = self.url
+        with open(f"{self.state_file}.tmp", "w") as handle:
+            json.dump(state, handle)
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+    def fetch(self, force: bool = False) -> bool:
+        """
+        Brings the target up to date with the remote file.
+
+        Returns:
+            bool: True when new content was downloaded, False when the copy on disk is current.
+        """
+        os.makedirs(os.path.dirname(self.target) or ".", exist_ok=True)
+        delay = self.backoff
+
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self.attempt(force)
+            except (URLError, HTTPException, ConnectionError, TimeoutError) as error:
+                if isinstance(error, HTTPError) and error.code < 500:
+                    raise DownloadError(f"{self.url} returned HTTP {error.code}") from error
+                if attempt == self.retries:
+                    raise DownloadError(f"{self.url} failed after {attempt} attempts") from error
+                time.sleep(delay)
+                delay *= 2
+
+        return False
+
+    def attempt(self, force: bool) -> bool:
+        state = self.load_state()
+        headers: Dict[str, str] = {}
+        offset = 0
+
+        if state.get("complete") and os.path.exists(self.target) and not force:
+            if state.get("etag"):
+                headers["If-None-Match"] = state["etag"]
+            if state.get("last_modified"):
+                headers["If-Modified-Since"] = state["last_modified"]
+        elif not state.get("complete") and os.path.exists(self.partial_file):
+            offset = os.path.getsize(self.partial_file)
+            validator = state.get("etag") or state.get("last_modified")
+            if offset and validator:
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+            else:
+                offset = 0
+
+        try:
+            response = self.opener(Request(self.url, headers=headers))
+        except HTTPError as error:
+            if error.code == 304:
+                return False
+            if error.code == 416 and offset:
+                # The partial copy is no longer a prefix of the remote file.
+                self.discard()
+                return self.attempt(force)
+            raise
+
+        with response:
+            if getattr(response, "status", 200) != 206:
+                offset = 0
+
+            state = {
+                "complete": False,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            self.save_state(state)
+            digest = self.copy(response, offset)
+
+        self.verify(digest)
+        os.replace(self.partial_file, self.target)
+        state.update(complete=True, sha256=digest, size=os.path.getsize(self.target))
+        self.save_state(state)
+
+        return True
+
+    def copy(self, response: Any, offset: int) -> str:
+        digest = hashlib.sha256()
+
+        with open(self.partial_file, "r+b" if offset else "wb") as handle:
+            # Hash the prefix kept from a previous attempt before appending to it.
+            while handle.tell() < offset:
+                chunk = handle.read(min(self.chunk_size, offset - handle.tell()))
+                if not chunk:
+                    break
+                digest.update(chunk)
+            handle.truncate(offset)
+
+            while chunk := response.read(self.chunk_size):
+                handle.write(chunk)
+                digest.update(chunk)
+
+            length = response.headers.get("Content-Length")
+            if length is not None and handle.tell() - offset != int(length):
+                raise ConnectionError(f"{self.url} closed before sending {length} bytes")
+
+        return digest.hexdigest()
+
+    def verify(self, digest: str) -> None:
+        if self.checksum and digest != self.checksum.lower():
+            self.discard()
+            raise DownloadError(f"{self.url} checksum {digest} does not match {self.checksum}")
+
+        if not self.target.endswith(".zip"):
+            return
+
+        try:
+            with ZipFile(self.partial_file) as archive:
+                corrupt = archive.testzip()
+        except BadZipFile as error:
+            self.discard()
+            raise DownloadError(f"{self.url} is not a valid zip archive") from error
+
+        if corrupt is not None:
+            self.discard()
+            raise DownloadError(f"{self.url} failed the CRC check on {corrupt}")
+
+    def discard(self) -> None:
+        for path in (self.partial_file, self.state_file):
+            if os.path.exists(path):
+                os.remove(path)
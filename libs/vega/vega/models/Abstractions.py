@@ -1,3 +1,4 @@
+from datetime import timedelta
 from decimal import Decimal
 from typing import Optional, Self, TypeVar
 
@@ -55,6 +56,10 @@ class AbstractSymbol(CodeStub):
 
     frontmonth = models.CharField(max_length=1, null=True, blank=True)
 
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+
+    delisted_stamp = models.DateTimeField(null=True, blank=True)
+
     class Meta(CodeStub.Meta):
         app_label = AppNames.DATASET
         abstract = True
@@ -170,7 +175,25 @@ class AbstractPortfolio(CodeStub, EventBridgeStub):
 
     win_ratio = models.DecimalField(max_digits=5, decimal_places=2, null=True)
 
-    total_cagr = models.DecimalField(max_digits=5, decimal_places=2, null=True)
+    total_cagr = models.DecimalField(max_digits=9, decimal_places=2, null=True)
+
+    max_drawdown = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
+
+    max_drawdown_duration = models.DurationField(null=True, blank=True)
+
+    current_drawdown = models.DecimalField(max_digits=7, decimal_places=2, null=True, blank=True)
+
+    sharpe_ratio = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+
+    sortino_ratio = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+
+    calmar_ratio = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+
+    profit_factor = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
+
+    expectancy = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+
+    payoff_ratio = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True)
 
     total_wins = models.IntegerField(null=False, blank=False)
 
@@ -228,6 +251,8 @@ class AbstractPosition(models.Model, EventBridgeStub):
 
     unreal_pnl = models.DecimalField(blank=True, null=True, max_digits=9, decimal_places=2)
 
+    mark_price = models.DecimalField(blank=True, null=True, max_digits=9, decimal_places=2)
+
     duration = models.DurationField(null=True, blank=True)
 
     result_type = models.CharField(
@@ -418,8 +443,83 @@ class AbstractSubscription(models.Model, EventBridgeStub):
         return ""
 
 
+class AbstractPortfolioStatistic(models.Model):
+    """
+    Running totals of the closed positions of a portfolio with one result type.
+
+    Sums, sums of squares and counts are maintained by delta as positions change, the
+    bounds are recomputed whenever a position holding one of them is removed.
+    """
+
+    result_type = models.CharField(max_length=7, choices=constants.ResultType.choices)
+
+    position_count = models.IntegerField(default=0)
+
+    amount_sum = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal(0))
+
+    amount_sumsq = models.DecimalField(max_digits=24, decimal_places=4, default=Decimal(0))
+
+    amount_min = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+
+    amount_max = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+
+    duration_sum = models.DurationField(default=timedelta)
+
+    duration_min = models.DurationField(null=True, blank=True)
+
+    duration_max = models.DurationField(null=True, blank=True)
+
+    is_stale = models.BooleanField(default=False)
+
+    class Meta:
+        app_label = AppNames.TRACKRECORD
+        abstract = True
+        base_manager_name = "objects"
+
+    def __str__(self):
+        return self.result_type
+
+
+class AbstractPortfolioEquity(models.Model):
+    """
+    Account value of a portfolio at the end of one day.
+
+    Realized pnl is booked on the day a position is exited, the unrealized pnl of the
+    open positions is only known for the last day of the series.
+    """
+
+    stamp = models.DateField()
+
+    realized_pnl = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal(0))
+
+    unreal_pnl = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal(0))
+
+    equity = models.DecimalField(max_digits=15, decimal_places=2)
+
+    peak = models.DecimalField(max_digits=15, decimal_places=2)
+
+    peak_stamp = models.DateField()
+
+    drawdown = models.DecimalField(max_digits=9, decimal_places=6, default=Decimal(0))
+
+    class Meta:
+        app_label = AppNames.TRACKRECORD
+        abstract = True
+        ordering = ["stamp"]
+        base_manager_name = "objects"
+
+    def __str__(self):
+        return str(self.stamp)
+
+
 AbstractPermissionType = TypeVar("AbstractPermissionType", bound="AbstractPermission")
 AbstractPortfolioType = TypeVar("AbstractPortfolioType", bound="AbstractPortfolio")
+AbstractPortfolioEquityType = TypeVar(
+    "AbstractPortfolioEquityType", bound="AbstractPortfolioEquity"
+)
+AbstractPortfolioStatisticType = TypeVar(
+    "AbstractPortfolioStatisticType", bound="AbstractPortfolioStatistic"
+)
 AbstractSubscriptionType = TypeVar("AbstractSubscriptionType", bound="AbstractSubscription")
 AbstractSymbolType = TypeVar("AbstractSymbolType", bound="AbstractSymbol")
 AbstractTempSymbolType = TypeVar("AbstractTempSymbolType", bound="AbstractTempSymbol")
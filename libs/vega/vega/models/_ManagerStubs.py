@@ -1,10 +1,11 @@
 import os
-from io import BytesIO
-from urllib.request import urlopen
+from contextlib import contextmanager
+from typing import IO, Iterator
 from zipfile import ZipFile
 
 from django.db import models
 from django.db.backends.utils import CursorWrapper
+from vega.downloads import DataFileDownloader
 
 
 class ImportExportStub(object):
@@ -13,15 +14,35 @@ class ImportExportStub(object):
     insert_columns = []
     file_name = None
     download_url = None
+    download_file = None
+    download_checksum = None
     extract_folder = None
     extract_file = None
 
-    def download_data_file(self) -> None:
+    # Bytes handed to the server per COPY ... FROM STDIN round trip.
+    copy_buffer_size = 64 * 1024
+
+    def get_downloader(self) -> DataFileDownloader:
+        return DataFileDownloader(
+            str(self.download_url),
+            str(self.download_file),
+            checksum=self.download_checksum,
+            chunk_size=self.copy_buffer_size,
+        )
+
+    def fetch_data_file(self, force: bool = False) -> bool:
         if not self.download_url:
-            return None
-        response = urlopen(self.download_url)
-        zipfile = ZipFile(BytesIO(response.read()))
-        zipfile.extractall(path=self.extract_folder)
+            return False
+        return self.get_downloader().fetch(force)
+
+    def download_data_file(self, force: bool = False) -> bool:
+        if not self.download_url:
+            return False
+        changed = self.fetch_data_file(force)
+        with ZipFile(str(self.download_file)) as zipfile:
+            zipfile.extractall(path=self.extract_folder)
+
+        return changed
 
     def remove_data_file(self) -> None:
         if not self.file_name:
@@ -34,14 +55,74 @@ class ImportExportStub(object):
     def get_insert_columns(self) -> str:
         return ", ".join(self.insert_columns)
 
-    def import_from_file(self, cursor: CursorWrapper) -> None:
+    def import_from_file(self, cursor: CursorWrapper, table: str | None = None) -> None:
         sql = f"""
-            COPY {self.table_name} ({self.get_import_columns()})
+            COPY {table or self.table_name} ({self.get_import_columns()})
             FROM '{self.file_name}'
             DELIMITER E'\t' CSV HEADER;
         """
         cursor.execute(sql)
 
+    def import_from_stream(
+        self, cursor: CursorWrapper, stream: IO[bytes], table: str | None = None
+    ) -> None:
+        sql = f"""
+            COPY {table or self.table_name} ({self.get_import_columns()})
+            FROM STDIN
+            DELIMITER E'\t' CSV HEADER;
+        """
+        cursor.copy_expert(sql, stream, size=self.copy_buffer_size)
+
+    def stream_from_file(self, cursor: CursorWrapper, table: str | None = None) -> None:
+        with self.open_data_stream() as stream:
+            self.import_from_stream(cursor, stream, table)
+
+    def merge_from_file(self, cursor: CursorWrapper, stream: bool = False) -> None:
+        # Load into a scratch copy of the table and upsert from it so existing
+        # ids, and every row referencing them, survive the refresh.
+        incoming = f"{self.table_name}_incoming"
+        sql = f"""
+            DROP TABLE IF EXISTS {incoming};
+            CREATE TEMP TABLE {incoming} AS
+            SELECT {self.get_import_columns()} FROM {self.table_name} WITH NO DATA;
+        """
+        cursor.execute(sql)
+
+        if stream:
+            self.stream_from_file(cursor, incoming)
+        else:
+            self.import_from_file(cursor, incoming)
+
+        self.merge_from_temp(cursor, incoming)
+        cursor.execute(f"DROP TABLE {incoming};")
+
+    def merge_from_temp(self, cursor: CursorWrapper, source: str) -> None:
+        key, *columns = self.import_columns
+        current = ", ".join(f"{self.table_name}.{column}" for column in columns)
+        excluded = ", ".join(f"EXCLUDED.{column}" for column in columns)
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+        sql = f"""
+            INSERT INTO {self.table_name} ({self.get_import_columns()})
+            SELECT DISTINCT ON ({key}) {self.get_import_columns()}
+            FROM {source}
+            WHERE {key} IS NOT NULL
+            ON CONFLICT ({key}) DO UPDATE SET {assignments}
+            WHERE ({current}) IS DISTINCT FROM ({excluded});
+        """
+        cursor.execute(sql)
+
+    @contextmanager
+    def open_data_stream(self) -> Iterator[IO[bytes]]:
+        if not self.download_url:
+            with open(str(self.file_name), "rb") as stream:
+                yield stream
+            return
+
+        # The member is inflated lazily as COPY pulls from it and is never extracted.
+        with ZipFile(str(self.download_file)) as zipfile:
+            with zipfile.open(str(self.extract_file).lstrip("/")) as stream:
+                yield stream
+
     def export_to_file(self, cursor: CursorWrapper) -> None:
         sql = f"""
             COPY (select {self.get_import_columns()} from {self.table_name})
@@ -65,5 +146,7 @@ class ImportExportStub(object):
 
     @property
     def table_name(self) -> str:
-        # self.model._meta.db_table
-        raise Exception("table name not overridden")
+        model: type[models.Model] | None = getattr(self, "model", None)
+        if model is None:
+            raise Exception("table name not overridden")
+        return model._meta.db_table
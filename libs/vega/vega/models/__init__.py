@@ -1,7 +1,9 @@
 from typing import Optional, Self, cast
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import signals
+from django.dispatch import receiver
 from vega import constants
 from vega.models._managers import (
     ExchangeManager,
@@ -9,7 +11,9 @@ from vega.models._managers import (
     NaicsManager,
     OrderManager,
     PermissionManager,
+    PortfolioEquityManager,
     PortfolioManager,
+    PortfolioStatisticManager,
     PositionManager,
     SecurityManager,
     SicManager,
@@ -24,6 +28,8 @@ from vega.models.Abstractions import (
     AbstractOrder,
     AbstractPermission,
     AbstractPortfolio,
+    AbstractPortfolioEquity,
+    AbstractPortfolioStatistic,
     AbstractPosition,
     AbstractSecurity,
     AbstractSicCode,
@@ -131,6 +137,10 @@ class Portfolio(AbstractPortfolio):
 
     subscriptions: models.Manager["Subscription"]
 
+    statistics: PortfolioStatisticManager["PortfolioStatistic"]
+
+    equity: PortfolioEquityManager["PortfolioEquity"]
+
     objects = cast(PortfolioManager[Self], PortfolioManager())
 
 
@@ -156,6 +166,30 @@ class Position(AbstractPosition):
 
     orders: OrderManager["AbstractOrder"]
 
+    class Meta(AbstractPosition.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["_portfolio", "_symbol"],
+                condition=models.Q(position_status=constants.PositionStatus.OPEN),
+                name="unique_open_position",
+            )
+        ]
+        indexes = [
+            # closed positions of a portfolio in exit order (streaks, equity curve)
+            models.Index(
+                fields=["_portfolio", "exit_stamp", "id"],
+                condition=models.Q(position_status=constants.PositionStatus.CLOSED),
+                name="closed_position_exit_idx",
+            ),
+            # result totals and stats of the closed positions of a portfolio
+            models.Index(
+                fields=["_portfolio", "result_type"],
+                condition=models.Q(position_status=constants.PositionStatus.CLOSED),
+                include=["real_pnl", "duration"],
+                name="closed_position_result_idx",
+            ),
+        ]
+
     @property
     def symbol(self) -> Optional[AbstractSymbol]:
         return self._symbol
@@ -204,6 +238,17 @@ class Order(AbstractOrder):
 
     objects = cast(OrderManager[Self], OrderManager())
 
+    class Meta(AbstractOrder.Meta):
+        indexes = [
+            # entry / exit stats of positions from their filled orders
+            models.Index(
+                fields=["_position", "order_action", "filled_stamp"],
+                condition=models.Q(order_status=constants.OrderStatus.FILLED),
+                include=["filled_price", "filled_amount", "fees"],
+                name="filled_order_position_idx",
+            ),
+        ]
+
     @property
     def position(self) -> Optional[AbstractPosition]:
         return self._position
@@ -247,6 +292,42 @@ class Permission(AbstractPermission):
     objects = cast(PermissionManager[Self], PermissionManager())
 
 
+class PortfolioEquity(AbstractPortfolioEquity):
+
+    portfolio = models.ForeignKey(
+        Portfolio,
+        on_delete=models.CASCADE,
+        related_name="equity",
+        related_query_name=constants.ModelClass.PORTFOLIO,
+    )
+
+    objects = cast(PortfolioEquityManager[Self], PortfolioEquityManager())
+
+    class Meta(AbstractPortfolioEquity.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=["portfolio", "stamp"], name="unique_portfolio_stamp")
+        ]
+
+
+class PortfolioStatistic(AbstractPortfolioStatistic):
+
+    portfolio = models.ForeignKey(
+        Portfolio,
+        on_delete=models.CASCADE,
+        related_name="statistics",
+        related_query_name=constants.ModelClass.PORTFOLIO,
+    )
+
+    objects = cast(PortfolioStatisticManager[Self], PortfolioStatisticManager())
+
+    class Meta(AbstractPortfolioStatistic.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["portfolio", "result_type"], name="unique_portfolio_result_type"
+            )
+        ]
+
+
 class Subscription(AbstractSubscription):
 
     portfolio = models.ForeignKey(
@@ -264,3 +345,44 @@ class Subscription(AbstractSubscription):
     )
 
     objects = cast(SubscriptionManager[Self], SubscriptionManager())
+
+
+def deleted_with(origin: object, model: type[models.Model]) -> bool:
+    """
+    Whether a deletion was started on an instance or queryset of `model`.
+    """
+    if isinstance(origin, models.QuerySet):
+        return origin.model is model
+
+    return isinstance(origin, model)
+
+
+@receiver(signals.post_delete, sender=Position)
+def position_deleted(sender, instance: Position, origin: object = None, **kwargs) -> None:
+    # The statistics of a deleted portfolio are deleted with it.
+    if deleted_with(origin, Portfolio):
+        return
+
+    statistics = PortfolioStatistic.objects
+    statistics.apply_change(instance.portfolio, statistics.contribution(instance), None)
+
+
+@receiver(signals.post_delete, sender=Order)
+def order_deleted(sender, instance: Order, origin: object = None, **kwargs) -> None:
+    # Orders deleted along with their position (or its symbol or portfolio) leave
+    # nothing to recompute, the position receiver removes its contribution.
+    if not deleted_with(origin, Order):
+        return
+
+    with transaction.atomic():
+        # Serialized with the orders applied to the same position.
+        Position.objects.lock(getattr(instance, "_portfolio_id"), getattr(instance, "_symbol_id"))
+        position = Position.objects.filter(pk=getattr(instance, "_position_id")).first()
+
+        if position is None:
+            return
+        if position.orders.exists():
+            Position.objects.update_status(position)
+        else:
+            # A position without fills is no exposure at all.
+            position.delete()
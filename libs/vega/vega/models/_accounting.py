@@ -0,0 +1,181 @@
+import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Tuple
+
+from vega import constants
+
+# order action, filled stamp, filled price, filled amount and fees of a fill
+Fill = Tuple[str, datetime.datetime, Decimal, int, Decimal | None]
+
+
+class PositionAccount(object):
+    """
+    Average cost accounting of one position, replayed from its fills.
+
+    The side of the first fill is the entry.  Entry fills add to the open amount at a
+    volume weighted average cost, exit fills reduce it and realize the difference
+    between their price and that cost, signed by the trend (a short gains when the
+    exit price is lower).  Realized pnl is net of the exit fees and of the entry fees
+    of the closed amount, the entry fees of the amount still open are charged to the
+    unrealized pnl, so realized plus unrealized is the pnl net of every fee.
+
+    Exits beyond the open amount are not part of a position (`PositionMatcher` and
+    `OrderManager.apply` split fills crossing zero), only the open amount is realized
+    for them.
+
+    Args:
+        fills (Iterable[Fill]): Fills of the position sorted by stamp.
+    """
+
+    def __init__(self, fills: Iterable[Fill]) -> None:
+        self.entry: Dict[str, Any] = self.side()
+        self.exit: Dict[str, Any] = self.side()
+        self.open_amount = 0
+        self.cost = Decimal(0)
+        self.open_fees = Decimal(0)
+        self.realized: List[Decimal] = []
+        self.last_price: Decimal | None = None
+
+        for fill in fills:
+            self.add(*fill)
+
+    @staticmethod
+    def side() -> Dict[str, Any]:
+        return {
+            "action": None,
+            "count": 0,
+            "first": None,
+            "last": None,
+            "value": Decimal(0),
+            "amount": 0,
+            "fees": Decimal(0),
+        }
+
+    @property
+    def direction(self) -> int:
+        return -1 if self.entry["action"] == constants.OrderAction.SELL else 1
+
+    def add(
+        self,
+        action: str,
+        stamp: datetime.datetime,
+        price: Decimal,
+        amount: int,
+        fees: Decimal | None = None,
+    ) -> None:
+        fees = Decimal(fees or 0)
+        self.entry["action"] = self.entry["action"] or action
+        side = self.entry if action == self.entry["action"] else self.exit
+        side["action"] = action
+        side["count"] += 1
+        side["first"] = side["first"] or stamp
+        side["last"] = stamp
+        side["value"] += price * amount
+        side["amount"] += amount
+        side["fees"] += fees
+        self.last_price = price
+
+        if side is self.entry:
+            total = self.open_amount + amount
+            if total:
+                self.cost = (self.cost * self.open_amount + price * amount) / total
+            self.open_amount = total
+            self.open_fees += fees
+            return
+
+        closed = min(amount, self.open_amount)
+        entry_fees = self.open_fees * closed / self.open_amount if self.open_amount else 0
+        gross = (price - self.cost) * closed * self.direction
+        self.realized.append(gross - fees - entry_fees)
+        self.open_fees -= entry_fees
+        self.open_amount -= closed
+
+    @staticmethod
+    def average(side: Dict[str, Any]) -> Decimal | None:
+        return side["value"] / side["amount"] if side["amount"] else None
+
+    @property
+    def real_pnl(self) -> Decimal | None:
+        return sum(self.realized, Decimal(0)) if self.realized else None
+
+    def unreal_pnl(self, mark: Decimal | None = None) -> Decimal | None:
+        """
+        Unrealized pnl of the open amount, marked at `mark` or the last fill price.
+        """
+        if not self.open_amount:
+            return Decimal(0) if self.entry["action"] else None
+
+        mark = self.last_price if mark is None else Decimal(mark)
+        gross = (mark - self.cost) * self.open_amount * self.direction
+
+        return gross - self.open_fees
+
+    @classmethod
+    def from_totals(
+        cls, totals: Dict[str, Any], mark: Decimal | None = None
+    ) -> Dict[str, Any] | None:
+        """
+        The `stats` of a position from its `OrderQuerySet.order_stats`, without its fills.
+
+        Realized pnl only depends on the side totals once a position is closed (every
+        exit realizes against the same average cost then), the unrealized pnl of a
+        position without exits only on the entry totals and `mark`.  None is returned
+        for every other position, its fills have to be replayed.
+        """
+        entry_amount = totals["entry_amount"] or 0
+        exit_amount = totals["exit_amount"] or 0
+        direction = -1 if totals["entry_action"] == constants.OrderAction.SELL else 1
+        stats: Dict[str, Any] = {
+            **totals,
+            "open_amount": entry_amount - exit_amount,
+            "mark_price": None,
+            "average_cost": None,
+            "realized": [],
+            "real_pnl": None,
+            "unreal_pnl": Decimal(0),
+        }
+
+        if exit_amount and exit_amount == entry_amount:
+            gross = (totals["exit_price"] - totals["entry_price"]) * exit_amount * direction
+            stats["real_pnl"] = gross - totals["entry_fees"] - totals["exit_fees"]
+            stats["realized"] = [stats["real_pnl"]]
+            return stats
+
+        if exit_amount or mark is None:
+            return None
+
+        mark = Decimal(mark).quantize(Decimal("0.01"))
+        gross = (mark - totals["entry_price"]) * entry_amount * direction
+        stats["mark_price"] = mark
+        stats["average_cost"] = totals["entry_price"]
+        stats["unreal_pnl"] = gross - totals["entry_fees"]
+
+        return stats
+
+    def stats(self, mark: Decimal | None = None) -> Dict[str, Any]:
+        """
+        Entry and exit of the position, named like `OrderQuerySet.order_stats`, with
+        its realized and unrealized pnl.
+        """
+        if self.open_amount:
+            mark = self.last_price if mark is None else Decimal(mark).quantize(Decimal("0.01"))
+
+        stats: Dict[str, Any] = {
+            "open_amount": self.open_amount,
+            "mark_price": mark if self.open_amount else None,
+            "average_cost": self.cost if self.open_amount else None,
+            "realized": list(self.realized),
+            "real_pnl": self.real_pnl,
+            "unreal_pnl": self.unreal_pnl(mark),
+        }
+
+        for prefix, side, stamp in (("entry", self.entry, "first"), ("exit", self.exit, "last")):
+            has_fills = bool(side["count"])
+            stats[f"{prefix}_action"] = side["action"]
+            stats[f"{prefix}_count"] = side["count"] if has_fills else None
+            stats[f"{prefix}_stamp"] = side[stamp]
+            stats[f"{prefix}_price"] = self.average(side)
+            stats[f"{prefix}_amount"] = side["amount"] if has_fills else None
+            stats[f"{prefix}_fees"] = side["fees"] if has_fills else None
+
+        return stats
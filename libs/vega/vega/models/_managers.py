@@ -1,17 +1,31 @@
+import copy
 import datetime
-
-from django.db import models
-
-# from django_cte import CTEManager, CTEQuerySet
+import pathlib
+import uuid
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+from django.db import connections, models, transaction
+from django.db.backends.utils import CursorWrapper
+from django.db.models import ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Greatest, Least
+from django.db.transaction import TransactionManagementError
 from vega import constants
+from vega.models._accounting import PositionAccount
+from vega.models._exporters import FORMATS, ColumnarExporter
 from vega.models._ManagerStubs import ImportExportStub
+from vega.models._matching import OpenLot, PositionMatcher
+from vega.models._metrics import RiskMetrics
+from vega.models._prices import PriceCache
 from vega.models._querysets import (
     ExchangeQuerySet,
     MarketQuerySet,
     NaicsQuerySet,
     OrderQuerySet,
     PermissionQuerySet,
+    PortfolioEquityQuerySet,
     PortfolioQuerySet,
+    PortfolioStatisticQuerySet,
     PositionQuerySet,
     SecurityQuerySet,
     SicQuerySet,
@@ -19,6 +33,8 @@ from vega.models._querysets import (
     SymbolQuerySet,
     TempSymbolQuerySet,
 )
+from vega.models._resolvers import SymbolResolver
+from vega.models._statements import PROFILES, StatementImporter, open_statement
 from vega.models.Abstractions import (
     AbstractExchangeType,
     AbstractMarketType,
@@ -27,6 +43,9 @@ from vega.models.Abstractions import (
     AbstractOrderType,
     AbstractPermissionType,
     AbstractPortfolio,
+    AbstractPortfolioEquityType,
+    AbstractPortfolioStatistic,
+    AbstractPortfolioStatisticType,
     AbstractPortfolioType,
     AbstractPosition,
     AbstractPositionType,
@@ -37,453 +56,797 @@ from vega.models.Abstractions import (
     AbstractTempSymbolType,
 )
 
-# import pprint
-
-
-# from django.db.models import OuterRef, Subquery
+# result type, amount and duration a closed position adds to the portfolio statistics
+Contribution = Tuple[str, Decimal, datetime.timedelta]
 
 
 class PermissionManager(models.Manager[AbstractPermissionType]):
 
-    def default_owner_permissions(self, portfolio: AbstractPortfolio):
+    collection_groups = {
+        constants.CollectionName.PORTFOLIO: constants.CollectionGroup.PORTFOLIOS,
+        constants.CollectionName.PERMISSION: constants.CollectionGroup.PERMISSIONS,
+        constants.CollectionName.SUBSCRIPTION: constants.CollectionGroup.SUBSCRIPTIONS,
+        constants.CollectionName.OPEN_POSITION: constants.CollectionGroup.POSITIONS,
+        constants.CollectionName.CLOSED_POSITION: constants.CollectionGroup.POSITIONS,
+        constants.CollectionName.FILLED_ORDER: constants.CollectionGroup.ORDERS,
+        constants.CollectionName.PARTIAL_ORDER: constants.CollectionGroup.ORDERS,
+        constants.CollectionName.PENDING_ORDER: constants.CollectionGroup.ORDERS,
+        constants.CollectionName.CANCELLED_ORDER: constants.CollectionGroup.ORDERS,
+    }
+
+    # position and order collections, granted alike
+    records = [
+        collection
+        for collection, group in collection_groups.items()
+        if group in (constants.CollectionGroup.POSITIONS, constants.CollectionGroup.ORDERS)
+    ]
+
+    # actions of every role on every collection
+    template = {
+        constants.RoleType.OWNER: {
+            constants.CollectionName.PORTFOLIO: constants.ALL_ACTIONS,
+            constants.CollectionName.PERMISSION: constants.NO_CREATE_OR_DELETE_ACTIONS,
+            constants.CollectionName.SUBSCRIPTION: constants.ALL_ACTIONS,
+            **dict.fromkeys(records, constants.ALL_ACTIONS),
+        },
+        constants.RoleType.ADMIN: {
+            constants.CollectionName.PORTFOLIO: constants.NO_CREATE_OR_DELETE_ACTIONS,
+            constants.CollectionName.PERMISSION: constants.NO_CREATE_OR_DELETE_ACTIONS,
+            constants.CollectionName.SUBSCRIPTION: constants.ALL_ACTIONS,
+            **dict.fromkeys(records, constants.ALL_ACTIONS),
+        },
+        constants.RoleType.SUBSCRIBER: {
+            constants.CollectionName.PORTFOLIO: constants.READ_ONLY_ACTIONS,
+            constants.CollectionName.PERMISSION: constants.READ_ONLY_ACTIONS,
+            constants.CollectionName.SUBSCRIPTION: constants.NO_ACTIONS,
+            **dict.fromkeys(records, constants.READ_ONLY_ACTIONS),
+        },
+        constants.RoleType.GUEST: {
+            constants.CollectionName.PORTFOLIO: constants.READ_ONLY_ACTIONS,
+            constants.CollectionName.PERMISSION: constants.READ_ONLY_ACTIONS,
+            constants.CollectionName.SUBSCRIPTION: constants.NO_ACTIONS,
+            **dict.fromkeys(records, constants.NO_ACTIONS),
+        },
+    }
+
+    @staticmethod
+    def is_enabled(portfolio: AbstractPortfolio, role: str, group: str) -> bool:
+        """
+        Whether a permission is enabled for the allowed roles and record type of a portfolio.
+
+        Orders are only enabled for portfolios recording orders.
+        """
+        if group == constants.CollectionGroup.ORDERS:
+            if portfolio.record_type != constants.RecordType.ORDER:
+                return False
+
+        return role in (portfolio.allowed_roles or [])
+
+    def build_permissions(
+        self, portfolio: AbstractPortfolio, roles: Iterable[str] | None = None
+    ) -> List[AbstractPermissionType]:
+        """
+        Unsaved permissions of a portfolio from the template, for all roles when omitted.
+        """
         items = []
 
-        # Portfolio owner permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PORTFOLIO,
-                group=constants.CollectionGroup.PORTFOLIOS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        for role in roles or self.template:
+            for collection, actions in self.template[role].items():
+                group = self.collection_groups[collection]
+                items.append(
+                    self.model(
+                        collection=collection,
+                        group=group,
+                        role=role,
+                        actions=list(actions),
+                        enabled=self.is_enabled(portfolio, role, group),
+                        portfolio=portfolio,
+                    )
+                )
 
-        # Permission owner permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PERMISSION,
-                group=constants.CollectionGroup.PERMISSIONS,
-                role=constants.RoleType.OWNER,
-                actions=constants.NO_CREATE_OR_DELETE_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        return items
 
-        # Subscription owner permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.SUBSCRIPTION,
-                group=constants.CollectionGroup.SUBSCRIPTIONS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
+    def provision(
+        self,
+        portfolios: Iterable[AbstractPortfolio],
+        roles: Iterable[str] | None = None,
+        batch_size: int = 1000,
+    ) -> List[AbstractPermissionType]:
+        """
+        Creates the template permissions of many portfolios with one `bulk_create`.
+
+        Args:
+            portfolios (Iterable[AbstractPortfolio]): Saved portfolios to provision.
+            roles (Iterable[str] | None): Roles to provision, all when omitted.
+            batch_size (int): Permissions written per INSERT statement.
+
+        Returns:
+            List[AbstractPermissionType]: The created permissions.
+        """
+        roles = list(roles or self.template)
+        items = [
+            item for portfolio in portfolios for item in self.build_permissions(portfolio, roles)
+        ]
+
+        return self.bulk_create(items, batch_size=batch_size)
+
+    def sync(self, portfolio_ids: Iterable[int]) -> List[int]:
+        """
+        Re-evaluates the enabled flag of the permissions of many portfolios in one UPDATE.
+
+        Applies the rule of `is_enabled` in SQL, joining every permission to its
+        portfolio and testing `allowed_roles` for containment of the role.  Only rows
+        whose flag changes are written.
+
+        Args:
+            portfolio_ids (Iterable[int]): Portfolios whose permissions are synced.
+
+        Returns:
+            List[int]: Ids of the portfolios with at least one permission changed.
+        """
+        permissions = self.model._meta.db_table
+        portfolios = self.model._meta.get_field("portfolio").related_model._meta.db_table
+        enabled = """
+            COALESCE(portfolio.allowed_roles @> ARRAY[p.role], FALSE)
+            AND (p."group" <> %(orders)s OR portfolio.record_type = %(order)s)
+        """
+        sql = f"""
+            WITH updated AS (
+                UPDATE {permissions} p
+                SET enabled = {enabled}
+                FROM {portfolios} portfolio
+                WHERE portfolio.id = p.portfolio_id
+                    AND portfolio.id = ANY(%(ids)s)
+                    AND p.enabled IS DISTINCT FROM ({enabled})
+                RETURNING p.portfolio_id
             )
-        )
+            SELECT DISTINCT portfolio_id FROM updated;
+        """
+        params = {
+            "ids": list(portfolio_ids),
+            "orders": constants.CollectionGroup.ORDERS,
+            "order": constants.RecordType.ORDER,
+        }
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [portfolio_id for (portfolio_id,) in cursor.fetchall()]
 
-        # Position owner permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.OPEN_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def default_owner_permissions(self, portfolio: AbstractPortfolio):
+        return self.provision([portfolio], [constants.RoleType.OWNER])
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CLOSED_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def default_admin_permissions(self, portfolio: AbstractPortfolio):
+        return self.provision([portfolio], [constants.RoleType.ADMIN])
 
-        # Order order permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.FILLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def default_subscription_permissions(self, portfolio: AbstractPortfolio):
+        return self.provision([portfolio], [constants.RoleType.SUBSCRIBER])
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PARTIAL_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def default_guest_permissions(self, portfolio: AbstractPortfolio):
+        return self.provision([portfolio], [constants.RoleType.GUEST])
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PENDING_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def get_queryset(self) -> PermissionQuerySet[AbstractPermissionType]:
+        return PermissionQuerySet(model=self.model, using=self._db)
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CANCELLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.OWNER,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
 
-        return items
+class PortfolioEquityManager(models.Manager[AbstractPortfolioEquityType]):
 
-    def default_admin_permissions(self, portfolio: AbstractPortfolio):
-        items = []
+    metric_fields = ["total_cagr", "max_drawdown", "max_drawdown_duration", "current_drawdown"]
 
-        # Portfolio admin permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PORTFOLIO,
-                group=constants.CollectionGroup.PORTFOLIOS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.NO_CREATE_OR_DELETE_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def rebuild(self, portfolio: AbstractPortfolio, since: datetime.datetime | None = None) -> int:
+        """
+        Rebuilds the daily equity curve of a portfolio and the metrics derived from it.
 
-        # Permission admin permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PERMISSION,
-                group=constants.CollectionGroup.PERMISSIONS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.NO_CREATE_OR_DELETE_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        The curve runs from the first entry to today.  Equity is the initial capital
+        plus the realized pnl of every position exited up to that day, plus the
+        unrealized pnl of the open positions on the last day.  Peaks and drawdowns
+        are window functions over the series, so the whole curve is written with one
+        INSERT.  CAGR, max drawdown, the longest time under water and the current
+        drawdown (all in percent) are then read back from the stored curve into the
+        portfolio.
 
-        # Subscription admin permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.SUBSCRIPTION,
-                group=constants.CollectionGroup.SUBSCRIPTIONS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        With `since` only the days from then on (and at least the last stored day) are
+        rewritten, continuing the equity and peak of the day before.  The whole curve
+        is rebuilt when it does not have that day.
 
-        # Position admin permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.OPEN_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
+        Returns:
+            int: Number of days written.
+        """
+        positions = getattr(portfolio, "positions").model._meta.db_table
+        table = self.model._meta.db_table
+        columns = (
+            "portfolio_id, stamp, realized_pnl, unreal_pnl, equity, peak, peak_stamp, drawdown"
         )
-
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CLOSED_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
+        params = {
+            "portfolio": portfolio.pk,
+            "capital": portfolio.initial_capital,
+            "open": constants.PositionStatus.OPEN,
+            "closed": constants.PositionStatus.CLOSED,
+            "start": None,
+            "base": portfolio.initial_capital,
+            "peak": None,
+            "peak_stamp": None,
+        }
+        # The day before the rewritten ones, never the last day (its unrealized pnl
+        # is not carried over).
+        seed = f"""
+            SELECT stamp, equity - unreal_pnl, peak, peak_stamp
+            FROM {table}
+            WHERE portfolio_id = %(portfolio)s AND stamp = LEAST(
+                %(since)s::DATE, (SELECT MAX(stamp) FROM {table} WHERE portfolio_id = %(portfolio)s)
+            ) - 1;
+        """
+        insert = f"""
+            WITH daily AS (
+                SELECT exit_stamp::date AS stamp, SUM(real_pnl) AS realized_pnl
+                FROM {positions}
+                WHERE _portfolio_id = %(portfolio)s AND position_status = %(closed)s
+                    AND real_pnl IS NOT NULL
+                    AND exit_stamp >= COALESCE(%(start)s::DATE, '-infinity'::DATE)
+                GROUP BY 1
+            ),
+            marked AS (
+                SELECT COALESCE(SUM(unreal_pnl), 0) AS unreal_pnl
+                FROM {positions}
+                WHERE _portfolio_id = %(portfolio)s AND position_status = %(open)s
+            ),
+            days AS (
+                SELECT day::date AS stamp
+                FROM GENERATE_SERIES(
+                    COALESCE(
+                        %(start)s::DATE,
+                        (SELECT MIN(entry_stamp)::date FROM {positions}
+                            WHERE _portfolio_id = %(portfolio)s)
+                    ),
+                    GREATEST(CURRENT_DATE, (SELECT MAX(stamp) FROM daily)),
+                    INTERVAL '1 day'
+                ) AS day
+            ),
+            curve AS (
+                SELECT
+                    days.stamp,
+                    COALESCE(daily.realized_pnl, 0) AS realized_pnl,
+                    CASE
+                        WHEN days.stamp = MAX(days.stamp) OVER () THEN marked.unreal_pnl ELSE 0
+                    END AS unreal_pnl,
+                    %(base)s + SUM(COALESCE(daily.realized_pnl, 0)) OVER (ORDER BY days.stamp)
+                        AS realized_equity
+                FROM days
+                LEFT JOIN daily ON daily.stamp = days.stamp
+                CROSS JOIN marked
+            ),
+            peaks AS (
+                SELECT
+                    *,
+                    realized_equity + unreal_pnl AS equity,
+                    GREATEST(
+                        %(peak)s::NUMERIC,
+                        MAX(realized_equity + unreal_pnl) OVER (ORDER BY stamp)
+                    ) AS peak
+                FROM curve
             )
-        )
+            INSERT INTO {table} ({columns})
+            SELECT
+                %(portfolio)s,
+                stamp,
+                realized_pnl,
+                unreal_pnl,
+                equity,
+                peak,
+                COALESCE(
+                    MAX(stamp) FILTER (WHERE equity >= peak) OVER (ORDER BY stamp),
+                    %(peak_stamp)s::DATE
+                ),
+                CASE WHEN peak > 0 THEN equity / peak - 1 ELSE 0 END
+            FROM peaks;
+        """
+        # CAGR of histories shorter than a year is their plain return.
+        metrics = f"""
+            UPDATE {portfolio._meta.db_table} portfolio
+            SET
+                total_cagr = metrics.total_cagr,
+                max_drawdown = metrics.max_drawdown,
+                max_drawdown_duration = metrics.max_drawdown_duration,
+                current_drawdown = metrics.current_drawdown
+            FROM (
+                SELECT
+                    CASE
+                        WHEN %(capital)s <= 0 THEN NULL
+                        WHEN last.equity <= 0 THEN -100
+                        ELSE (
+                            POWER(
+                                last.equity / %(capital)s,
+                                365.25 / GREATEST(last.stamp - first.stamp, 365.25)
+                            ) - 1
+                        ) * 100
+                    END AS total_cagr,
+                    curve.max_drawdown * 100 AS max_drawdown,
+                    curve.max_drawdown_duration,
+                    last.drawdown * 100 AS current_drawdown
+                FROM (
+                    SELECT
+                        MIN(drawdown) AS max_drawdown,
+                        MAX(stamp - peak_stamp) * INTERVAL '1 day' AS max_drawdown_duration
+                    FROM {self.model._meta.db_table}
+                    WHERE portfolio_id = %(portfolio)s
+                ) curve
+                LEFT JOIN LATERAL (
+                    SELECT stamp, equity, drawdown FROM {self.model._meta.db_table}
+                    WHERE portfolio_id = %(portfolio)s ORDER BY stamp DESC LIMIT 1
+                ) last ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT stamp FROM {self.model._meta.db_table}
+                    WHERE portfolio_id = %(portfolio)s ORDER BY stamp LIMIT 1
+                ) first ON TRUE
+            ) metrics
+            WHERE portfolio.id = %(portfolio)s
+            RETURNING {", ".join(f"portfolio.{field}" for field in self.metric_fields)};
+        """
+
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            curve = self.get_queryset().filter(portfolio=portfolio)
+
+            if since is not None:
+                cursor.execute(seed, {**params, "since": since})
+
+                if row := cursor.fetchone():
+                    stamp, params["base"], params["peak"], params["peak_stamp"] = row
+                    params["start"] = stamp + datetime.timedelta(days=1)
+                    curve = curve.filter(stamp__gte=params["start"])
+
+            curve.delete()
+            cursor.execute(insert, params)
+            days = cursor.rowcount
+            cursor.execute(metrics, params)
+            values = cursor.fetchone()
+
+        for field, value in zip(self.metric_fields, values):
+            setattr(portfolio, field, value)
+
+        return days
+
+    def get_queryset(self) -> PortfolioEquityQuerySet[AbstractPortfolioEquityType]:
+        return PortfolioEquityQuerySet(model=self.model, using=self._db)
+
+
+class PortfolioStatisticManager(models.Manager[AbstractPortfolioStatisticType]):
+
+    result_types = [
+        constants.ResultType.WIN,
+        constants.ResultType.LOSS,
+        constants.ResultType.WASH,
+    ]
 
-        # Order admin permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.FILLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    total_fields = [
+        "position_count",
+        "amount_sum",
+        "amount_sumsq",
+        "amount_min",
+        "amount_max",
+        "duration_sum",
+        "duration_min",
+        "duration_max",
+    ]
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PARTIAL_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    summary_fields = [
+        "amount_avg",
+        "amount_min",
+        "amount_max",
+        "amount_cnt",
+        "amount_stdev",
+        "amount_sum",
+        "duration_avg",
+        "duration_min",
+        "duration_max",
+    ]
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PENDING_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def contribution(self, position: AbstractPosition) -> Contribution | None:
+        """
+        What a position adds to the statistics of its portfolio, None when it adds nothing.
+        """
+        if position.position_status != constants.PositionStatus.CLOSED:
+            return None
+        if position.result_type not in self.result_types:
+            return None
+        if position.real_pnl is None or position.duration is None:
+            return None
+
+        # Totals are kept of the stored (rounded) amount.
+        amount = Decimal(position.real_pnl).quantize(Decimal("0.01"))
+
+        return (position.result_type, amount, position.duration)
+
+    def apply_change(
+        self,
+        portfolio: AbstractPortfolio,
+        previous: Contribution | None,
+        current: Contribution | None,
+    ) -> None:
+        """
+        Moves a position's contribution from `previous` to `current` by delta.
+
+        Sums and counts are adjusted in place.  Removing a value that is one of the
+        bounds marks the row stale and its result type is rebuilt, as is the whole
+        portfolio when its rows have not been built yet.
+        """
+        if previous == current:
+            return
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CANCELLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.ADMIN,
-                actions=constants.ALL_ACTIONS,
-                portfolio=portfolio,
+        self.lock(portfolio)
+        qs = self.get_queryset().filter(portfolio=portfolio)
+        updated = 1
+
+        if previous:
+            result_type, amount, duration = previous
+            is_bound = (
+                Q(is_stale=True)
+                | Q(amount_min=amount)
+                | Q(amount_max=amount)
+                | Q(duration_min=duration)
+                | Q(duration_max=duration)
+            )
+            updated = qs.filter(result_type=result_type).update(
+                position_count=F("position_count") - 1,
+                amount_sum=F("amount_sum") - amount,
+                amount_sumsq=F("amount_sumsq") - amount * amount,
+                duration_sum=F("duration_sum") - duration,
+                is_stale=ExpressionWrapper(is_bound, output_field=models.BooleanField()),
             )
-        )
 
-        return items
+        if current and updated:
+            result_type, amount, duration = current
+            updated = qs.filter(result_type=result_type).update(
+                position_count=F("position_count") + 1,
+                amount_sum=F("amount_sum") + amount,
+                amount_sumsq=F("amount_sumsq") + amount * amount,
+                amount_min=Least(F("amount_min"), Value(amount)),
+                amount_max=Greatest(F("amount_max"), Value(amount)),
+                duration_sum=F("duration_sum") + duration,
+                duration_min=Least(F("duration_min"), Value(duration)),
+                duration_max=Greatest(F("duration_max"), Value(duration)),
+            )
 
-    def default_subscription_permissions(self, portfolio: AbstractPortfolio):
-        items = []
+        if not updated:
+            self.rebuild(portfolio)
+        elif stale := list(qs.stale_statistics().values_list("result_type", flat=True)):
+            self.rebuild(portfolio, stale)
 
-        # Portfolio subscriber permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PORTFOLIO,
-                group=constants.CollectionGroup.PORTFOLIOS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def lock(self, portfolio: AbstractPortfolio) -> None:
+        """
+        Serializes changes to the totals of a portfolio until the transaction ends.
 
-        # Permission subscriber permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PERMISSION,
-                group=constants.CollectionGroup.PERMISSIONS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        Without it a rebuild reading the positions could overwrite a delta committed by
+        a concurrent transaction after the read.  The advisory lock uses the single key
+        space, apart from the position locks taken by `PositionManager.lock`.
+        """
+        if not connections[self.db].in_atomic_block:
+            return
 
-        # Subscription subscriber permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.SUBSCRIPTION,
-                group=constants.CollectionGroup.SUBSCRIPTIONS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s);", [portfolio.pk])
 
-        # Position subscriber permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.OPEN_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
+    def rebuild(self, portfolio: AbstractPortfolio, result_types: List[str] | None = None) -> None:
+        """
+        Recomputes the totals of a portfolio (or some of its result types) from its positions.
+        """
+        self.lock(portfolio)
+        result_types = result_types or self.result_types
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+        qs = positions.get_queryset().filter(result_type__in=result_types)
+        totals = qs.result_totals()
+        rows = [
+            self.model(portfolio=portfolio, result_type=result_type, **totals.get(result_type, {}))
+            for result_type in result_types
+        ]
+
+        self.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["portfolio", "result_type"],
+            update_fields=[*self.total_fields, "is_stale"],
         )
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CLOSED_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def inconsistencies(
+        self, portfolio: AbstractPortfolio
+    ) -> Dict[str, Dict[str, Tuple[Any, Any]]]:
+        """
+        Compares the stored totals of a portfolio with totals computed from its positions.
 
-        # Order subscriber permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.FILLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
+        Returns:
+            Dict[str, Dict[str, Tuple[Any, Any]]]: Stored and expected value of every
+                field that differs, keyed by result type.
+        """
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+        totals = positions.get_queryset().result_totals()
+        stored = {row.result_type: row for row in self.get_queryset().filter(portfolio=portfolio)}
+        # A result type without a row (or positions) has the default, empty totals.
+        empty = self.model()
+        mismatches: Dict[str, Dict[str, Tuple[Any, Any]]] = {}
+
+        for result_type in self.result_types:
+            row = stored.get(result_type, empty)
+
+            for field in self.total_fields:
+                value = getattr(row, field)
+                target = totals.get(result_type, {}).get(field, getattr(empty, field))
+
+                if value != target:
+                    mismatches.setdefault(result_type, {})[field] = (value, target)
+
+        return mismatches
+
+    def totals(self, portfolio: AbstractPortfolio) -> Dict[str, Dict[str, Any]]:
+        """
+        Stored totals of a portfolio per result type, from its positions when stale.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Totals keyed by result type, shaped like
+                `PositionQuerySet.result_totals`.
+        """
+        rows = list(self.get_queryset().filter(portfolio=portfolio))
+
+        if len(rows) < len(self.result_types) or any(row.is_stale for row in rows):
+            positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+            return positions.get_queryset().result_totals()
+
+        return {
+            row.result_type: {field: getattr(row, field) for field in self.total_fields}
+            for row in rows
+        }
+
+    def summary(self, portfolio: AbstractPortfolio) -> Dict[str, Dict[str, Any]] | None:
+        """
+        Amount and duration statistics of a portfolio per result type, from the stored totals.
+
+        Returns:
+            Dict[str, Dict[str, Any]] | None: Statistics keyed by result type, shaped like
+                `PositionQuerySet.calculate_all_stats`.  None when the totals of the
+                portfolio have not been built or are stale.
+        """
+        rows = list(self.get_queryset().filter(portfolio=portfolio))
+
+        if len(rows) < len(self.result_types) or any(row.is_stale for row in rows):
+            return None
+
+        return {row.result_type: self.describe(row) for row in rows}
+
+    def describe(self, row: AbstractPortfolioStatistic) -> Dict[str, Any]:
+        count = row.position_count
+        stats: Dict[str, Any] = dict.fromkeys(self.summary_fields)
+        stats["amount_cnt"] = count
+
+        if not count:
+            return stats
+
+        mean = row.amount_sum / count
+        variance = max(row.amount_sumsq / count - mean * mean, Decimal(0))
+        stats.update(
+            amount_avg=mean,
+            amount_min=row.amount_min,
+            amount_max=row.amount_max,
+            amount_stdev=variance.sqrt(),
+            amount_sum=row.amount_sum,
+            duration_avg=row.duration_sum / count,
+            duration_min=row.duration_min,
+            duration_max=row.duration_max,
         )
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PARTIAL_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        return stats
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PENDING_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+    def get_queryset(self) -> PortfolioStatisticQuerySet[AbstractPortfolioStatisticType]:
+        return PortfolioStatisticQuerySet(model=self.model, using=self._db)
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CANCELLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.SUBSCRIBER,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
 
-        return items
+class PortfolioManager(models.Manager[AbstractPortfolioType]):
 
-    def default_guest_permissions(self, portfolio: AbstractPortfolio):
-        items = []
+    stats_fields = [
+        "avg_profit_amount",
+        "smallest_profit_amount",
+        "largest_profit_amount",
+        "avg_loss_amount",
+        "smallest_loss_amount",
+        "largest_loss_amount",
+        "avg_win_duration",
+        "avg_loss_duration",
+        "avg_wash_duration",
+        "shortest_win_duration",
+        "shortest_loss_duration",
+        "shortest_wash_duration",
+        "largest_win_duration",
+        "largest_loss_duration",
+        "largest_wash_duration",
+        "total_wins",
+        "total_losses",
+        "total_washes",
+        "total_trades",
+    ]
 
-        # Portfolio guest permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PORTFOLIO,
-                group=constants.CollectionGroup.PORTFOLIOS,
-                role=constants.RoleType.GUEST,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
+    def update_stats(self, portfolio: AbstractPortfolio) -> None:
+        statistics: PortfolioStatisticManager[AbstractPortfolioStatistic] = getattr(
+            portfolio, "statistics"
         )
+        summary = statistics.summary(portfolio)
 
-        # Permission guest permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PERMISSION,
-                group=constants.CollectionGroup.PERMISSIONS,
-                role=constants.RoleType.GUEST,
-                actions=constants.READ_ONLY_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        if summary is None:
+            positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+            summary = positions.get_queryset().closed_positions().calculate_all_stats()
 
-        # Subscription guest permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.SUBSCRIPTION,
-                group=constants.CollectionGroup.SUBSCRIPTIONS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        profits = summary.get(constants.ResultType.WIN, {})
+        losses = summary.get(constants.ResultType.LOSS, {})
+        washes = summary.get(constants.ResultType.WASH, {})
 
-        # Position guest permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.OPEN_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        portfolio.avg_profit_amount = profits.get(PositionQuerySet.AMOUNT_AVG, 0)
+        portfolio.smallest_profit_amount = profits.get(PositionQuerySet.AMOUNT_MIN, 0)
+        portfolio.largest_profit_amount = profits.get(PositionQuerySet.AMOUNT_MAX, 0)
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CLOSED_POSITION,
-                group=constants.CollectionGroup.POSITIONS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        portfolio.avg_loss_amount = losses.get(PositionQuerySet.AMOUNT_AVG, 0)
+        portfolio.smallest_loss_amount = losses.get(PositionQuerySet.AMOUNT_MIN, 0)
+        portfolio.largest_loss_amount = losses.get(PositionQuerySet.AMOUNT_MAX, 0)
 
-        # Order guest permissions
-        items.append(
-            self.create(
-                collection=constants.CollectionName.FILLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        portfolio.avg_win_duration = profits.get(PositionQuerySet.DURATION_AVG, 0)
+        portfolio.avg_loss_duration = losses.get(PositionQuerySet.DURATION_AVG, 0)
+        portfolio.avg_wash_duration = washes.get(PositionQuerySet.DURATION_AVG, 0)
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PARTIAL_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
-        )
+        portfolio.shortest_win_duration = profits.get(PositionQuerySet.DURATION_MIN, 0)
+        portfolio.shortest_loss_duration = losses.get(PositionQuerySet.DURATION_MIN, 0)
+        portfolio.shortest_wash_duration = washes.get(PositionQuerySet.DURATION_MIN, 0)
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.PENDING_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
-            )
+        portfolio.largest_win_duration = profits.get(PositionQuerySet.DURATION_MAX, 0)
+        portfolio.largest_loss_duration = losses.get(PositionQuerySet.DURATION_MAX, 0)
+        portfolio.largest_wash_duration = washes.get(PositionQuerySet.DURATION_MAX, 0)
+
+        portfolio.total_wins = profits.get(PositionQuerySet.AMOUNT_CNT, 0)
+        portfolio.total_losses = losses.get(PositionQuerySet.AMOUNT_CNT, 0)
+        portfolio.total_washes = washes.get(PositionQuerySet.AMOUNT_CNT, 0)
+        portfolio.total_trades = (
+            portfolio.total_wins + portfolio.total_losses + portfolio.total_washes
         )
 
-        items.append(
-            self.create(
-                collection=constants.CollectionName.CANCELLED_ORDER,
-                group=constants.CollectionGroup.ORDERS,
-                role=constants.RoleType.GUEST,
-                actions=constants.NO_ACTIONS,
-                portfolio=portfolio,
+    def update_access(
+        self,
+        queryset: PortfolioQuerySet | None = None,
+        grant: Iterable[str] = (),
+        revoke: Iterable[str] = (),
+        record_type: str | None = None,
+    ) -> List[int]:
+        """
+        Grants or revokes roles and sets the record type of many portfolios at once.
+
+        The portfolios are updated by one statement that skips those whose allowed
+        roles (compared as sets) and record type stay the same, the permissions of the
+        changed portfolios are then synced by `PermissionManager.sync`.  Nothing is
+        loaded into Python.
+
+        Args:
+            queryset (PortfolioQuerySet | None): Portfolios to update, all when omitted.
+            grant (Iterable[str]): Roles added to `allowed_roles`.
+            revoke (Iterable[str]): Roles removed from `allowed_roles`.
+            record_type (str | None): New record type, unchanged when omitted.
+
+        Returns:
+            List[int]: Ids of the portfolios whose access changed.
+        """
+        queryset = self.get_queryset() if queryset is None else queryset
+        scope_sql, scope_params = queryset.values("id").order_by().query.sql_with_params()
+        portfolios = self.model._meta.db_table
+        current = "COALESCE(portfolio.allowed_roles, '{}')"
+        sql = f"""
+            WITH scope AS ({scope_sql}),
+            target AS (
+                SELECT
+                    portfolio.id,
+                    ARRAY(
+                        SELECT role
+                        FROM UNNEST({current} || %s::VARCHAR[]) WITH ORDINALITY AS roles (role, n)
+                        WHERE role <> ALL(%s::VARCHAR[])
+                        GROUP BY role
+                        ORDER BY MIN(n)
+                    )::VARCHAR[] AS allowed_roles,
+                    COALESCE(%s, portfolio.record_type) AS record_type
+                FROM {portfolios} portfolio
+                JOIN scope ON scope.id = portfolio.id
             )
-        )
+            UPDATE {portfolios} portfolio
+            SET allowed_roles = target.allowed_roles, record_type = target.record_type
+            FROM target
+            WHERE portfolio.id = target.id
+                AND (
+                    NOT (target.allowed_roles @> {current} AND {current} @> target.allowed_roles)
+                    OR portfolio.record_type IS DISTINCT FROM target.record_type
+                )
+            RETURNING portfolio.id;
+        """
+        params = (*scope_params, list(grant), list(revoke), record_type)
+        permissions = getattr(self.model, "permissions").rel.related_model._default_manager
+
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql, params)
+                changed = [portfolio_id for (portfolio_id,) in cursor.fetchall()]
+
+            permissions.sync(changed)
+
+        return changed
+
+    def refresh(
+        self,
+        portfolio: AbstractPortfolio,
+        since: datetime.datetime | None = None,
+        streaks: bool = True,
+    ) -> None:
+        """
+        Updates the streaks, stats, equity curve and risk metrics of a portfolio.
+
+        The portfolio row is locked first, so concurrent refreshes of one portfolio run
+        one after the other while other portfolios are refreshed in parallel.  Stats
+        and risk metrics come from the `PortfolioStatistic` totals, the history is only
+        read for the streaks (skipped unless `streaks`) and the equity curve (rewritten
+        from `since`, see `PortfolioEquityManager.rebuild`).
+        """
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
 
-        return items
+        with transaction.atomic(using=self.db):
+            self.get_queryset().select_for_update().filter(pk=portfolio.pk).exists()
 
-    def get_queryset(self) -> PermissionQuerySet[AbstractPermissionType]:
-        return PermissionQuerySet(model=self.model, using=self._db)
+            if streaks:
+                positions.update_streaks()
 
+            portfolio.refresh_from_db()
+            self.update_stats(portfolio)
+            portfolio.save(update_fields=self.stats_fields)
+            getattr(portfolio, "equity").rebuild(portfolio, since)
+            self.update_risk_metrics(portfolio)
 
-class PortfolioManager(models.Manager[AbstractPortfolioType]):
+    def update_risk_metrics(self, portfolio: AbstractPortfolio) -> Dict[str, Decimal | None]:
+        """
+        Stores the risk adjusted metrics of a portfolio.
 
-    def update_stats(self, portfolio: AbstractPortfolio) -> None:
-        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
-        qs = positions.get_queryset().closed_positions()
-        profits = qs.calculate_profits()
-        losses = qs.calculate_losses()
-        washes = qs.calculate_washes()
-
-        portfolio.avg_profit_amount = profits.get(qs.AMOUNT_AVG, 0)
-        portfolio.smallest_profit_amount = profits.get(qs.AMOUNT_MIN, 0)
-        portfolio.largest_profit_amount = profits.get(qs.AMOUNT_MAX, 0)
-
-        portfolio.avg_loss_amount = losses.get(qs.AMOUNT_AVG, 0)
-        portfolio.smallest_loss_amount = losses.get(qs.AMOUNT_MIN, 0)
-        portfolio.largest_loss_amount = losses.get(qs.AMOUNT_MAX, 0)
-
-        portfolio.avg_win_duration = profits.get(qs.DURATION_AVG, 0)
-        portfolio.avg_loss_duration = losses.get(qs.DURATION_AVG, 0)
-        portfolio.avg_wash_duration = washes.get(qs.DURATION_AVG, 0)
-
-        portfolio.shortest_win_duration = profits.get(qs.DURATION_MIN, 0)
-        portfolio.shortest_loss_duration = losses.get(qs.DURATION_MIN, 0)
-        portfolio.shortest_wash_duration = washes.get(qs.DURATION_MIN, 0)
-
-        portfolio.largest_win_duration = profits.get(qs.DURATION_MAX, 0)
-        portfolio.largest_loss_duration = losses.get(qs.DURATION_MAX, 0)
-        portfolio.largest_wash_duration = washes.get(qs.DURATION_MAX, 0)
-
-        portfolio.total_wins = profits.get(qs.AMOUNT_CNT, 0)
-        portfolio.total_losses = losses.get(qs.AMOUNT_CNT, 0)
-        portfolio.total_washes = washes.get(qs.AMOUNT_CNT, 0)
-        portfolio.total_trades = (
-            portfolio.total_wins + portfolio.total_losses + portfolio.total_washes
+        The metrics come from the totals kept in `PortfolioStatistic`, so only when those
+        are stale are the positions aggregated (once).  Calmar uses the CAGR and maximum
+        drawdown of the portfolio, so the equity curve should be rebuilt first.
+
+        Returns:
+            Dict[str, Decimal | None]: Metrics keyed by their portfolio field.
+        """
+        statistics: PortfolioStatisticManager[AbstractPortfolioStatistic] = getattr(
+            portfolio, "statistics"
         )
+        totals = statistics.totals(portfolio)
+        metrics = RiskMetrics(totals).calculate(portfolio.total_cagr, portfolio.max_drawdown)
+
+        self.get_queryset().filter(pk=portfolio.pk).update(**metrics)
+
+        for field, value in metrics.items():
+            setattr(portfolio, field, value)
+
+        return metrics
+
+    def export_snapshot(
+        self,
+        portfolios: models.QuerySet,
+        directory: pathlib.Path,
+        fmt: str = "parquet",
+        batch_size: int = 50_000,
+    ) -> Dict[str, int]:
+        """
+        Exports the positions and orders of `portfolios` into `positions.<fmt>` and
+        `orders.<fmt>` files in `directory`, see `ColumnarExporter`.
+
+        Returns:
+            Dict[str, int]: Number of rows written, keyed by file name.
+        """
+        related = {
+            "positions": getattr(self.model, "positions").rel.related_model,
+            "orders": getattr(self.model, "orders").rel.related_model,
+        }
+        written = {}
+
+        for name, model in related.items():
+            queryset = model._default_manager.filter(_portfolio__in=portfolios.values("pk"))
+            exporter: ColumnarExporter = model._default_manager.get_exporter(queryset)
+            file_name = f"{name}.{FORMATS[fmt]}"
+            written[file_name] = exporter.write(directory / file_name, fmt, batch_size)
+
+        return written
 
     def get_queryset(self) -> PortfolioQuerySet[AbstractPortfolioType]:
         return PortfolioQuerySet(model=self.model, using=self._db)
@@ -509,6 +872,114 @@ class SymbolManager(models.Manager[AbstractSymbolType], ImportExportStub):
         "search_index",
     ]
 
+    # smallest share of the listed symbols a feed must have for its delta to be applied
+    min_delta_ratio = 0.5
+
+    def check_delta(self, cursor: CursorWrapper, feed: str) -> None:
+        """
+        Refuses a feed that is empty or far smaller than the listed symbols.
+
+        Applying it would delist every symbol missing from it, so a failed or
+        truncated download would soft delete most of the table.
+
+        Args:
+            cursor (CursorWrapper): Cursor the counts are read on.
+            feed (str): Query yielding the code of every row in the feed.
+        """
+        key = self.insert_columns[0]
+        sql = f"""
+            SELECT
+                (SELECT COUNT(DISTINCT {key}) FROM ({feed}) AS feed ({key})),
+                (SELECT COUNT(*) FROM {self.table_name} WHERE delisted_stamp IS NULL);
+        """
+        cursor.execute(sql)
+        incoming, listed = cursor.fetchone()
+
+        if not incoming or incoming < listed * self.min_delta_ratio:
+            raise ValueError(
+                f"Symbol feed has {incoming} symbols for {listed} listed ones, "
+                "refusing to delist the missing symbols"
+            )
+
+    def apply_delta(
+        self,
+        cursor: CursorWrapper,
+        query: models.QuerySet,
+        codes: models.QuerySet | None = None,
+        force: bool = False,
+    ) -> Dict[str, int]:
+        """
+        Applies only the difference between the resolved temp symbols and the symbol table.
+
+        Every incoming row is fingerprinted, new codes are inserted, rows whose
+        fingerprint changed (or that were previously delisted) are updated in
+        place and listed symbols missing from the feed are soft deleted.  All
+        three sets are computed and applied in a single statement.  A symbol is
+        missing when its code is not in `codes` at all, rows that are in the feed but
+        could not be resolved leave their symbol as it is.
+
+        Unless forced, a feed that fails `check_delta` is refused before anything is
+        written.
+
+        Args:
+            cursor (CursorWrapper): Cursor the statement is executed on.
+            query (models.QuerySet): Query yielding rows in `insert_columns` order.
+            codes (models.QuerySet | None): Query yielding every code of the feed,
+                the codes of `query` when omitted.
+            force (bool): Apply the delta of an empty or truncated feed anyway.
+
+        Returns:
+            Dict[str, int]: Number of inserted, updated and delisted symbols.
+        """
+        key, *columns = self.insert_columns
+        feed = str((query if codes is None else codes).query)
+
+        if not force:
+            self.check_delta(cursor, feed)
+
+        fingerprint = ", ".join(f"COALESCE({column}::text, '')" for column in self.insert_columns)
+        assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+        sql = f"""
+            WITH incoming AS (
+                SELECT
+                    DISTINCT ON ({key}) {self.get_insert_columns()},
+                    MD5(CONCAT_WS(E'\x1f', {fingerprint})) AS fingerprint
+                FROM ({query.query}) AS resolved ({self.get_insert_columns()})
+                WHERE {key} IS NOT NULL
+                ORDER BY {key}
+            ),
+            upserted AS (
+                INSERT INTO {self.table_name} ({self.get_insert_columns()}, fingerprint)
+                SELECT {self.get_insert_columns()}, fingerprint FROM incoming
+                ON CONFLICT ({key}) DO UPDATE
+                SET {assignments}, fingerprint = EXCLUDED.fingerprint, delisted_stamp = NULL
+                WHERE {self.table_name}.fingerprint IS DISTINCT FROM EXCLUDED.fingerprint
+                    OR {self.table_name}.delisted_stamp IS NOT NULL
+                RETURNING xmax = 0 AS inserted
+            ),
+            delisted AS (
+                UPDATE {self.table_name}
+                SET delisted_stamp = NOW()
+                WHERE delisted_stamp IS NULL
+                    AND NOT EXISTS (
+                        SELECT 1 FROM ({feed}) AS feed ({key})
+                        WHERE feed.{key} = {self.table_name}.{key}
+                    )
+                RETURNING id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM upserted WHERE inserted),
+                (SELECT COUNT(*) FROM upserted WHERE NOT inserted),
+                (SELECT COUNT(*) FROM delisted);
+        """
+        cursor.execute(sql)
+        inserted, updated, delisted = cursor.fetchone()
+
+        return {"inserted": inserted, "updated": updated, "delisted": delisted}
+
+    def get_resolver(self, source: ImportExportStub) -> SymbolResolver:
+        return SymbolResolver(source, self)
+
     def get_queryset(self) -> SymbolQuerySet[AbstractSymbolType]:
         return SymbolQuerySet(model=self.model, using=self._db)
 
@@ -526,10 +997,45 @@ class TempSymbolManager(models.Manager[AbstractTempSymbolType], ImportExportStub
         "naics",
     ]
     download_url = "https://www.iqfeed.net/downloads/download_file.cfm?type=mktsymbols"
+    download_file = "/home/data/symbols/mktsymbols.zip"
     extract_folder = "/home/data/symbols"
     extract_file = "/mktsymbols_v2.txt"
     file_name = "/home/data/symbols/mktsymbols_v2.txt"
 
+    staging_table: str | None = None
+
+    @property
+    def table_name(self) -> str:
+        return self.staging_table or self.model._meta.db_table
+
+    def create_staging_table(self, cursor: CursorWrapper, unlogged: bool = True) -> str:
+        """
+        Creates a per run staging table shaped like the import columns and loads go to it.
+
+        The table is UNLOGGED by default, so neither loading nor dropping it writes WAL
+        or leaves dead tuples behind.  It is a regular (not session temporary) table so
+        that stages running on other connections can read it.
+        """
+        name = f"{self.model._meta.db_table}_{uuid.uuid4().hex[:12]}"
+        sql = f"""
+            CREATE {"UNLOGGED" if unlogged else ""} TABLE {name} AS
+            SELECT {self.get_import_columns()} FROM {self.model._meta.db_table} WITH NO DATA;
+        """
+        cursor.execute(sql)
+        self.staging_table = name
+
+        return name
+
+    def analyze_staging_table(self, cursor: CursorWrapper) -> None:
+        # The staging table is only ever scanned whole (the resolver hash joins it to the
+        # code tables), so it has no indexes, ANALYZE gives the planner real row counts.
+        cursor.execute(f"ANALYZE {self.table_name};")
+
+    def drop_staging_table(self, cursor: CursorWrapper) -> None:
+        if self.staging_table:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.staging_table};")
+        self.staging_table = None
+
     def get_queryset(self) -> TempSymbolQuerySet[AbstractTempSymbolType]:
         return TempSymbolQuerySet(model=self.model, using=self._db)
 
@@ -599,30 +1105,442 @@ class OrderManager(models.Manager[AbstractOrderType]):
         elif order.filled_amount == order.sent_amount:
             order.order_status = constants.OrderStatus.FILLED
 
+    def apply(self, order: AbstractOrder) -> Tuple[datetime.datetime, bool]:
+        """
+        Saves an order and applies it to its position, serialized per portfolio and symbol.
+
+        The position lock taken by `PositionManager.set_position` is held until the
+        order is saved and the position recomputed, so concurrent workers can not open
+        a second position for the symbol or recompute it from a partial set of orders.
+        A filled exit larger than the open amount is split like `PositionMatcher` does,
+        the remainder is applied as a new order opening the next position.  Portfolio
+        wide figures are left to `PortfolioManager.refresh`.
+
+        Returns:
+            Tuple[datetime.datetime, bool]: What to refresh, see
+                `PositionManager.update_status`.
+        """
+        positions = self.model._meta.get_field("_position").related_model._default_manager
+
+        with transaction.atomic(using=self.db):
+            self.update_status(order)
+            positions.set_position(order)
+            remainder = self.split_exit(order)
+            order.save()
+            since, streaks = positions.update_status(order.position)
+
+            if remainder is not None:
+                remainder_since, remainder_streaks = self.apply(remainder)
+                since, streaks = min(since, remainder_since), streaks or remainder_streaks
+
+        return since, streaks
+
+    def split_exit(self, order: AbstractOrder) -> AbstractOrder | None:
+        """
+        Reduces a filled exit to the open amount of its position.
+
+        Returns:
+            AbstractOrder | None: Unsaved order for the rest of the exit, with a pro rata
+                share of the fees, or None when the exit does not cross zero.
+        """
+        position = order.position
+
+        if order.order_status != constants.OrderStatus.FILLED or position is None:
+            return None
+
+        others = self.get_queryset().filter(_position=position).exclude(pk=order.pk)
+        account = PositionAccount(others.position_fills().get(position.pk, []))
+
+        if order.order_action == account.entry["action"] or account.entry["action"] is None:
+            return None
+        if (order.filled_amount or 0) <= account.open_amount:
+            return None
+
+        fill = {"filled_amount": order.filled_amount, "fees": order.fees}
+        head, tail = PositionMatcher.split(fill, account.open_amount)
+        remainder = copy.copy(order)
+        remainder.pk = None
+        remainder._state.adding = True
+        remainder.position = None
+
+        for part, values in ((order, head), (remainder, tail)):
+            part.sent_amount = part.filled_amount = values["filled_amount"]
+            part.fees = values["fees"]
+
+        return remainder
+
+    def ingest(
+        self,
+        portfolio: AbstractPortfolio,
+        rows: Iterable[Dict[str, Any]],
+        batch_size: int = 1000,
+    ) -> Dict[str, int]:
+        """
+        Bulk loads filled orders into a portfolio and matches them to its positions.
+
+        Fills are sorted by `filled_stamp` and matched in memory by `PositionMatcher`,
+        continuing the open positions of the portfolio.  New positions and the orders
+        are then bulk inserted and the touched positions recomputed with
+        `PositionManager.recompute`, which rebuilds the portfolio statistics and
+        refreshes the streaks, stats, equity curve and risk metrics of the portfolio,
+        all in one transaction holding the position lock of every symbol in `rows`.
+
+        Args:
+            portfolio (AbstractPortfolio): Portfolio the fills belong to.
+            rows (Iterable[Dict[str, Any]]): Fills with the `symbol` code, `order_action`,
+                `filled_stamp`, `filled_price` and `filled_amount` of each, optionally
+                `fees`, `order_type`, `limit_price` and the `sent_*` values (which
+                default to the filled ones).
+            batch_size (int): Rows written per INSERT / UPDATE statement.
+
+        Returns:
+            Dict[str, int]: Number of orders created, positions opened and positions
+                touched.
+        """
+        fills = sorted(({**row} for row in rows), key=lambda row: row["filled_stamp"])
+        symbols = self.model._meta.get_field("_symbol").related_model._default_manager
+        codes = {row["symbol"] for row in fills}
+        symbol_ids = dict(symbols.filter(code__in=codes).values_list("code", "id"))
+
+        if missing := codes - set(symbol_ids):
+            raise ValueError(f"Unknown symbols: {', '.join(sorted(missing))}")
+
+        for row in fills:
+            if row["order_action"] not in constants.OrderAction.values:
+                raise ValueError(f"Unknown order action {row['order_action']}")
+            if row["filled_amount"] <= 0:
+                raise ValueError(f"Filled amount must be positive, got {row['filled_amount']}")
+
+            row["symbol_id"] = symbol_ids[row["symbol"]]
+
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+
+        with transaction.atomic(using=self.db):
+            positions.model._default_manager.lock(portfolio.pk, *symbol_ids.values())
+            matcher = PositionMatcher(positions.model, portfolio, self.open_lots(portfolio))
+            orders = [
+                self.model(
+                    _portfolio=portfolio,
+                    _symbol_id=fill["symbol_id"],
+                    _position=position,
+                    order_type=fill.get("order_type", constants.OrderType.MARKET),
+                    order_action=fill["order_action"],
+                    order_status=constants.OrderStatus.FILLED,
+                    sent_stamp=fill.get("sent_stamp", fill["filled_stamp"]),
+                    sent_price=fill.get("sent_price", fill["filled_price"]),
+                    sent_amount=fill.get("sent_amount", fill["filled_amount"]),
+                    limit_price=fill.get("limit_price"),
+                    filled_stamp=fill["filled_stamp"],
+                    filled_price=fill["filled_price"],
+                    filled_amount=fill["filled_amount"],
+                    fees=fill.get("fees"),
+                )
+                for fill, position in matcher.match(fills)
+            ]
+            matcher.save(batch_size)
+            self.bulk_create(orders, batch_size=batch_size)
+            touched = {order.position.pk for order in orders}
+            self.settle(portfolio, touched, batch_size)
+
+        return {"orders": len(orders), "opened": len(matcher.opened), "positions": len(touched)}
+
+    def import_statement(
+        self,
+        portfolio: AbstractPortfolio,
+        path: str,
+        profile: str = "generic",
+        fmt: str | None = None,
+        batch_size: int = 1000,
+    ) -> Dict[str, Any]:
+        """
+        Imports the trades of a broker statement (CSV or OFX) into a portfolio.
+
+        CSV columns are mapped to order fields by the broker `profile`, OFX statements
+        are always read as generic rows.  See `StatementImporter`.
+
+        Returns:
+            Dict[str, Any]: Counts of the statement rows, fills, skipped rows, orders and
+                positions, and the unresolved symbols with their occurrences.
+        """
+        stream, fmt = open_statement(path, fmt)
+        importer = StatementImporter(
+            self, portfolio, PROFILES["generic" if fmt == "ofx" else profile]
+        )
+
+        with stream:
+            return importer.run(stream, batch_size)
+
+    def open_lots(self, portfolio: AbstractPortfolio) -> Dict[int, OpenLot]:
+        """
+        The open position of each symbol in a portfolio, with its side and open amount.
+        """
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+        open_lots: Dict[int, OpenLot] = {}
+
+        for position in positions.get_queryset().open_positions():
+            side = (
+                constants.OrderAction.SELL
+                if position.trend_type == constants.TrendType.SHORT
+                else constants.OrderAction.BUY
+            )
+            remaining = position.entry_amount - (position.exit_amount or 0)
 
-# class GenericCTEManager(CTEManager, Generic[AbstractPositionType]):
-#     pass
-# CTEManager
+            if remaining > 0:
+                open_lots[getattr(position, "_symbol_id")] = (position, side, remaining)
+
+        return open_lots
+
+    def settle(
+        self, portfolio: AbstractPortfolio, position_ids: Iterable[int], batch_size: int = 1000
+    ) -> None:
+        """
+        Brings positions and the portfolio up to date after orders were bulk inserted.
+        """
+        positions: PositionManager[AbstractPosition] = getattr(portfolio, "positions")
+        positions.model._default_manager.recompute(
+            positions.get_queryset().filter(pk__in=list(position_ids)), batch_size
+        )
+
+    def get_exporter(self, queryset: OrderQuerySet | None = None) -> ColumnarExporter:
+        queryset = self.get_queryset() if queryset is None else queryset
+
+        return ColumnarExporter(queryset.order_by("_portfolio", "id"), ["_portfolio", "_symbol"])
 
 
 class PositionManager(models.Manager[AbstractPositionType]):
 
-    # def update_streaks(self) -> int:
-    #     qs = self.get_queryset().closed_positions()
-    #     index_subquery = qs.streak_index_query().filter(id=OuterRef("pk"))
-    #     lag_subquery = qs.streak_lag_query().filter(id=OuterRef("pk"))
-    #     sq = Subquery(index_subquery.values("group_index")[:1])
-    #     update_response = qs.update(streak_index=sq)
+    def update_streaks(self) -> Dict[str, int]:
+        """
+        Numbers the winning, losing and wash streaks of the closed positions in one statement.
+
+        Streaks are found with the gaps-and-islands technique: within a portfolio the
+        difference between the row number over all closed positions and the row number
+        per result type is constant for consecutive positions with the same result.
+        Every position of an island gets the id of its first position as `streak_group`
+        and its 0-based place in the island as `streak_index`; positions that are not
+        closed are cleared.  The longest island per result type is stored on the
+        portfolio by the same statement.
+
+        Returns:
+            Dict[str, int]: Number of updated positions and portfolios.
+        """
+        scope = self.get_queryset().values("id", "_portfolio_id").order_by()
+        scope_sql, params = scope.query.sql_with_params()
+        positions = self.model._meta.db_table
+        portfolios = self.model._meta.get_field("_portfolio").related_model._meta.db_table
+        longest = (
+            "COALESCE(MAX(streaks.streak_index + 1) FILTER (WHERE streaks.result_type = %s), 0)"
+        )
+        sql = f"""
+            WITH scope AS ({scope_sql}),
+            islands AS (
+                SELECT
+                    p.id,
+                    p._portfolio_id,
+                    p.result_type,
+                    p.exit_stamp,
+                    ROW_NUMBER() OVER (PARTITION BY p._portfolio_id ORDER BY p.exit_stamp, p.id)
+                    - ROW_NUMBER() OVER (
+                        PARTITION BY p._portfolio_id, p.result_type ORDER BY p.exit_stamp, p.id
+                    ) AS island
+                FROM {positions} p
+                JOIN scope ON scope.id = p.id
+                WHERE p.position_status = %s
+            ),
+            streaks AS (
+                SELECT
+                    id,
+                    _portfolio_id,
+                    result_type,
+                    FIRST_VALUE(id) OVER island AS streak_group,
+                    ROW_NUMBER() OVER island - 1 AS streak_index
+                FROM islands
+                WINDOW island AS (
+                    PARTITION BY _portfolio_id, result_type, island ORDER BY exit_stamp, id
+                )
+            ),
+            updated AS (
+                UPDATE {positions} p
+                SET streak_group = streaks.streak_group, streak_index = streaks.streak_index
+                FROM scope
+                LEFT JOIN streaks ON streaks.id = scope.id
+                WHERE p.id = scope.id
+                    AND (
+                        p.streak_group IS DISTINCT FROM streaks.streak_group
+                        OR p.streak_index IS DISTINCT FROM streaks.streak_index
+                    )
+                RETURNING p.id
+            ),
+            longest AS (
+                SELECT
+                    scope._portfolio_id,
+                    {", ".join(f"{longest} AS {name}" for name in ("wins", "losses", "washes"))}
+                FROM scope
+                LEFT JOIN streaks ON streaks.id = scope.id
+                GROUP BY scope._portfolio_id
+            ),
+            totals AS (
+                UPDATE {portfolios} portfolio
+                SET
+                    largest_wining_streak = longest.wins,
+                    largest_loosing_streak = longest.losses,
+                    largest_wash_streak = longest.washes
+                FROM longest
+                WHERE portfolio.id = longest._portfolio_id
+                RETURNING portfolio.id
+            )
+            SELECT (SELECT COUNT(*) FROM updated), (SELECT COUNT(*) FROM totals);
+        """
+        params = (
+            *params,
+            constants.PositionStatus.CLOSED,
+            constants.ResultType.WIN,
+            constants.ResultType.LOSS,
+            constants.ResultType.WASH,
+        )
 
-    #     pprint.pprint(update_response)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            positions_updated, portfolios_updated = cursor.fetchone()
+
+        return {"positions": positions_updated, "portfolios": portfolios_updated}
+
+    status_fields = [
+        "trend_type",
+        "position_status",
+        "entry_stamp",
+        "entry_price",
+        "entry_amount",
+        "entry_fees",
+        "exit_stamp",
+        "exit_price",
+        "exit_amount",
+        "exit_fees",
+        "duration",
+        "real_pnl",
+        "unreal_pnl",
+        "mark_price",
+        "result_type",
+    ]
 
-    #     return qs.update(streak_group=Subquery(lag_subquery.values("group_id")[:1]))
+    def get_exporter(self, queryset: PositionQuerySet | None = None) -> ColumnarExporter:
+        queryset = self.get_queryset() if queryset is None else queryset
 
-    def update_status(self, position: AbstractPosition) -> None:
+        return ColumnarExporter(queryset.order_by("_portfolio", "id"), ["_portfolio", "_symbol"])
+
+    def update_status(
+        self, position: AbstractPosition, mark: Decimal | None = None
+    ) -> Tuple[datetime.datetime, bool]:
+        """
+        Recomputes a position from its orders and applies the change to the statistics
+        of its portfolio.
+
+        Returns:
+            Tuple[datetime.datetime, bool]: First entry of the position before and after,
+                from which the equity curve of the portfolio changed, and whether its
+                streaks changed.
+        """
         orders: OrderManager[AbstractOrder] = getattr(position, "orders")
-        rows = orders.get_queryset().order_stats()
-        entry_order = rows[0] if len(rows) > 0 else {}
-        exit_order = rows[1] if len(rows) > 1 else {}
+        statistics: PortfolioStatisticManager[AbstractPortfolioStatistic] = getattr(
+            position.portfolio, "statistics"
+        )
+        previous = statistics.contribution(position)
+        before = self.streak_key(position)
+        entry_stamp = position.entry_stamp
+        fills = orders.get_queryset().position_fills().get(position.pk, [])
+        self.apply_order_stats(position, PositionAccount(fills).stats(mark))
+        position.save()
+        statistics.apply_change(position.portfolio, previous, statistics.contribution(position))
+
+        return min(entry_stamp, position.entry_stamp), before != self.streak_key(position)
+
+    @staticmethod
+    def streak_key(position: AbstractPosition) -> Tuple[Any, ...] | None:
+        """
+        What the place of a position in the streaks of its portfolio depends on.
+        """
+        if position.position_status != constants.PositionStatus.CLOSED:
+            return None
+
+        return (position.result_type, position.exit_stamp)
+
+    def recompute(
+        self,
+        queryset: PositionQuerySet | None = None,
+        batch_size: int = 1000,
+        prices: Dict[int, Decimal] | None = None,
+    ) -> int:
+        """
+        Recomputes the status fields of many positions from their orders.
+
+        The entry and exit totals of every position are aggregated in one query by
+        `OrderQuerySet.order_stats`, which is all a closed position (or an open one
+        without exits, marked at `prices`) needs.  Only the fills of the other open
+        positions are read and replayed by `PositionAccount`.  The positions are
+        written back with `bulk_update` in chunks of `batch_size`, the statistics of
+        the affected portfolios rebuilt afterwards and the portfolios refreshed from
+        the first entry of their positions.
+
+        Args:
+            queryset (PositionQuerySet | None): Positions to recompute, all when omitted.
+            batch_size (int): Positions written per UPDATE statement.
+            prices (Dict[int, Decimal] | None): Mark price per symbol id for the
+                unrealized pnl of open positions, their last fill price when missing.
+
+        Returns:
+            int: Number of positions updated.
+        """
+        queryset = self.get_queryset() if queryset is None else queryset
+        orders = getattr(self.model, "orders").rel.related_model._default_manager
+        orders = orders.get_queryset().filter(_position__in=queryset.values("pk"))
+        totals = orders.order_stats()
+        positions = list(queryset.select_related("_portfolio"))
+        prices = prices or {}
+        stats: Dict[int, Dict[str, Any] | None] = {}
+
+        for position in positions:
+            mark = prices.get(getattr(position, "_symbol_id"))
+            position_totals = totals.get(position.pk)
+            stats[position.pk] = position_totals and PositionAccount.from_totals(
+                position_totals, mark
+            )
+
+        replayed = [pk for pk, position_stats in stats.items() if position_stats is None]
+        fills = orders.filter(_position__in=replayed).position_fills() if replayed else {}
+        changes: Dict[AbstractPortfolio, Tuple[datetime.datetime, bool]] = {}
+
+        for position in positions:
+            before = self.streak_key(position)
+            entry_stamp = position.entry_stamp
+            position_stats = stats[position.pk]
+
+            if position_stats is None:
+                mark = prices.get(getattr(position, "_symbol_id"))
+                position_stats = PositionAccount(fills.get(position.pk, [])).stats(mark)
+
+            self.apply_order_stats(position, position_stats)
+            since = min(entry_stamp, position.entry_stamp)
+            streaks = before != self.streak_key(position)
+
+            if previous := changes.get(position.portfolio):
+                since, streaks = min(since, previous[0]), streaks or previous[1]
+
+            changes[position.portfolio] = (since, streaks)
+
+        with transaction.atomic(using=self.db):
+            updated = self.bulk_update(positions, self.status_fields, batch_size=batch_size)
+
+            # Too many positions may have changed for deltas, rebuild their statistics.
+            for portfolio, (since, streaks) in changes.items():
+                getattr(portfolio, "statistics").rebuild(portfolio)
+                portfolio._meta.default_manager.refresh(portfolio, since, streaks)
+
+        return updated
+
+    def apply_order_stats(self, position: AbstractPosition, stats: Dict[str, Any]) -> None:
+        """
+        Sets the status fields of a position from the `PositionAccount.stats` of its fills.
+        """
         position.trend_type = constants.TrendType.UNKNOWN
         position.position_status = constants.PositionStatus.UNKNOWN
         position.duration = None
@@ -630,37 +1548,28 @@ class PositionManager(models.Manager[AbstractPositionType]):
         position.unreal_pnl = None
 
         # define entry for position
-        if entry_order:
-            position.entry_stamp = entry_order.get("first_order", 0)
-            position.entry_price = entry_order.get("average_price", 0)
-            position.entry_amount = entry_order.get("total_amount", 0)
-            position.entry_fees = entry_order.get("total_fees", 0)
+        if stats.get("entry_action"):
+            position.entry_stamp = stats["entry_stamp"]
+            position.entry_price = stats["entry_price"]
+            position.entry_amount = stats["entry_amount"]
+            position.entry_fees = stats["entry_fees"]
         else:
-            # position.entry_stamp = None
-            # position.entry_price = None
-            # position.entry_amount = None
             position.entry_fees = None
 
         # define exit for position
-        if exit_order:
-            position.exit_stamp = exit_order.get("last_order", 0)
-            position.exit_price = exit_order.get("avg_price", 0)
-            position.exit_amount = exit_order.get("total_amount", 0)
-            position.exit_fees = exit_order.get("total_fees", 0)
-        else:
-            position.exit_stamp = None
-            position.exit_price = None
-            position.exit_amount = None
-            position.exit_fees = None
+        position.exit_stamp = stats.get("exit_stamp")
+        position.exit_price = stats.get("exit_price")
+        position.exit_amount = stats.get("exit_amount")
+        position.exit_fees = stats.get("exit_fees")
 
         # define the trend (long/short) for this position
-        if entry_order.get("order_action", "") == constants.OrderAction.BUY:
+        if stats.get("entry_action") == constants.OrderAction.BUY:
             position.trend_type = constants.TrendType.LONG
-        elif entry_order.get("order_action", "") == constants.OrderAction.SELL:
+        elif stats.get("entry_action") == constants.OrderAction.SELL:
             position.trend_type = constants.TrendType.SHORT
 
         # define the position status
-        if position.entry_amount == position.exit_amount and position.exit_amount is not None:
+        if stats.get("exit_action") and not stats.get("open_amount"):
             position.position_status = constants.PositionStatus.CLOSED
         else:
             position.position_status = constants.PositionStatus.OPEN
@@ -669,12 +1578,10 @@ class PositionManager(models.Manager[AbstractPositionType]):
         current = datetime.datetime.now(position.entry_stamp.tzinfo)
         position.duration = (position.exit_stamp or current) - position.entry_stamp
 
-        # calculate the amount of realized profit/loss for this position
-        if position.exit_amount is not None:
-            position.real_pnl = position.price_difference * (position.exit_amount or 0)
-        # calculate the amount of unrealized profit/loss for this position
-        if position.entry_price:
-            position.unreal_pnl = position.entry_price * position.amount_difference
+        # realized profit/loss of the exits and unrealized of the open amount, net of fees
+        position.real_pnl = stats.get("real_pnl")
+        position.unreal_pnl = stats.get("unreal_pnl")
+        position.mark_price = stats.get("mark_price")
 
         # define the result type (win/loss/wash/none) for the position
         if position.position_status != constants.PositionStatus.CLOSED:
@@ -686,7 +1593,89 @@ class PositionManager(models.Manager[AbstractPositionType]):
         elif position.real_pnl == 0:
             position.result_type = constants.ResultType.WASH
 
-        position.save()
+    def mark_to_market(self, prices: PriceCache | Mapping[int, Decimal]) -> int:
+        """
+        Marks the unrealized pnl of every open position to the price of its symbol.
+
+        All positions are updated by one statement joining the prices as arrays, rows
+        whose mark does not change are not written.  The pnl is linear in the mark, so
+        it moves by the open amount times the change from the last `mark_price`, signed
+        by the trend, and stays equal to `PositionAccount.unreal_pnl` at the new mark.
+        A position never marked is valued from its average entry price, net of the
+        entry fees of the open amount.  Positions of symbols without a price keep their
+        last mark.
+
+        Args:
+            prices (PriceCache | Mapping[int, Decimal]): Price per symbol id, the live
+                prices of a `PriceCache`.
+
+        Returns:
+            int: Number of positions updated.
+        """
+        if isinstance(prices, PriceCache):
+            prices = prices.snapshot()
+        if not prices:
+            return 0
+
+        positions = self.model._meta.db_table
+        open_amount = "(p.entry_amount - COALESCE(p.exit_amount, 0))"
+        sql = f"""
+            UPDATE {positions} p
+            SET unreal_pnl = marked.unreal_pnl, mark_price = marked.price
+            FROM (
+                SELECT
+                    p.id,
+                    marks.price,
+                    COALESCE(
+                        p.unreal_pnl + (marks.price - p.mark_price) * {open_amount} * direction,
+                        ROUND(
+                            (marks.price - p.entry_price) * {open_amount} * direction
+                            - COALESCE(p.entry_fees, 0) * {open_amount} / p.entry_amount,
+                            2
+                        )
+                    ) AS unreal_pnl
+                FROM {positions} p
+                JOIN (
+                    SELECT symbol_id, ROUND(price, 2) AS price
+                    FROM UNNEST(%s::BIGINT[], %s::NUMERIC[]) AS marks (symbol_id, price)
+                ) AS marks ON marks.symbol_id = p._symbol_id
+                CROSS JOIN LATERAL (
+                    SELECT CASE WHEN p.trend_type = %s THEN -1 ELSE 1 END AS direction
+                ) AS trend
+                WHERE p.position_status = %s AND p.entry_amount <> 0
+            ) AS marked
+            WHERE p.id = marked.id AND p.mark_price IS DISTINCT FROM marked.price;
+        """
+        params = [
+            list(prices.keys()),
+            list(prices.values()),
+            constants.TrendType.SHORT,
+            constants.PositionStatus.OPEN,
+        ]
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def lock(self, portfolio_id: int, *symbol_ids: int) -> None:
+        """
+        Serializes order application per portfolio and symbol until the transaction ends.
+
+        A transaction level advisory lock is used because `SELECT ... FOR UPDATE` can not
+        lock an open position before it exists.  Orders of other symbols or portfolios
+        are not blocked.  Several symbols are locked in id order, so bulk loads and
+        single orders can not deadlock on each other.
+        """
+        if not connections[self.db].in_atomic_block:
+            raise TransactionManagementError("Position locks require a transaction.")
+
+        sql = """
+            SELECT pg_advisory_xact_lock(%s, symbol_id)
+            FROM (SELECT DISTINCT UNNEST(%s::INTEGER[]) AS symbol_id ORDER BY 1) symbols;
+        """
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, [portfolio_id, list(symbol_ids)])
 
     def set_position(self, order: AbstractOrder) -> None:
         # Find the first open position for this portfolio and symbol
@@ -696,17 +1685,23 @@ class PositionManager(models.Manager[AbstractPositionType]):
         if not portfolio_id or not symbol_id:
             return
 
-        position = self.get_queryset().open_position_by(portfolio_id, symbol_id)
-
-        # If a open position was not found then create a new one with the
-        # current order as the extry order
-        order.position = position if position else self.model()
-        order.position.portfolio = order.portfolio
-        order.position.symbol = order.symbol
-        order.position.entry_stamp = order.sent_stamp
-        order.position.entry_price = order.sent_price
-        order.position.entry_amount = order.sent_amount
-        order.position.save()
+        with transaction.atomic(using=self.db):
+            self.lock(portfolio_id, symbol_id)
+            qs = self.get_queryset().select_for_update()
+            position = qs.open_position_by(portfolio_id, symbol_id)
+
+            # If a open position was not found then create a new one with the
+            # current order as the extry order
+            if position is None:
+                position = self.model()
+                position.portfolio = order.portfolio
+                position.symbol = order.symbol
+                position.entry_stamp = order.sent_stamp
+                position.entry_price = order.sent_price
+                position.entry_amount = order.sent_amount
+                position.save()
+
+        order.position = position
 
     def get_queryset(self) -> PositionQuerySet[AbstractPositionType]:
         return PositionQuerySet(model=self.model, using=self._db)
@@ -0,0 +1,126 @@
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.db import models
+from vega import constants
+
+# position, side of its entry and amount still open
+OpenLot = Tuple[models.Model, str, int]
+
+
+class PositionMatcher(object):
+    """
+    Assigns fills to positions, per symbol and in fill order.
+
+    A position is the net exposure of a portfolio to one symbol, priced at average
+    cost: its first fill sets the side, fills on that side add to it and fills on the
+    other side reduce it until it is flat and closed.  A fill crossing zero is split,
+    the part that closes the position stays with it and the remainder (with a pro rata
+    share of the fees) opens the next position on the other side.
+
+    Matching only tracks the open amount per symbol, so thousands of fills are matched
+    in memory without a query.  Positions opened by the fills are created unsaved,
+    `save` writes them once the fills are matched.
+
+    Args:
+        model (type[models.Model]): Position model.
+        portfolio (models.Model): Portfolio the fills belong to.
+        open_lots (Dict[int, OpenLot]): Open position of each symbol id.
+    """
+
+    def __init__(
+        self,
+        model: type[models.Model],
+        portfolio: models.Model,
+        open_lots: Dict[int, OpenLot] | None = None,
+    ) -> None:
+        self.model = model
+        self.portfolio = portfolio
+        self.open_lots = dict(open_lots or {})
+        self.opened: List[models.Model] = []
+        self.closed: List[models.Model] = []
+
+    def open(self, symbol_id: int, fill: Dict[str, Any], amount: int) -> models.Model:
+        position = self.model(
+            _portfolio=self.portfolio,
+            _symbol_id=symbol_id,
+            entry_stamp=fill["filled_stamp"],
+            entry_price=fill["filled_price"],
+            entry_amount=amount,
+        )
+        self.opened.append(position)
+        self.open_lots[symbol_id] = (position, fill["order_action"], amount)
+
+        return position
+
+    @staticmethod
+    def split(fill: Dict[str, Any], amount: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Splits a fill in two, the first part for `amount` of its filled amount.
+        """
+        fees = Decimal(fill.get("fees") or 0)
+        head_fees = (fees * amount / fill["filled_amount"]).quantize(Decimal("0.01"))
+        remainder = fill["filled_amount"] - amount
+        head = {**fill, "filled_amount": amount, "sent_amount": amount, "fees": head_fees}
+        tail = {
+            **fill,
+            "filled_amount": remainder,
+            "sent_amount": remainder,
+            "fees": fees - head_fees,
+        }
+
+        return head, tail
+
+    def match(self, fills: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """
+        Yields every fill (or part of a split fill) with the position it belongs to.
+
+        Args:
+            fills (Iterable[Dict[str, Any]]): Fills sorted by `filled_stamp`, with the
+                `symbol_id`, `order_action`, `filled_stamp`, `filled_price`,
+                `filled_amount` and `fees` of each.
+        """
+        for fill in fills:
+            symbol_id = fill["symbol_id"]
+            lot = self.open_lots.get(symbol_id)
+
+            if lot is None:
+                yield fill, self.open(symbol_id, fill, fill["filled_amount"])
+                continue
+
+            position, side, remaining = lot
+
+            if fill["order_action"] == side:
+                self.open_lots[symbol_id] = (position, side, remaining + fill["filled_amount"])
+                yield fill, position
+                continue
+
+            if fill["filled_amount"] < remaining:
+                self.open_lots[symbol_id] = (position, side, remaining - fill["filled_amount"])
+                yield fill, position
+                continue
+
+            del self.open_lots[symbol_id]
+            position.position_status = constants.PositionStatus.CLOSED
+            self.closed.append(position)
+
+            if fill["filled_amount"] == remaining:
+                yield fill, position
+                continue
+
+            closing, opening = self.split(fill, remaining)
+            yield closing, position
+            yield opening, self.open(symbol_id, opening, opening["filled_amount"])
+
+    def save(self, batch_size: int = 1000) -> None:
+        """
+        Inserts the opened positions, after closing the existing ones the fills closed
+        so a symbol never has two open positions.
+        """
+        manager = self.model._default_manager
+        closed = [position.pk for position in self.closed if position.pk is not None]
+
+        if closed:
+            manager.filter(pk__in=closed).update(position_status=constants.PositionStatus.CLOSED)
+
+        manager.bulk_create(self.opened, batch_size=batch_size)
@@ -0,0 +1,152 @@
+import datetime
+from decimal import Decimal
+from typing import Any, Dict
+
+from vega import constants
+
+YEAR = datetime.timedelta(days=365.25)
+
+
+class RiskMetrics(object):
+    """
+    Risk adjusted performance of a portfolio, derived from its position totals.
+
+    Every metric is a closed form of the count, sum and sum of squares of the closed
+    position pnl per result type, plus their summed duration.  Those totals are what
+    `PortfolioStatistic` already maintains by delta (or one grouped aggregate over the
+    positions produces), so no position is loaded to compute them.
+
+    Sharpe and Sortino are per trade ratios with a zero risk free rate, annualized by
+    the number of average holding periods in a year.  Calmar is the CAGR over the
+    maximum drawdown of the equity curve.  Metrics that are undefined for the totals
+    (no losses, no variance, no drawdown) are None.
+
+    Args:
+        totals (Dict[str, Dict[str, Any]]): Totals keyed by result type, named after the
+            fields of `AbstractPortfolioStatistic`.
+    """
+
+    def __init__(self, totals: Dict[str, Dict[str, Any]]) -> None:
+        self.totals = totals
+
+    def total(self, field: str, result_type: str | None = None) -> Any:
+        if result_type:
+            return self.totals.get(result_type, {}).get(field) or 0
+
+        return sum(self.total(field, result_type) for result_type in self.totals)
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        durations = [totals.get("duration_sum") for totals in self.totals.values()]
+
+        return sum(filter(None, durations), datetime.timedelta())
+
+    @property
+    def count(self) -> int:
+        return self.total("position_count")
+
+    @property
+    def mean(self) -> Decimal | None:
+        if not self.count:
+            return None
+
+        return Decimal(self.total("amount_sum")) / self.count
+
+    @property
+    def stdev(self) -> Decimal | None:
+        if self.mean is None:
+            return None
+
+        variance = Decimal(self.total("amount_sumsq")) / self.count - self.mean * self.mean
+
+        return max(variance, Decimal(0)).sqrt()
+
+    @property
+    def downside_deviation(self) -> Decimal | None:
+        """Root mean square of the losses over every position, the wins counting as zero."""
+        if not self.count:
+            return None
+
+        squares = Decimal(self.total("amount_sumsq", constants.ResultType.LOSS))
+
+        return (squares / self.count).sqrt()
+
+    @property
+    def periods_per_year(self) -> Decimal | None:
+        if not self.count or not self.duration:
+            return None
+
+        holding = self.duration / self.count
+
+        return Decimal(YEAR / holding)
+
+    def annualized(self, deviation: Decimal | None) -> Decimal | None:
+        periods = self.periods_per_year
+
+        if not deviation or self.mean is None or periods is None:
+            return None
+
+        return self.mean / deviation * periods.sqrt()
+
+    def sharpe_ratio(self) -> Decimal | None:
+        return self.annualized(self.stdev)
+
+    def sortino_ratio(self) -> Decimal | None:
+        return self.annualized(self.downside_deviation)
+
+    def calmar_ratio(self, cagr: Decimal | None, max_drawdown: Decimal | None) -> Decimal | None:
+        if cagr is None or not max_drawdown:
+            return None
+
+        return Decimal(cagr) / abs(Decimal(max_drawdown))
+
+    def profit_factor(self) -> Decimal | None:
+        losses = abs(Decimal(self.total("amount_sum", constants.ResultType.LOSS)))
+
+        if not losses:
+            return None
+
+        return Decimal(self.total("amount_sum", constants.ResultType.WIN)) / losses
+
+    def expectancy(self) -> Decimal | None:
+        return self.mean
+
+    def payoff_ratio(self) -> Decimal | None:
+        wins = self.total("position_count", constants.ResultType.WIN)
+        losses = self.total("position_count", constants.ResultType.LOSS)
+        loss_sum = abs(Decimal(self.total("amount_sum", constants.ResultType.LOSS)))
+
+        if not wins or not loss_sum:
+            return None
+
+        return (Decimal(self.total("amount_sum", constants.ResultType.WIN)) / wins) / (
+            loss_sum / losses
+        )
+
+    def calculate(
+        self, cagr: Decimal | None = None, max_drawdown: Decimal | None = None
+    ) -> Dict[str, Decimal | None]:
+        """
+        Every metric, rounded for storage on the portfolio.
+
+        Args:
+            cagr (Decimal | None): Compound annual growth rate of the portfolio, in percent.
+            max_drawdown (Decimal | None): Maximum drawdown of the portfolio, in percent.
+
+        Returns:
+            Dict[str, Decimal | None]: Metrics keyed by their portfolio field.
+        """
+        metrics = {
+            "sharpe_ratio": self.sharpe_ratio(),
+            "sortino_ratio": self.sortino_ratio(),
+            "calmar_ratio": self.calmar_ratio(cagr, max_drawdown),
+            "profit_factor": self.profit_factor(),
+            "expectancy": self.expectancy(),
+            "payoff_ratio": self.payoff_ratio(),
+        }
+        places = {"expectancy": Decimal("0.01")}
+
+        return {
+            field: None if value is None else value.quantize(places.get(field, Decimal("0.0001")))
+            for field, value in metrics.items()
+        }
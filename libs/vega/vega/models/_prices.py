@@ -0,0 +1,114 @@
+import csv
+import pathlib
+import queue
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Tuple
+
+
+class PriceCache(object):
+    """
+    Last market price of each symbol id, evicted once older than `ttl` seconds.
+
+    Prices are kept in one dict of `symbol id -> (price, expiry)`, written by feeds and
+    read by `PositionManager.mark_to_market` through `snapshot()`, possibly from other
+    threads.  Expired prices are dropped on read, so a stalled feed stops marking the
+    positions of its symbols instead of marking them at a stale price.
+
+    Feeds are pluggable: anything producing `(symbol id, price)` pairs can `update()`
+    the cache.  `load()` reads a CSV file and `drain()` a queue, standing in for a
+    market data connection.
+
+    Args:
+        ttl (float): Seconds a price stays valid after it was set.
+        clock (Callable[[], float]): Monotonic clock in seconds.
+    """
+
+    def __init__(self, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.prices: Dict[int, Tuple[Decimal, float]] = {}
+        self.mutex = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def set(self, symbol_id: int, price: Decimal) -> None:
+        self.update([(symbol_id, price)])
+
+    def update(self, prices: Iterable[Tuple[int, Decimal]]) -> int:
+        """
+        Stores many prices at once, returns the number stored.
+        """
+        expiry = self.clock() + self.ttl
+        entries = {int(symbol_id): (Decimal(price), expiry) for symbol_id, price in prices}
+
+        with self.mutex:
+            self.prices.update(entries)
+
+        return len(entries)
+
+    def get(self, symbol_id: int) -> Decimal | None:
+        with self.mutex:
+            entry = self.prices.get(symbol_id)
+
+            if entry is None:
+                return None
+            if entry[1] <= self.clock():
+                del self.prices[symbol_id]
+                return None
+
+        return entry[0]
+
+    def evict(self) -> int:
+        """
+        Drops every expired price, returns the number dropped.
+        """
+        now = self.clock()
+
+        with self.mutex:
+            expired = [symbol_id for symbol_id, (_, expiry) in self.prices.items() if expiry <= now]
+
+            for symbol_id in expired:
+                del self.prices[symbol_id]
+
+        return len(expired)
+
+    def snapshot(self) -> Dict[int, Decimal]:
+        """
+        Prices that have not expired, keyed by symbol id.
+        """
+        self.evict()
+
+        with self.mutex:
+            return {symbol_id: price for symbol_id, (price, _) in self.prices.items()}
+
+    def load(self, path: str | pathlib.Path) -> int:
+        """
+        Stores the prices of a `symbol_id,price` CSV file, rows that do not parse are skipped.
+        """
+        prices = []
+
+        with open(path, newline="") as handle:
+            for row in csv.reader(handle):
+                try:
+                    prices.append((int(row[0]), Decimal(row[1])))
+                except (IndexError, ValueError, InvalidOperation):
+                    continue
+
+        return self.update(prices)
+
+    def drain(self, source: queue.Queue, limit: int | None = None) -> int:
+        """
+        Stores the `(symbol id, price)` pairs waiting in a queue without blocking.
+        """
+        prices = []
+
+        while limit is None or len(prices) < limit:
+            try:
+                prices.append(source.get_nowait())
+            except queue.Empty:
+                break
+
+        return self.update(prices)
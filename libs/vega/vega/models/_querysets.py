@@ -1,9 +1,13 @@
-from typing import Any, Dict, Generic, Self
+from decimal import Decimal
+from typing import Any, Dict, Generic, List, Self
 
 from django.db import models
-from django.db.models import (  # BigIntegerField,; Field,; IntegerField,; Window,
+from django.db.models import (
+    Aggregate,
     Avg,
     Count,
+    DecimalField,
+    ExpressionWrapper,
     F,
     Max,
     Min,
@@ -11,11 +15,8 @@ from django.db.models import (  # BigIntegerField,; Field,; IntegerField,; Windo
     StdDev,
     Sum,
 )
-
-# from django.db.models.expressions import Expression
-# from django.db.models.functions import Cast, RowNumber
-# from django_cte import CTEQuerySet, With
 from vega import constants
+from vega.models._accounting import Fill
 from vega.models.Abstractions import (
     AbstractExchangeType,
     AbstractMarketType,
@@ -23,6 +24,8 @@ from vega.models.Abstractions import (
     AbstractOrder,
     AbstractOrderType,
     AbstractPermissionType,
+    AbstractPortfolioEquityType,
+    AbstractPortfolioStatisticType,
     AbstractPortfolioType,
     AbstractPosition,
     AbstractPositionType,
@@ -33,8 +36,6 @@ from vega.models.Abstractions import (
     AbstractTempSymbolType,
 )
 
-# from vega.models.functions import CustomLag
-
 
 class PermissionQuerySet(models.QuerySet[AbstractPermissionType], Generic[AbstractPermissionType]):
     pass
@@ -44,6 +45,51 @@ class PortfolioQuerySet(models.QuerySet[AbstractPortfolioType], Generic[Abstract
     pass
 
 
+class PortfolioEquityQuerySet(
+    models.QuerySet[AbstractPortfolioEquityType], Generic[AbstractPortfolioEquityType]
+):
+
+    IS_UNDERWATER = Q(drawdown__lt=0)
+
+    def underwater(self) -> Self:
+        return self.filter(self.IS_UNDERWATER)
+
+    def underwater_periods(self) -> list[dict[str, Any]]:
+        """
+        Every stretch of days spent below a previous peak, oldest first.
+
+        Returns:
+            list[dict[str, Any]]: Peak day (`start`), last day under it (`end`), deepest
+                drawdown (`depth`) and `duration` of each period.
+        """
+        rows = (
+            self.underwater()
+            .values("peak_stamp")
+            .annotate(end=Max("stamp"), depth=Min("drawdown"))
+            .order_by("peak_stamp")
+        )
+
+        return [
+            {
+                "start": row["peak_stamp"],
+                "end": row["end"],
+                "depth": row["depth"],
+                "duration": row["end"] - row["peak_stamp"],
+            }
+            for row in rows
+        ]
+
+
+class PortfolioStatisticQuerySet(
+    models.QuerySet[AbstractPortfolioStatisticType], Generic[AbstractPortfolioStatisticType]
+):
+
+    IS_STALE = Q(is_stale=True)
+
+    def stale_statistics(self) -> Self:
+        return self.filter(self.IS_STALE)
+
+
 class SubscriptionQuerySet(
     models.QuerySet[AbstractSubscriptionType], Generic[AbstractSubscriptionType]
 ):
@@ -51,13 +97,25 @@ class SubscriptionQuerySet(
 
 
 class SymbolQuerySet(models.QuerySet[AbstractSymbolType], Generic[AbstractSymbolType]):
-    pass
+
+    IS_LISTED = Q(delisted_stamp__isnull=True)
+
+    def listed_symbols(self) -> Self:
+        return self.filter(self.IS_LISTED)
+
+    def delisted_symbols(self) -> Self:
+        return self.exclude(self.IS_LISTED)
 
 
 class TempSymbolQuerySet(models.QuerySet[AbstractTempSymbolType], Generic[AbstractTempSymbolType]):
 
+    @property
+    def table_name(self) -> str:
+        # Follows the manager so a per run staging table is read when one is active.
+        return getattr(self.model._default_manager, "table_name", self.model._meta.db_table)
+
     def distinct_symbols(self):
-        sql = """
+        sql = f"""
             SELECT
                 DISTINCT temp.symbol,
                 temp.description,
@@ -69,7 +127,7 @@ class TempSymbolQuerySet(models.QuerySet[AbstractTempSymbolType], Generic[Abstra
                 COALESCE(naics_codes.id, NULL),
                 LEFT(CONCAT('(', exchanges.code, '):', temp.symbol, '  ', temp.description), 64)
             FROM
-                dataset_tempsymbol as temp
+                {self.table_name} as temp
             LEFT JOIN dataset_exchange exchanges
                 ON temp.exchange = exchanges.code
             LEFT JOIN dataset_market markets
@@ -84,32 +142,30 @@ class TempSymbolQuerySet(models.QuerySet[AbstractTempSymbolType], Generic[Abstra
 
         return self.raw(sql.strip())
 
+    def distinct_codes(self, column: str):
+        sql = f"""
+            SELECT DISTINCT {column}
+            FROM {self.table_name}
+            WHERE {column} IS NOT NULL
+            ORDER BY {column}
+        """
+
+        return self.raw(sql.strip())
+
     def distinct_naics(self):
-        return self.filter(naics__isnull=False).values("naics").distinct().order_by("naics")
+        return self.distinct_codes("naics")
 
     def distinct_sic(self):
-        return self.filter(sic__isnull=False).values("sic").distinct().order_by("sic")
+        return self.distinct_codes("sic")
 
     def distinct_exchanges(self):
-        return (
-            self.filter(exchange__isnull=False).values("exchange").distinct().order_by("exchange")
-        )
+        return self.distinct_codes("exchange")
 
     def distinct_markets(self):
-        return (
-            self.filter(listed_market__isnull=False)
-            .values("listed_market")
-            .distinct()
-            .order_by("listed_market")
-        )
+        return self.distinct_codes("listed_market")
 
     def distinct_securities(self):
-        return (
-            self.filter(security_type__isnull=False)
-            .values("security_type")
-            .distinct()
-            .order_by("security_type")
-        )
+        return self.distinct_codes("security_type")
 
 
 class NaicsQuerySet(models.QuerySet[AbstractNaicsCodeType], Generic[AbstractNaicsCodeType]):
@@ -152,18 +208,96 @@ class OrderQuerySet(models.QuerySet[AbstractOrderType], Generic[AbstractOrderTyp
 
     FEES = F("fees")
 
-    def order_stats(self) -> list[dict[str, Any]]:
-        return list(
+    def side_aggregates(self, action: str) -> Dict[str, Aggregate]:
+        side = Q(order_action=action)
+        value = ExpressionWrapper(
+            self.FILLED_PRICE * self.FILLED_AMOUNT, output_field=DecimalField()
+        )
+
+        return {
+            f"{action}_count": Count("id", filter=side),
+            f"{action}_first_id": Min("id", filter=side),
+            f"{action}_first": Min(self.FILLED_STAMP, filter=side),
+            f"{action}_last": Max(self.FILLED_STAMP, filter=side),
+            f"{action}_amount": Sum(self.FILLED_AMOUNT, filter=side),
+            f"{action}_value": Sum(value, filter=side),
+            f"{action}_fees": Sum(self.FEES, filter=side),
+        }
+
+    def order_stats(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Entry and exit of every position in the queryset, aggregated in one grouped query.
+
+        Filled orders are summed per position and side.  The side of the first fill is
+        the entry (ties on the stamp go to the lowest order id) and the other side the
+        exit.  Prices are volume weighted averages, the entry stamp is the first entry
+        fill and the exit stamp the last exit fill.
+
+        Returns:
+            Dict[int, Dict[str, Any]]: `entry_*` and `exit_*` action, count, stamp, price,
+                amount and fees keyed by position id.  Exit values are `None` for a
+                position without exit fills.
+        """
+        aggregates: Dict[str, Aggregate] = {}
+
+        for action in constants.OrderAction.values:
+            aggregates.update(self.side_aggregates(action))
+
+        rows = (
             self.filled_orders()
-            .values("order_action")
-            .annotate(order_count=Count(F("id")))
-            .annotate(first_order=Min(self.FILLED_STAMP))
-            .annotate(last_order=Max(self.FILLED_STAMP))
-            .annotate(average_price=Avg(self.FILLED_PRICE))
-            .annotate(total_amount=Sum(self.FILLED_AMOUNT))
-            .annotate(total_fees=Sum(self.FEES))
-            .order_by("filled_stamp")
+            .exclude(_position=None)
+            .values("_position")
+            .annotate(**aggregates)
+            .order_by()
         )
+        stats: Dict[int, Dict[str, Any]] = {}
+
+        for row in rows:
+            sides = [action for action in constants.OrderAction.values if row[f"{action}_count"]]
+            sides.sort(key=lambda action: (row[f"{action}_first"], row[f"{action}_first_id"]))
+            stats[row["_position"]] = {
+                **self.side_stats("entry", row, sides[0]),
+                **self.side_stats("exit", row, sides[1] if len(sides) > 1 else None),
+            }
+
+        return stats
+
+    def side_stats(self, prefix: str, row: Dict[str, Any], action: str | None) -> Dict[str, Any]:
+        if action is None:
+            keys = ["action", "count", "stamp", "price", "amount", "fees"]
+            return {f"{prefix}_{key}": None for key in keys}
+
+        amount = row[f"{action}_amount"] or 0
+        value = row[f"{action}_value"]
+
+        return {
+            f"{prefix}_action": action,
+            f"{prefix}_count": row[f"{action}_count"],
+            f"{prefix}_stamp": row[f"{action}_{'first' if prefix == 'entry' else 'last'}"],
+            f"{prefix}_price": value / amount if amount and value is not None else None,
+            f"{prefix}_amount": amount,
+            f"{prefix}_fees": row[f"{action}_fees"] or Decimal(0),
+        }
+
+    def position_fills(self) -> Dict[int, List[Fill]]:
+        """
+        Filled orders of every position in the queryset in fill order, keyed by position id.
+        """
+        rows = (
+            self.filled_orders()
+            .exclude(_position=None)
+            .exclude(filled_amount=None)
+            .order_by("_position", "filled_stamp", "id")
+            .values_list(
+                "_position", "order_action", "filled_stamp", "filled_price", "filled_amount", "fees"
+            )
+        )
+        fills: Dict[int, List[Fill]] = {}
+
+        for position_id, *fill in rows.iterator(chunk_size=10000):
+            fills.setdefault(position_id, []).append(tuple(fill))
+
+        return fills
 
     def pending_orders(self) -> Self:
         return self.filter(self.IS_PENDING)
@@ -215,80 +349,61 @@ class PositionQuerySet(models.QuerySet[AbstractPositionType], Generic[AbstractPo
 
     IS_CLOSED = Q(position_status=constants.PositionStatus.CLOSED)
 
+    IS_COUNTED = Q(real_pnl__isnull=False, duration__isnull=False)
+
     AMOUNT_AVG = "amount_avg"
     AMOUNT_MIN = "amount_min"
     AMOUNT_MAX = "amount_max"
     AMOUNT_CNT = "amount_cnt"
+    AMOUNT_STDEV = "amount_stdev"
+    AMOUNT_SUM = "amount_sum"
 
     DURATION_AVG = "duration_avg"
     DURATION_MIN = "duration_min"
     DURATION_MAX = "duration_max"
 
-    # def streak_window(
-    #     self, expression: Expression, output_field: Field[Any, Any] = IntegerField()
-    # ) -> Window:
-    #     return Window(
-    #         expression=expression,
-    #         order_by=[self.PORTFOLIO_ID.asc(), self.EXIT_STAMP.asc()],
-    #         partition_by=[self.PORTFOLIO_ID, self.RESULT_TYPE],
-    #         output_field=output_field,
-    #     )
-
-    # def streak_index_query(self) -> Self:
-    #     offset_query = (
-    #         self.all()
-    #         .order_by(self.EXIT_STAMP)
-    #         .closed_positions()
-    #         .values("id")
-    #         .annotate(offset=Cast(self.streak_window(RowNumber()) - 1, IntegerField()))
-    #     )
-
-    #     cte_offset = With(offset_query, name="cte_offset")
-    #     joined_cte = cte_offset.join(self.all(), id=cte_offset.col.id)
-
-    #     return (
-    #         cast(Self, joined_cte)
-    #         .with_cte(cte_offset)
-    #         .values("id")
-    #         .annotate(group_index=cte_offset.col.offset)
-    #     )
-
-    # def streak_lag_query(self) -> Self:
-    #     lag_query = (
-    #         self.all()
-    #         .order_by(self.EXIT_STAMP)
-    #         .closed_positions()
-    #         .values("id")
-    #         .annotate(
-    #             lag_id=Cast(
-    #                 self.streak_window(CustomLag(F("id"), self.STREAK_INDEX)), BigIntegerField()
-    #             )
-    #         )
-    #     )
-
-    #     cte_lag = With(lag_query, name="cte_lag")
-    #     joined_cte = cte_lag.join(self.all(), id=cte_lag.col.id)
-
-    #     return (
-    #         cast(Self, joined_cte)
-    #         .with_cte(cte_lag)
-    #         .values("id")
-    #         .annotate(group_id=cte_lag.col.lag_id)
-    #     )
+    def stats_aggregates(self, column: F, query: Q) -> Dict[str, Aggregate]:
+        return {
+            self.AMOUNT_AVG: Avg(column, filter=query),
+            self.AMOUNT_MIN: Min(column, filter=query),
+            self.AMOUNT_MAX: Max(column, filter=query),
+            self.AMOUNT_CNT: Count(column, filter=query),
+            self.AMOUNT_STDEV: StdDev(column, filter=query),
+            self.AMOUNT_SUM: Sum(column, filter=query),
+            self.DURATION_AVG: Avg(self.DUR_COL, filter=query),
+            self.DURATION_MIN: Min(self.DUR_COL, filter=query),
+            self.DURATION_MAX: Max(self.DUR_COL, filter=query),
+            # duration_stdev=StdDev(self.DUR_COL, filter=query)
+        }
 
     def calculate_stats(self, column: F, query: Q) -> Dict[str, Any]:
-        return self.aggregate(
-            amount_avg=Avg(column, filter=query),
-            amount_min=Min(column, filter=query),
-            amount_max=Max(column, filter=query),
-            amount_cnt=Count(column, filter=query),
-            amount_stdev=StdDev(column, filter=query),
-            amount_sum=Sum(column, filter=query),
-            duration_avg=Avg(self.DUR_COL, filter=query),
-            duration_min=Min(self.DUR_COL, filter=query),
-            duration_max=Max(self.DUR_COL, filter=query),
-            # duration_stdev=StdDev(self.DUR_COL, filter=query)
-        )
+        return self.aggregate(**self.stats_aggregates(column, query))
+
+    def calculate_all_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Win, loss and wash statistics computed together in a single scan.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Statistics keyed by result type, each shaped like the
+                result of `calculate_stats`.
+        """
+        filters = {
+            constants.ResultType.WIN: self.IS_PROFIT,
+            constants.ResultType.LOSS: self.IS_LOSS,
+            constants.ResultType.WASH: self.IS_WASH,
+        }
+        aggregates = {
+            f"{result_type}__{name}": aggregate
+            for result_type, query in filters.items()
+            for name, aggregate in self.stats_aggregates(self.RPNL_COL, query).items()
+        }
+        stats: Dict[str, Dict[str, Any]] = {result_type: {} for result_type in filters}
+
+        for key, value in self.aggregate(**aggregates).items():
+            result_type, name = key.split("__", 1)
+            stats[result_type][name] = value
+
+        return stats
 
     def calculate_profits(self) -> Dict[str, Any]:
         return self.calculate_stats(self.RPNL_COL, self.IS_PROFIT)
@@ -299,6 +414,31 @@ class PositionQuerySet(models.QuerySet[AbstractPositionType], Generic[AbstractPo
     def calculate_washes(self) -> Dict[str, Any]:
         return self.calculate_stats(self.RPNL_COL, self.IS_WASH)
 
+    def result_totals(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Running totals of the closed positions per result type, in one grouped query.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Totals keyed by result type, named after the
+                fields of `AbstractPortfolioStatistic`.
+        """
+        rows = (
+            self.closed_positions()
+            .filter(self.IS_COUNTED)
+            .values("result_type")
+            .annotate(position_count=Count(F("id")))
+            .annotate(amount_sum=Sum(self.RPNL_COL))
+            .annotate(amount_sumsq=Sum(self.RPNL_COL * self.RPNL_COL))
+            .annotate(amount_min=Min(self.RPNL_COL))
+            .annotate(amount_max=Max(self.RPNL_COL))
+            .annotate(duration_sum=Sum(self.DUR_COL))
+            .annotate(duration_min=Min(self.DUR_COL))
+            .annotate(duration_max=Max(self.DUR_COL))
+            .order_by()
+        )
+
+        return {row.pop("result_type"): row for row in rows}
+
     def open_position_by(self, portfolio_id: int, symbol_id: int) -> AbstractPosition | None:
         return (
             self.open_positions()
@@ -308,10 +448,10 @@ class PositionQuerySet(models.QuerySet[AbstractPositionType], Generic[AbstractPo
         )
 
     def positions_by_portfolio(self, portfolio_id: int) -> Self:
-        return self.filter(portfolio__id=portfolio_id)
+        return self.filter(_portfolio_id=portfolio_id)
 
     def positions_by_symbol(self, symbol_id: int) -> Self:
-        return self.filter(symbol__id=symbol_id)
+        return self.filter(_symbol_id=symbol_id)
 
     def open_positions(self) -> Self:
         return self.filter(self.IS_OPEN)
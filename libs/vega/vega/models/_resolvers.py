@@ -0,0 +1,144 @@
+import uuid
+from typing import Any, Dict
+
+from django.db import models
+from django.db.backends.utils import CursorWrapper
+from vega.models._ManagerStubs import ImportExportStub
+
+
+class SymbolResolver(object):
+    """
+    Resolves staged symbol rows to symbol rows in one hashed pass.
+
+    The staging table is scanned once and every foreign key is resolved with a hash
+    join against its code table, so each code -> id map is built once per run instead
+    of joining and de-duplicating over every text column.  Resolved ids are written next
+    to the raw codes into an UNLOGGED `<staging>_resolved_<run>` table that
+    `SymbolManager.insert_from_temp` / `apply_delta` read through `query()`, the codes
+    of every staged row (resolved or not) through `codes()`.  The run suffix keeps
+    concurrent imports reading the shared temp symbol table apart.
+
+    Codes that do not exist in their table are counted per column.  Rows missing a
+    required code (exchange, market or security) are skipped instead of being inserted
+    with a NULL foreign key.
+
+    Args:
+        source (ImportExportStub): Manager of the staged rows (`TempSymbol.objects`).
+        target (ImportExportStub): Manager of the resolved rows (`Symbol.objects`).
+    """
+
+    # staging column -> symbol foreign key
+    foreign_keys = {
+        "exchange": "exchange",
+        "listed_market": "market",
+        "security_type": "security",
+        "sic": "sic",
+        "naics": "naics",
+    }
+
+    def __init__(self, source: ImportExportStub, target: ImportExportStub) -> None:
+        self.source = source
+        self.target = target
+        self.run_id = uuid.uuid4().hex[:12]
+
+    @property
+    def model(self) -> type[models.Model]:
+        return getattr(self.target, "model")
+
+    @property
+    def table_name(self) -> str:
+        return f"{self.source.table_name}_resolved_{self.run_id}"
+
+    def resolved(self) -> str:
+        required = [
+            f"{field_name}_id IS NOT NULL"
+            for field_name in self.foreign_keys.values()
+            if not self.model._meta.get_field(field_name).null
+        ]
+
+        return " AND ".join(["code IS NOT NULL", *required])
+
+    def resolve(self, cursor: CursorWrapper) -> Dict[str, Any]:
+        """
+        Resolves every staged row into the resolved table, replacing any previous content.
+
+        Returns:
+            Dict[str, Any]: Row counts and the unresolved codes (with occurrences) per column.
+        """
+        ids, misses, joins = [], [], []
+
+        # Raw codes are only kept when they did not resolve, for the report.
+        for alias, (column, field_name) in enumerate(self.foreign_keys.items()):
+            related = self.model._meta.get_field(field_name).related_model
+            ids.append(f"t{alias}.id AS {field_name}_id")
+            misses.append(f"CASE WHEN t{alias}.id IS NULL THEN s.{column} END AS {column}")
+            joins.append(
+                f"LEFT JOIN {related._meta.db_table} t{alias} ON t{alias}.code = s.{column}"
+            )
+
+        sql = f"""
+            DROP TABLE IF EXISTS {self.table_name};
+            CREATE UNLOGGED TABLE {self.table_name} AS
+            SELECT
+                s.symbol AS code,
+                s.description,
+                s.frontmonth,
+                LEFT(
+                    CONCAT('(', s.exchange, '):', s.symbol, '  ', s.description), 64
+                ) AS search_index,
+                {", ".join(ids)},
+                {", ".join(misses)}
+            FROM {self.source.table_name} s
+            {" ".join(joins)};
+        """
+        cursor.execute(sql)
+
+        return self.report(cursor)
+
+    def report(self, cursor: CursorWrapper) -> Dict[str, Any]:
+        sql = f"""
+            SELECT
+                COUNT(*),
+                COUNT(*) FILTER (WHERE {self.resolved()}),
+                {", ".join(f"COUNT({column})" for column in self.foreign_keys)}
+            FROM {self.table_name};
+        """
+        cursor.execute(sql)
+        rows, resolved, *missed = cursor.fetchone()
+        unresolved = {}
+
+        for column, count in zip(self.foreign_keys, missed):
+            if not count:
+                continue
+
+            sql = f"""
+                SELECT {column}, COUNT(*) FROM {self.table_name}
+                WHERE {column} IS NOT NULL GROUP BY {column};
+            """
+            cursor.execute(sql)
+            unresolved[column] = dict(cursor.fetchall())
+
+        return {
+            "rows": rows,
+            "resolved": resolved,
+            "skipped": rows - resolved,
+            "unresolved": unresolved,
+        }
+
+    def query(self) -> models.QuerySet:
+        sql = f"""
+            SELECT {self.target.get_insert_columns()} FROM {self.table_name} WHERE {self.resolved()}
+        """
+
+        return getattr(self.target, "get_queryset")().raw(sql)
+
+    def codes(self) -> models.QuerySet:
+        """
+        Every code in the feed, including those of rows `query()` skips.
+        """
+        sql = f"SELECT code FROM {self.table_name} WHERE code IS NOT NULL"
+
+        return getattr(self.target, "get_queryset")().raw(sql)
+
+    def drop(self, cursor: CursorWrapper) -> None:
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table_name};")
@@ -0,0 +1,516 @@
+import csv
+import datetime
+import io
+import re
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from typing import IO, Any, Dict, Iterator, List, Tuple
+
+from django.db import connections, models, transaction
+from django.db.backends.utils import CursorWrapper
+from psycopg2 import sql as psql
+from vega import constants
+from vega.models._matching import PositionMatcher
+
+
+@dataclass
+class BrokerProfile:
+    """
+    How the trade export of a broker maps to order fields.
+
+    `columns` maps `symbol`, `filled_stamp`, `filled_price`, `filled_amount` and
+    optionally `order_action` and `fees` to the header of the statement column holding
+    them.  Without an action column the side comes from the sign of the amount.
+    """
+
+    name: str
+
+    columns: Dict[str, str]
+
+    # statement value (upper case) -> order action
+    actions: Dict[str, str] = field(default_factory=dict)
+
+    # to_timestamp() format of the stamps, cast as timestamptz when None
+    stamp_format: str | None = None
+
+    delimiter: str = ","
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in [
+        BrokerProfile(
+            name="generic",
+            columns={
+                "symbol": "symbol",
+                "order_action": "order_action",
+                "filled_stamp": "filled_stamp",
+                "filled_price": "filled_price",
+                "filled_amount": "filled_amount",
+                "fees": "fees",
+            },
+            actions={"BUY": constants.OrderAction.BUY, "SELL": constants.OrderAction.SELL},
+        ),
+        BrokerProfile(
+            name="ibkr",
+            columns={
+                "symbol": "Symbol",
+                "filled_stamp": "DateTime",
+                "filled_price": "TradePrice",
+                "filled_amount": "Quantity",
+                "fees": "IBCommission",
+            },
+            stamp_format="YYYYMMDD;HH24MISS",
+        ),
+        BrokerProfile(
+            name="schwab",
+            columns={
+                "symbol": "Symbol",
+                "order_action": "Action",
+                "filled_stamp": "Date",
+                "filled_price": "Price",
+                "filled_amount": "Quantity",
+                "fees": "Fees & Comm",
+            },
+            actions={
+                "BUY": constants.OrderAction.BUY,
+                "BUY TO COVER": constants.OrderAction.BUY,
+                "SELL": constants.OrderAction.SELL,
+                "SELL SHORT": constants.OrderAction.SELL,
+            },
+            stamp_format="MM/DD/YYYY",
+        ),
+    ]
+}
+
+# OFX investment transactions and the side they trade on
+OFX_TRADES = {
+    "BUYSTOCK": constants.OrderAction.BUY,
+    "SELLSTOCK": constants.OrderAction.SELL,
+}
+
+OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<]*)")
+
+OFX_STAMP = re.compile(r"(\d{8})(\d{6})?[^\[]*(?:\[([+-]?\d+(?:\.\d+)?)(?::\w+)?\])?")
+
+# number left once currency symbols and separators are stripped, safe to cast
+NUMBER_PATTERN = r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]{1,3})?$"
+
+# largest amount an order stores
+MAX_AMOUNT = 2**31 - 1
+
+# bound of the prices and fees an order stores, two decimals in nine digits
+MAX_PRICE = 10**7
+
+
+def ofx_stamp(value: str) -> datetime.datetime:
+    """
+    Parses an OFX date time (`YYYYMMDDHHMMSS.XXX[gmt offset:tz name]`), UTC when no
+    offset is given.
+    """
+    match = OFX_STAMP.match(value)
+
+    if match is None:
+        raise ValueError(f"Invalid OFX date {value}")
+
+    date, time, offset = match.groups()
+    stamp = datetime.datetime.strptime(date + (time or "000000"), "%Y%m%d%H%M%S")
+    zone = datetime.timezone(datetime.timedelta(hours=float(offset or 0)))
+
+    return stamp.replace(tzinfo=zone)
+
+
+def read_ofx(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the stock trades of an OFX statement as generic profile rows.
+
+    Both the SGML (1.x) and XML (2.x) flavours are read: leaf elements are taken from
+    the text following their opening tag, closing tags are optional.  Securities are
+    identified by their ticker from the security list, or by their unique id (CUSIP)
+    when the list does not have it.
+    """
+    tickers: Dict[str, str] = {}
+    trades: List[Tuple[str, Dict[str, str]]] = []
+    block: Dict[str, str] | None = None
+    kind = None
+
+    for closing, tag, text in OFX_TAG.findall(stream.read()):
+        if tag in OFX_TRADES or tag == "SECINFO":
+            if closing and block is not None:
+                if kind == "SECINFO":
+                    tickers[block.get("UNIQUEID", "")] = block.get("TICKER", "")
+                else:
+                    trades.append((str(kind), block))
+                block = kind = None
+            elif not closing:
+                block, kind = {}, tag
+        elif block is not None and not closing and text.strip():
+            block.setdefault(tag, text.strip())
+
+    for kind, trade in trades:
+        unique_id = trade.get("UNIQUEID", "")
+        fees = sum(abs(float(trade.get(name) or 0)) for name in ("COMMISSION", "FEES"))
+
+        yield {
+            "symbol": tickers.get(unique_id) or unique_id,
+            "order_action": OFX_TRADES[kind],
+            "filled_stamp": ofx_stamp(trade["DTTRADE"]).isoformat(),
+            "filled_price": trade.get("UNITPRICE"),
+            "filled_amount": trade.get("UNITS"),
+            "fees": fees,
+        }
+
+
+class StatementImporter(object):
+    """
+    Imports a broker statement into a portfolio through COPY staging tables.
+
+    The statement is copied as is into an UNLOGGED table with one text column per
+    header (OFX statements are first converted to generic rows).  One INSERT ... SELECT
+    then casts and normalizes the columns of the broker profile and resolves the
+    symbols with a hash join on `Symbol.code`, retrying unresolved symbols with the
+    separators brokers use for share classes (`BRK B`, `BRK/B`) replaced by a dot.
+
+    Fills are streamed from a server side cursor in fill order through
+    `PositionMatcher`, the positions they open are bulk inserted and the matched
+    amounts copied back, so the orders are written by a single INSERT ... SELECT.
+    Rows that can not be used (unresolved symbol, missing or malformed value, unknown
+    action, fractional amount) are counted and skipped: values are only cast once they
+    are known to be valid.  The position lock of every statement symbol is held from
+    matching until the portfolio is settled.
+
+    Args:
+        manager (models.Manager): Order manager.
+        portfolio (models.Model): Portfolio the statement belongs to.
+        profile (BrokerProfile): Column mapping of the statement.
+    """
+
+    def __init__(
+        self, manager: models.Manager, portfolio: models.Model, profile: BrokerProfile
+    ) -> None:
+        self.manager = manager
+        self.portfolio = portfolio
+        self.profile = profile
+        self.table_name = f"{manager.model._meta.db_table}_statement_{uuid.uuid4().hex[:12]}"
+        self.header: Dict[str, str] = {}
+
+    @property
+    def fills_table(self) -> str:
+        return f"{self.table_name}_fills"
+
+    @property
+    def matched_table(self) -> str:
+        return f"{self.table_name}_matched"
+
+    def load(self, cursor: CursorWrapper, stream: IO[str]) -> int:
+        """
+        Copies the statement into the raw staging table.
+
+        Returns:
+            int: Number of statement rows.
+        """
+        header = next(csv.reader([stream.readline()], delimiter=self.profile.delimiter))
+        # `line` numbers the staged rows.
+        duplicates = {name for name in header if header.count(name) > 1 or name == "line"}
+        missing = {
+            name
+            for key, name in self.profile.columns.items()
+            if key != "fees" and name not in header
+        }
+
+        if not all(header):
+            raise ValueError("Statement has columns without a name")
+        if duplicates:
+            raise ValueError(f"Statement has duplicate columns: {', '.join(sorted(duplicates))}")
+        if missing:
+            raise ValueError(f"Statement is missing columns: {', '.join(sorted(missing))}")
+
+        self.header = {name: psql.Identifier(name).as_string(cursor.connection) for name in header}
+        columns = ", ".join(f"{quoted} TEXT" for quoted in self.header.values())
+        copied = ", ".join(self.header.values())
+        cursor.execute(f"""
+            CREATE UNLOGGED TABLE {self.table_name} (
+                line BIGINT GENERATED ALWAYS AS IDENTITY, {columns}
+            );
+            """)
+        sql = f"""
+            COPY {self.table_name} ({copied})
+            FROM STDIN WITH (FORMAT CSV, DELIMITER E'{self.profile.delimiter}');
+        """
+        cursor.copy_expert(sql, stream)
+
+        return cursor.rowcount
+
+    def column(self, key: str) -> str | None:
+        name = self.profile.columns.get(key)
+
+        if name not in self.header:
+            return None
+
+        return f"NULLIF(TRIM(s.{self.header[name]}), '')"
+
+    def number(self, key: str) -> str:
+        column = self.column(key)
+
+        if column is None:
+            return "NULL"
+
+        # Currency symbols and thousands separators, parentheses for negatives.  Values
+        # with words in them or that are still not a number are NULL instead of failing
+        # the cast.
+        digits = f"REGEXP_REPLACE({column}, '[^0-9.eE+-]', '', 'g')"
+
+        return f"""
+            CASE WHEN {column} !~ '[A-DF-Za-df-z]' AND {digits} ~ '{NUMBER_PATTERN}' THEN
+                CASE WHEN {column} ~ '^\\(.*\\)$' THEN -1 ELSE 1 END * ({digits})::NUMERIC
+            END
+        """
+
+    def stamp(self) -> str:
+        column = self.column("filled_stamp")
+        stamp_format = f"'{self.profile.stamp_format}'" if self.profile.stamp_format else "NULL"
+
+        return f"pg_temp.statement_stamp({column}, {stamp_format})"
+
+    def fees(self) -> str:
+        # Missing fees are none, malformed ones make the row unusable.
+        column = self.column("fees")
+
+        if column is None:
+            return "0"
+
+        return f"CASE WHEN {column} IS NULL THEN 0 ELSE ABS({self.number('fees')}) END"
+
+    def action(self) -> str:
+        if self.column("order_action") is None:
+            amount = self.number("filled_amount")
+            return f"""
+                CASE WHEN {amount} > 0 THEN '{constants.OrderAction.BUY}'
+                WHEN {amount} < 0 THEN '{constants.OrderAction.SELL}' END
+            """
+
+        cases = " ".join(
+            f"WHEN '{value.upper()}' THEN '{action}'"
+            for value, action in self.profile.actions.items()
+        )
+
+        return f"CASE UPPER({self.column('order_action')}) {cases} END"
+
+    def stage(self, cursor: CursorWrapper) -> Dict[str, Any]:
+        """
+        Normalizes the raw rows into the fills table and resolves their symbols.
+
+        Returns:
+            Dict[str, Any]: Number of usable fills, skipped rows and the unresolved
+                symbols with their occurrences.
+        """
+        symbols = self.manager.model._meta.get_field("_symbol").related_model._meta.db_table
+        # Stamps that do not parse are NULL, the cast of a single one would fail the import.
+        cursor.execute("""
+            CREATE OR REPLACE FUNCTION pg_temp.statement_stamp(value TEXT, format TEXT)
+            RETURNS TIMESTAMPTZ AS $$
+            DECLARE
+                stamp TIMESTAMPTZ;
+            BEGIN
+                stamp := CASE
+                    WHEN format IS NULL THEN value::TIMESTAMPTZ ELSE TO_TIMESTAMP(value, format)
+                END;
+                RETURN CASE WHEN ISFINITE(stamp) THEN stamp END;
+            EXCEPTION WHEN data_exception THEN
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql STABLE;
+            """)
+        sql = f"""
+            CREATE UNLOGGED TABLE {self.fills_table} AS
+            WITH parsed AS (
+                SELECT
+                    s.line,
+                    UPPER({self.column("symbol")}) AS symbol,
+                    {self.action()} AS order_action,
+                    {self.stamp()} AS filled_stamp,
+                    {self.number("filled_price")} AS filled_price,
+                    ABS({self.number("filled_amount")}) AS amount,
+                    {self.fees()} AS fees
+                FROM {self.table_name} s
+            ),
+            normalized AS (
+                SELECT
+                    line, symbol, order_action, filled_stamp,
+                    CASE
+                        WHEN ABS(ROUND(filled_price, 2)) < {MAX_PRICE} THEN filled_price
+                    END AS filled_price,
+                    CASE
+                        WHEN amount = TRUNC(amount) AND amount <= {MAX_AMOUNT}
+                        THEN amount::INTEGER
+                    END AS filled_amount,
+                    CASE WHEN ROUND(fees, 2) < {MAX_PRICE} THEN fees END AS fees
+                FROM parsed
+            )
+            SELECT n.line, n.symbol, COALESCE(code.id, alias.id) AS symbol_id,
+                n.order_action, n.filled_stamp, n.filled_price, n.filled_amount, n.fees
+            FROM normalized n
+            LEFT JOIN {symbols} code ON code.code = n.symbol
+            LEFT JOIN {symbols} alias
+                ON code.id IS NULL AND alias.code = REGEXP_REPLACE(n.symbol, '[ /-]', '.', 'g');
+
+            SELECT
+                COUNT(*) FILTER (WHERE symbol_id IS NOT NULL AND {self.usable()}),
+                COUNT(*)
+            FROM {self.fills_table};
+        """
+        cursor.execute(sql)
+        fills, rows = cursor.fetchone()
+        sql = f"""
+            SELECT symbol, COUNT(*) FROM {self.fills_table}
+            WHERE symbol_id IS NULL AND symbol IS NOT NULL GROUP BY symbol;
+        """
+        cursor.execute(sql)
+
+        return {"fills": fills, "skipped": rows - fills, "unresolved": dict(cursor.fetchall())}
+
+    def symbol_ids(self, cursor: CursorWrapper) -> List[int]:
+        cursor.execute(
+            f"SELECT DISTINCT symbol_id FROM {self.fills_table} WHERE symbol_id IS NOT NULL;"
+        )
+
+        return [symbol_id for (symbol_id,) in cursor.fetchall()]
+
+    def usable(self) -> str:
+        return """
+            order_action IS NOT NULL AND filled_stamp IS NOT NULL
+            AND filled_price IS NOT NULL AND filled_amount > 0 AND fees IS NOT NULL
+        """
+
+    def match(self, matcher: PositionMatcher) -> List[Tuple[int, int, Any, Any]]:
+        """
+        Matches the usable fills in fill order.
+
+        Returns:
+            List[Tuple[int, int, Any, Any]]: Line, matched amount, fees and position of
+                every order to write.
+        """
+        columns = ["symbol_id", "order_action", "filled_stamp", "filled_price"]
+        sql = f"""
+            SELECT line, {", ".join(columns)}, filled_amount, fees
+            FROM {self.fills_table}
+            WHERE symbol_id IS NOT NULL AND {self.usable()}
+            ORDER BY filled_stamp, line;
+        """
+        matched = []
+
+        with connections[self.manager.db].chunked_cursor() as cursor:
+            cursor.execute(sql)
+            fills = (
+                {
+                    "line": line,
+                    **dict(zip(columns, values)),
+                    "filled_amount": amount,
+                    "fees": fees,
+                }
+                for line, *values, amount, fees in cursor
+            )
+
+            for fill, position in matcher.match(fills):
+                matched.append((fill["line"], fill["filled_amount"], fill["fees"], position))
+
+        return matched
+
+    def write(self, cursor: CursorWrapper, matched: List[Tuple[int, int, Any, Any]]) -> int:
+        """
+        Copies the matched amounts next to the fills and inserts the orders.
+
+        Returns:
+            int: Number of orders inserted.
+        """
+        buffer = io.StringIO()
+
+        for part, (line, amount, fees, position) in enumerate(matched):
+            buffer.write(f"{line}\t{part}\t{amount}\t{fees}\t{position.pk}\n")
+
+        buffer.seek(0)
+        cursor.execute(f"""
+            CREATE UNLOGGED TABLE {self.matched_table} (
+                line BIGINT, part BIGINT, filled_amount INTEGER, fees NUMERIC, position_id BIGINT
+            );
+            """)
+        cursor.copy_expert(f"COPY {self.matched_table} FROM STDIN", buffer)
+        sql = f"""
+            INSERT INTO {self.manager.model._meta.db_table} (
+                _portfolio_id, _symbol_id, _position_id, order_type, order_action,
+                order_status, sent_stamp, sent_price, sent_amount, filled_stamp,
+                filled_price, filled_amount, fees
+            )
+            SELECT
+                %s, f.symbol_id, m.position_id, %s, f.order_action, %s, f.filled_stamp,
+                f.filled_price, m.filled_amount, f.filled_stamp, f.filled_price,
+                m.filled_amount, m.fees
+            FROM {self.matched_table} m
+            JOIN {self.fills_table} f ON f.line = m.line
+            ORDER BY m.part;
+        """
+        cursor.execute(
+            sql, [self.portfolio.pk, constants.OrderType.MARKET, constants.OrderStatus.FILLED]
+        )
+
+        return cursor.rowcount
+
+    def drop(self, cursor: CursorWrapper) -> None:
+        for table in (self.matched_table, self.fills_table, self.table_name):
+            cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        cursor.execute("DROP FUNCTION IF EXISTS pg_temp.statement_stamp(TEXT, TEXT);")
+
+    def run(self, stream: IO[str], batch_size: int = 1000) -> Dict[str, Any]:
+        """
+        Imports the statement and settles the portfolio, in one transaction.
+
+        The staging tables are dropped once the orders are written, when the import
+        fails they are rolled back with everything else.
+
+        Returns:
+            Dict[str, Any]: Statement rows, usable fills, skipped rows, unresolved
+                symbols and the number of orders and positions written.
+        """
+        positions = getattr(self.portfolio, "positions")
+
+        with transaction.atomic(using=self.manager.db):
+            with connections[self.manager.db].cursor() as cursor:
+                result = {"rows": self.load(cursor, stream), **self.stage(cursor)}
+                positions.model._default_manager.lock(self.portfolio.pk, *self.symbol_ids(cursor))
+                matcher = PositionMatcher(
+                    positions.model, self.portfolio, self.manager.open_lots(self.portfolio)
+                )
+                matched = self.match(matcher)
+                matcher.save(batch_size)
+                result["orders"] = self.write(cursor, matched)
+                self.drop(cursor)
+
+            touched = {position.pk for *_, position in matched}
+            self.manager.settle(self.portfolio, touched, batch_size)
+
+        return {**result, "opened": len(matcher.opened), "positions": len(touched)}
+
+
+def open_statement(path: str, fmt: str | None = None) -> Tuple[IO[str], str]:
+    """
+    Opens a statement as CSV text, converting OFX statements to generic rows.
+
+    Returns:
+        Tuple[IO[str], str]: The CSV stream and the format it was read as.
+    """
+    fmt = fmt or ("ofx" if path.lower().endswith((".ofx", ".qfx")) else "csv")
+
+    if fmt == "csv":
+        return open(path, newline="", encoding="utf-8-sig"), fmt
+
+    spool = tempfile.SpooledTemporaryFile(mode="w+", newline="")
+    writer = csv.DictWriter(spool, fieldnames=list(PROFILES["generic"].columns))
+    writer.writeheader()
+
+    with open(path, encoding="utf-8", errors="replace") as stream:
+        writer.writerows(read_ofx(stream))
+
+    spool.seek(0)
+
+    return spool, fmt
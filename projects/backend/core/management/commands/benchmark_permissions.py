@@ -0,0 +1,112 @@
+"""
+Django command timing the permission checks of a portfolio changelist render.
+"""
+
+import time
+import typing
+
+from core.patterns.management import MembershipContext, MembershipManagement
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test import RequestFactory
+from vega import constants
+from vega.models import Permission, Portfolio
+
+# actions checked for every row of a changelist
+ROW_ACTIONS = [
+    constants.ActionType.VIEW,
+    constants.ActionType.UPDATE,
+    constants.ActionType.DELETE,
+]
+
+
+def scan(permissions: typing.List[Permission], collections: typing.List, action: str) -> bool:
+    """Permission check by scanning every permission, as done before the masks."""
+    for perm in permissions:
+        if perm.collection in collections and action in perm.actions and perm.enabled:
+            return True
+
+    return False
+
+
+class Command(BaseCommand):
+    """Django command comparing scanned and compiled permission checks of the subadmins."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('portfolio', help='Code of the portfolio whose permissions are used.')
+        parser.add_argument(
+            '--role',
+            choices=constants.RoleType.values,
+            default=constants.RoleType.OWNER,
+            help='Role whose permissions are checked.',
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=100,
+            help='Rows per changelist, each checked for view, change and delete.',
+        )
+        parser.add_argument(
+            '--renders',
+            type=int,
+            default=1000,
+            help='Number of changelist renders of every subadmin.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        portfolio = Portfolio.objects.filter(code=options['portfolio']).first()
+
+        if portfolio is None:
+            raise CommandError(f'Unknown portfolio {options["portfolio"]}')
+
+        permissions = list(portfolio.permissions.filter(role=options['role']))
+        mgmt = MembershipManagement()
+        token = mgmt.activate(MembershipContext(portfolio, None, tuple(permissions)))
+        request = RequestFactory().get('/')
+        subadmins = admin.site._registry[Portfolio].subadmin_instances
+        # Django checks add once per changelist and view, change, delete per row.
+        checks = [constants.ActionType.CREATE] + ROW_ACTIONS * options['rows']
+        results = {}
+
+        try:
+            for subadmin in subadmins:
+                name = type(subadmin).__name__
+                started = time.perf_counter()
+
+                for _ in range(options['renders']):
+                    for action in checks:
+                        scan(permissions, subadmin.collections, action)
+
+                scanned = time.perf_counter() - started
+                started = time.perf_counter()
+
+                for _ in range(options['renders']):
+                    for action in checks:
+                        mgmt.has_permissions(subadmin.collections, action)
+
+                compiled = time.perf_counter() - started
+                started = time.perf_counter()
+
+                for _ in range(options['renders']):
+                    subadmin.has_add_permission(request)
+
+                    for _ in range(options['rows']):
+                        subadmin.has_view_permission(request, portfolio)
+                        subadmin.has_change_permission(request, portfolio)
+                        subadmin.has_delete_permission(request, portfolio)
+
+                rendered = time.perf_counter() - started
+                results[name] = (scanned, compiled, rendered)
+        finally:
+            mgmt.reset(token)
+
+        count = options['renders'] * len(checks)
+        self.stdout.write(f'{len(permissions)} {options["role"]} permissions, {count} checks each')
+        self.stdout.write(f'  {"subadmin":<22} {"scan":>10} {"mask":>10} {"admin":>10}')
+
+        for name, timings in results.items():
+            per_check = ' '.join(f'{timing / count * 1e9:>8.0f}ns' for timing in timings)
+            self.stdout.write(f'  {name:<22} {per_check}')
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,235 @@
+"""
+Django command comparing the hot position and order queries with and without their indexes.
+"""
+
+import time
+import typing
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+from django.test.utils import CaptureQueriesContext
+from vega import constants
+from vega.models import Order, Portfolio, Position, Symbol
+
+# indexes added by trackrecord 0005, the open position constraint is a unique index
+INDEXES = [
+    'unique_open_position',
+    'closed_position_exit_idx',
+    'closed_position_result_idx',
+    'filled_order_position_idx',
+]
+
+
+class Command(BaseCommand):
+    """Django command to benchmark position and order queries on a synthetic dataset."""
+
+    prefix = 'BENCH'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--orders',
+            type=int,
+            default=10_000_000,
+            help='Number of synthetic filled orders to seed, two per closed position.',
+        )
+        parser.add_argument(
+            '--portfolios',
+            type=int,
+            default=100,
+            help='Number of synthetic portfolios the orders are spread over.',
+        )
+        parser.add_argument(
+            '--symbols',
+            type=int,
+            default=50,
+            help='Number of symbols traded by every portfolio.',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the synthetic portfolios instead of deleting them afterwards.',
+        )
+
+    def cleanup(self, cursor: CursorWrapper) -> None:
+        ids = list(
+            Portfolio.objects.filter(code__startswith=self.prefix).values_list('id', flat=True)
+        )
+
+        for model in (Order, Position, Portfolio):
+            column = 'id' if model is Portfolio else '_portfolio_id'
+            cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column} = ANY(%s);', [ids])
+
+    def seed(self, cursor: CursorWrapper, orders: int, portfolios: int, symbols: int) -> None:
+        symbol_ids = list(Symbol.objects.order_by('id').values_list('id', flat=True)[:symbols])
+        portfolio_ids = [
+            portfolio.pk
+            for portfolio in Portfolio.objects.bulk_create(
+                [
+                    Portfolio(
+                        code=f'{self.prefix}{number:05}',
+                        initial_capital=Decimal('100000'),
+                        allowed_roles=[constants.RoleType.OWNER],
+                        total_wins=0,
+                        total_losses=0,
+                        total_washes=0,
+                        total_trades=0,
+                    )
+                    for number in range(portfolios)
+                ]
+            )
+        ]
+        params = {
+            'portfolios': portfolio_ids,
+            'symbols': symbol_ids,
+            'positions': orders // 2,
+            'long': constants.TrendType.LONG,
+            'open': constants.PositionStatus.OPEN,
+            'closed': constants.PositionStatus.CLOSED,
+            'unknown': constants.ResultType.UNKNOWN,
+            'win': constants.ResultType.WIN,
+            'loss': constants.ResultType.LOSS,
+        }
+        # Closed positions spread over every portfolio and symbol, one hour apart.
+        sql = f"""
+            INSERT INTO {Position._meta.db_table} (
+                _portfolio_id, _symbol_id, trend_type, position_status, entry_stamp,
+                entry_price, entry_amount, exit_stamp, exit_price, exit_amount, real_pnl,
+                duration, result_type
+            )
+            SELECT
+                (%(portfolios)s::BIGINT[])[1 + MOD(g, CARDINALITY(%(portfolios)s::BIGINT[]))],
+                (%(symbols)s::BIGINT[])[1 + MOD(g / 7, CARDINALITY(%(symbols)s::BIGINT[]))],
+                %(long)s, %(closed)s, stamp, 100, 10, stamp + INTERVAL '1 hour',
+                100 + pnl / 10, 10, pnl, INTERVAL '1 hour',
+                CASE WHEN pnl >= 0 THEN %(win)s ELSE %(loss)s END
+            FROM GENERATE_SERIES(1, %(positions)s) AS g,
+                LATERAL (
+                    SELECT
+                        TIMESTAMPTZ '2000-01-01' + g * INTERVAL '1 hour' AS stamp,
+                        ROUND((MOD(g * 7919, 2001) - 1000)::NUMERIC / 10, 2) AS pnl
+                ) AS values;
+        """
+        cursor.execute(sql, params)
+        # One open position per portfolio and symbol.
+        sql = f"""
+            INSERT INTO {Position._meta.db_table} (
+                _portfolio_id, _symbol_id, trend_type, position_status, entry_stamp,
+                entry_price, entry_amount, result_type
+            )
+            SELECT portfolio_id, symbol_id, %(long)s, %(open)s, NOW(), 100, 10, %(unknown)s
+            FROM UNNEST(%(portfolios)s::BIGINT[]) AS portfolio_id,
+                UNNEST(%(symbols)s::BIGINT[]) AS symbol_id;
+        """
+        cursor.execute(sql, params)
+        sql = f"""
+            INSERT INTO {Order._meta.db_table} (
+                _portfolio_id, _symbol_id, _position_id, order_type, order_action,
+                order_status, sent_stamp, sent_price, sent_amount, filled_stamp,
+                filled_price, filled_amount, fees
+            )
+            SELECT
+                p._portfolio_id, p._symbol_id, p.id, %s, legs.action, %s, legs.stamp,
+                legs.price, 10, legs.stamp, legs.price, 10, 1
+            FROM {Position._meta.db_table} p
+            CROSS JOIN LATERAL (
+                VALUES (%s, p.entry_stamp, p.entry_price), (%s, p.exit_stamp, p.exit_price)
+            ) AS legs (action, stamp, price)
+            WHERE p._portfolio_id = ANY(%s) AND legs.stamp IS NOT NULL;
+        """
+        cursor.execute(
+            sql,
+            [
+                constants.OrderType.MARKET,
+                constants.OrderStatus.FILLED,
+                constants.OrderAction.BUY,
+                constants.OrderAction.SELL,
+                portfolio_ids,
+            ],
+        )
+
+        for model in (Position, Order):
+            cursor.execute(f'ANALYZE {model._meta.db_table};')
+
+    def queries(self) -> typing.Dict[str, typing.Callable]:
+        portfolio = Portfolio.objects.filter(code__startswith=self.prefix).first()
+        position = Position.objects.filter(_portfolio=portfolio).order_by('-id').first()
+        closed = Position.objects.get_queryset().closed_positions().filter(_portfolio=portfolio)
+        orders = Order.objects.get_queryset().filter(_position=position)
+
+        return {
+            'open position lookup': lambda: Position.objects.get_queryset().open_position_by(
+                portfolio.pk, getattr(position, '_symbol_id')
+            ),
+            'closed positions by exit': lambda: list(
+                closed.order_by('exit_stamp', 'id').values_list('id', flat=True)[:100]
+            ),
+            'result totals': lambda: closed.result_totals(),
+            'position order stats': lambda: orders.order_stats(),
+        }
+
+    def explain(self, cursor: CursorWrapper, query: typing.Callable) -> float:
+        """
+        Runs `query` and returns the execution time (ms) of the plans of the SQL it ran.
+        """
+        with CaptureQueriesContext(connection) as captured:
+            query()
+
+        elapsed = 0.0
+
+        for executed in captured.captured_queries:
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {executed["sql"]}')
+
+            for (line,) in cursor.fetchall():
+                self.stdout.write(f'    {line}')
+
+                if line.startswith('Execution Time:'):
+                    elapsed += float(line.split()[2])
+
+        return elapsed
+
+    def compare(self, cursor: CursorWrapper) -> typing.Dict[str, typing.List[float]]:
+        timings: typing.Dict[str, typing.List[float]] = {}
+
+        for name, query in self.queries().items():
+            self.stdout.write(f'{name} (indexed):')
+            timings[name] = [self.explain(cursor, query)]
+
+        # Indexes are dropped inside a transaction that is rolled back afterwards.
+        with transaction.atomic():
+            for name in INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name};')
+
+            for name, query in self.queries().items():
+                self.stdout.write(f'{name} (without indexes):')
+                timings[name].append(self.explain(cursor, query))
+
+            transaction.set_rollback(True)
+
+        return timings
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        if not Symbol.objects.exists():
+            raise CommandError('Symbols are empty, run import_data first.')
+
+        with connection.cursor() as cursor:
+            self.cleanup(cursor)
+            started = time.perf_counter()
+            self.stdout.write(f'Seeding {options["orders"]} synthetic orders...')
+            self.seed(cursor, options['orders'], options['portfolios'], options['symbols'])
+            self.stdout.write(f'Seeded in {time.perf_counter() - started:.3f}s')
+
+            try:
+                timings = self.compare(cursor)
+            finally:
+                if not options['keep']:
+                    self.cleanup(cursor)
+
+        self.stdout.write(f'  {"query":<28} {"indexed":>12} {"unindexed":>12}')
+
+        for name, (indexed, unindexed) in timings.items():
+            self.stdout.write(f'  {name:<28} {indexed:>10.3f}ms {unindexed:>10.3f}ms')
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,103 @@
+"""
+Django command comparing the join based and the resolver based symbol resolution.
+"""
+
+import time
+import typing
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from vega.models import Exchange, Market, Security, Symbol, TempSymbol
+
+
+class Command(BaseCommand):
+    """Django command to benchmark symbol resolution on a synthetic staging table."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=2_000_000,
+            help='Number of synthetic temp symbols to stage.',
+        )
+
+    def seed(self, cursor: CursorWrapper, rows: int) -> None:
+        table_name = TempSymbol.objects.table_name
+        columns = TempSymbol.objects.get_import_columns()
+        sql = f"""
+            WITH codes AS (
+                SELECT
+                    (SELECT ARRAY_AGG(code) FROM dataset_exchange) AS exchanges,
+                    (SELECT ARRAY_AGG(code) FROM dataset_market) AS markets,
+                    (SELECT ARRAY_AGG(code) FROM dataset_security) AS securities,
+                    (SELECT ARRAY_AGG(code) FROM dataset_siccode) AS sic_codes,
+                    (SELECT ARRAY_AGG(code) FROM dataset_naicscode) AS naics_codes
+            )
+            INSERT INTO {table_name} ({columns})
+            SELECT
+                'BENCH' || g,
+                'Synthetic symbol ' || g,
+                exchanges[1 + MOD(g, CARDINALITY(exchanges))],
+                markets[1 + MOD(g, CARDINALITY(markets))],
+                securities[1 + MOD(g, CARDINALITY(securities))],
+                CASE
+                    WHEN MOD(g, 3) > 0 THEN sic_codes[1 + MOD(g, CARDINALITY(sic_codes))]
+                END,
+                NULL,
+                CASE
+                    WHEN MOD(g, 4) > 0 THEN naics_codes[1 + MOD(g, CARDINALITY(naics_codes))]
+                END
+            FROM codes, GENERATE_SERIES(1, %s) AS g;
+        """
+        cursor.execute(sql, [rows])
+        TempSymbol.objects.analyze_staging_table(cursor)
+
+    def explain(self, cursor: CursorWrapper, sql: str) -> float:
+        started = time.perf_counter()
+        cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}')
+
+        for (line,) in cursor.fetchall():
+            self.stdout.write(f'    {line}')
+
+        return time.perf_counter() - started
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        rows: int = options['rows']
+
+        for manager in (Exchange.objects, Market.objects, Security.objects):
+            if not manager.exists():
+                raise CommandError('Code tables are empty, run import_data first.')
+
+        with connection.cursor() as cursor:
+            TempSymbol.objects.create_staging_table(cursor)
+            resolver = Symbol.objects.get_resolver(TempSymbol.objects)
+
+            try:
+                self.stdout.write(f'Staging {rows} synthetic temp symbols...')
+                self.seed(cursor, rows)
+
+                self.stdout.write('Join based resolution (distinct_symbols):')
+                query = TempSymbol.objects.all().distinct_symbols()
+                joined = self.explain(cursor, str(query.query))
+
+                self.stdout.write('Resolver based resolution:')
+                started = time.perf_counter()
+                result = resolver.resolve(cursor)
+                resolved = time.perf_counter() - started
+                scanned = self.explain(cursor, str(resolver.query().query))
+            finally:
+                resolver.drop(cursor)
+                TempSymbol.objects.drop_staging_table(cursor)
+
+        self.stdout.write(
+            'Resolved {resolved} of {rows} rows, skipped {skipped}, '
+            '{unresolved} columns with unresolved codes'.format(
+                **{**result, 'unresolved': len(result['unresolved'])}
+            )
+        )
+        self.stdout.write(f'  {"join query":<24} {joined:>9.3f}s')
+        self.stdout.write(f'  {"resolver pass":<24} {resolved:>9.3f}s')
+        self.stdout.write(f'  {"resolved scan":<24} {scanned:>9.3f}s')
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
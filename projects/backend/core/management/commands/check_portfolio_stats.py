@@ -0,0 +1,55 @@
+"""
+Django command to verify the incrementally maintained portfolio statistics.
+"""
+
+import typing
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from vega.models import Portfolio, PortfolioStatistic
+
+
+class Command(BaseCommand):
+    """Django command comparing stored portfolio statistics with their positions."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            'portfolios',
+            nargs='*',
+            help='Codes of the portfolios to check, all portfolios when omitted.',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild the statistics of every inconsistent portfolio.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        portfolios = Portfolio.objects.all()
+        rebuild: bool = options['rebuild']
+        inconsistent = 0
+
+        if options['portfolios']:
+            portfolios = portfolios.filter(code__in=options['portfolios'])
+
+        for portfolio in portfolios.iterator():
+            mismatches = PortfolioStatistic.objects.inconsistencies(portfolio)
+
+            if not mismatches:
+                continue
+
+            inconsistent += 1
+            self.stdout.write(self.style.WARNING(f'{portfolio.code} is inconsistent:'))
+
+            for result_type, fields in mismatches.items():
+                for field, (stored, expected) in fields.items():
+                    self.stdout.write(f'  {result_type} {field}: {stored} != {expected}')
+
+            if rebuild:
+                PortfolioStatistic.objects.rebuild(portfolio)
+                self.stdout.write(f'  rebuilt {portfolio.code}')
+
+        if inconsistent and not rebuild:
+            raise CommandError(f'{inconsistent} portfolios have inconsistent statistics')
+
+        self.stdout.write(self.style.SUCCESS('Portfolio statistics are consistent'))
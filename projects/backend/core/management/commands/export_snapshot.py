@@ -0,0 +1,67 @@
+"""
+Django command to export position and order history into columnar files.
+"""
+
+import pathlib
+import time
+import typing
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from vega.models import Portfolio
+from vega.models._exporters import FORMATS
+
+
+class Command(BaseCommand):
+    """Django command streaming positions and orders into Parquet or Arrow IPC files."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            'portfolios',
+            nargs='*',
+            help='Codes of the portfolios to export, all portfolios when omitted.',
+        )
+        parser.add_argument(
+            '--output',
+            type=pathlib.Path,
+            default=pathlib.Path('.'),
+            help='Directory the positions and orders files are written to.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=list(FORMATS),
+            default='parquet',
+            help='Columnar file format.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50_000,
+            help='Rows fetched from the server side cursor and written per batch.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        portfolios = Portfolio.objects.all()
+        output: pathlib.Path = options['output']
+
+        if options['portfolios']:
+            portfolios = portfolios.filter(code__in=options['portfolios'])
+            missing = set(options['portfolios']) - set(portfolios.values_list('code', flat=True))
+
+            if missing:
+                raise CommandError(f'Unknown portfolios: {", ".join(sorted(missing))}')
+
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        output.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        written = Portfolio.objects.export_snapshot(
+            portfolios, output, options['format'], options['batch_size']
+        )
+        elapsed = time.perf_counter() - started
+
+        for file_name, rows in written.items():
+            self.stdout.write(f'  {str(output / file_name):<40} {rows:>12} rows')
+
+        self.stdout.write(self.style.SUCCESS(f'Export complete in {elapsed:.3f}s'))
@@ -2,11 +2,13 @@
 Django command to wait for the database to be available.
 """
 
-import os
+import time
 import typing
+from functools import partial
 
-from django.core.management.base import BaseCommand
-from django.db import connection, transaction
+from core.patterns.pipeline import Stage, StagePipeline
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection
 from django.db.backends.utils import CursorWrapper
 from vega.models import (
     Exchange,
@@ -17,58 +19,264 @@ from vega.models import (
     Symbol,
     TempSymbol,
 )
+from vega.models._ManagerStubs import ImportExportStub
+from vega.models._resolvers import SymbolResolver
 
 
 class Command(BaseCommand):
     """Django command to import Exchanges, Markets, Securities and Symbols."""
 
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            help='Pipe data files through COPY FROM STDIN instead of server side COPY.',
+        )
+        parser.add_argument(
+            '--delta',
+            action='store_true',
+            help='Upsert changed rows and soft delete missing symbols instead of reloading.',
+        )
+        parser.add_argument(
+            '--force-delta',
+            action='store_true',
+            help='Apply the delta even when the feed is empty or far smaller than the symbols.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of stages that may run concurrently, each on its own connection.',
+        )
+        parser.add_argument(
+            '--force-download',
+            action='store_true',
+            help='Download the symbol file even when the stored copy is still current.',
+        )
+        parser.add_argument(
+            '--staging',
+            action='store_true',
+            help='Load temp symbols into an UNLOGGED table created and dropped for this run.',
+        )
+
+    def import_file(self, manager: ImportExportStub, cursor: CursorWrapper, stream: bool) -> None:
+        if stream:
+            manager.stream_from_file(cursor)
+        else:
+            manager.import_from_file(cursor)
+
+    def load_table(
+        self, manager: ImportExportStub, cursor: CursorWrapper, stream: bool, delta: bool
+    ) -> None:
+        if delta:
+            manager.merge_from_file(cursor, stream)
+        else:
+            manager.clear_table(cursor)
+            self.import_file(manager, cursor, stream)
+
+    def download(self, cursor: CursorWrapper, stream: bool, force: bool) -> bool:
+        if stream:
+            # only the archive is needed, its member is streamed into COPY
+            return TempSymbol.objects.fetch_data_file(force)
+
+        return TempSymbol.objects.download_data_file(force)
+
+    def load_temp_symbols(self, cursor: CursorWrapper, stream: bool, staging: bool) -> None:
+        if not staging:
+            TempSymbol.objects.clear_table(cursor)
+
+        if stream:
+            # download is piped straight from the archive into the table
+            TempSymbol.objects.stream_from_file(cursor)
+        else:
+            TempSymbol.objects.import_from_file(cursor)
+
+    def insert_codes(
+        self, cursor: CursorWrapper, manager: ImportExportStub, query: typing.Callable
+    ) -> None:
+        manager.insert_from_temp(cursor, query())
+
+    def apply_delta(
+        self, cursor: CursorWrapper, resolver: SymbolResolver, force: bool
+    ) -> typing.Dict[str, int]:
+        try:
+            return Symbol.objects.apply_delta(cursor, resolver.query(), resolver.codes(), force)
+        except ValueError as exc:
+            raise CommandError(f'{exc}, rerun with --force-delta to apply it anyway') from exc
+
+    def load_symbols(
+        self, cursor: CursorWrapper, delta: bool, force: bool
+    ) -> typing.Dict[str, typing.Any]:
+        resolver = Symbol.objects.get_resolver(TempSymbol.objects)
+        result = resolver.resolve(cursor)
+
+        try:
+            if delta:
+                result['delta'] = self.apply_delta(cursor, resolver, force)
+            else:
+                Symbol.objects.insert_from_temp(cursor, resolver.query())
+        finally:
+            resolver.drop(cursor)
+
+        return result
+
+    def cleanup(self, cursor: CursorWrapper, stream: bool, staging: bool) -> None:
+        if not stream:
+            TempSymbol.objects.remove_data_file()
+
+        if staging:
+            TempSymbol.objects.drop_staging_table(cursor)
+        else:
+            TempSymbol.objects.clear_table(cursor)
+
+    def build_pipeline(
+        self,
+        workers: int,
+        stream: bool,
+        delta: bool,
+        force: bool,
+        staging: bool,
+        force_delta: bool = False,
+    ) -> StagePipeline:
+        pipeline = StagePipeline(workers)
+        qs = TempSymbol.objects.all()
+        related = [
+            ('naics', NaicsCode.objects, 'NAICS codes', qs.distinct_naics),
+            ('sic', SicCode.objects, 'SIC codes', qs.distinct_sic),
+            ('exchanges', Exchange.objects, 'Exchanges', qs.distinct_exchanges),
+            ('securities', Security.objects, 'Securities', qs.distinct_securities),
+        ]
+
+        # Reference tables and the download are independent of each other.
+        for name, manager, label, _ in related:
+            pipeline.add(
+                f'load_{name}',
+                partial(self.load_table, manager, stream=stream, delta=delta),
+                message=f'Imported {label}...',
+            )
+
+        pipeline.add(
+            'download',
+            partial(self.download, stream=stream, force=force),
+            message='Download complete...',
+        )
+        loaded = 'load_temp_symbols'
+
+        if staging:
+            pipeline.add(
+                'create_staging',
+                TempSymbol.objects.create_staging_table,
+                message='Created staging table...',
+            )
+            pipeline.add(
+                'load_temp_symbols',
+                partial(self.load_temp_symbols, stream=stream, staging=staging),
+                ['download', 'create_staging'],
+                'Import of temp symbols complete...',
+            )
+            pipeline.add(
+                'analyze_staging',
+                TempSymbol.objects.analyze_staging_table,
+                ['load_temp_symbols'],
+                'Analyzed staging table...',
+            )
+            loaded = 'analyze_staging'
+        else:
+            pipeline.add(
+                'load_temp_symbols',
+                partial(self.load_temp_symbols, stream=stream, staging=staging),
+                ['download'],
+                'Import of temp symbols complete...',
+            )
+
+        # Codes only present in the symbol feed are added once the reference
+        # table they belong to has been loaded.
+        inserts = [
+            (f'insert_{name}', manager, label, query, [f'load_{name}'])
+            for name, manager, label, query in related
+        ]
+        inserts.append(('insert_markets', Market.objects, 'Markets', qs.distinct_markets, []))
+
+        for name, manager, label, query, dependencies in inserts:
+            pipeline.add(
+                name,
+                partial(self.insert_codes, manager=manager, query=query),
+                [loaded, *dependencies],
+                f'Inserted new {label}...',
+            )
+
+        # Symbols reference every code table so they wait for all of them.
+        pipeline.add(
+            'load_symbols',
+            partial(self.load_symbols, delta=delta, force=force_delta),
+            [name for name, *_ in inserts],
+            'Inserted related symbols...',
+        )
+        pipeline.add(
+            'cleanup',
+            partial(self.cleanup, stream=stream, staging=staging),
+            ['load_symbols'],
+            'Temp Symbols cleared',
+        )
+
+        return pipeline
+
+    def report_symbols(self, result: typing.Dict[str, typing.Any]) -> None:
+        self.stdout.write(
+            'Resolved {resolved} of {rows} temp symbols, skipped {skipped}...'.format(**result)
+        )
+
+        for column, codes in result['unresolved'].items():
+            listed = ', '.join(sorted(codes, key=codes.get, reverse=True)[:10])
+            self.stdout.write(
+                self.style.WARNING(f'  {len(codes)} unresolved {column} codes: {listed}')
+            )
+
+        if 'delta' in result:
+            self.stdout.write(
+                'Applied symbol delta: {inserted} inserted, {updated} updated, '
+                '{delisted} delisted...'.format(**result['delta'])
+            )
+        else:
+            self.stdout.write('Inserted related symbols...')
+
+    def report(self, stage: Stage) -> None:
+        if stage.name == 'load_symbols':
+            self.report_symbols(stage.result)
+        elif stage.name == 'download' and stage.result is False:
+            self.stdout.write('Symbol file unchanged, download skipped...')
+        elif stage.message:
+            self.stdout.write(stage.message)
+
     def handle(self, *args: typing.Any, **options: typing.Any) -> None:
         """Entrypoint for command"""
         self.stdout.write('Starting data import...')
 
-        cursor: CursorWrapper = connection.cursor()
-
-        self.stdout.write('Clear original tables...')
-        NaicsCode.objects.clear_table(cursor)
-        NaicsCode.objects.import_from_file(cursor)
-        self.stdout.write('Imported NAICS codes...')
-        SicCode.objects.clear_table(cursor)
-        SicCode.objects.import_from_file(cursor)
-        self.stdout.write('Imported SIC codes...')
-        Exchange.objects.clear_table(cursor)
-        Exchange.objects.import_from_file(cursor)
-        self.stdout.write('Imported Exchanges...')
-        Security.objects.clear_table(cursor)
-        Security.objects.import_from_file(cursor)
-        self.stdout.write('Imported Securities...')
-        self.stdout.write('Import of related entities complete...')
-
-        TempSymbol.objects.download_data_file()
-        self.stdout.write('Download complete...')
-
-        TempSymbol.objects.clear_table(cursor)
-        TempSymbol.objects.import_from_file(cursor)
-        self.stdout.write('Import of temp symbols complete...')
+        stream: bool = options['stream']
+        delta: bool = options['delta']
+        workers: int = options['workers']
+        force: bool = options['force_download']
+        staging: bool = options['staging']
+        force_delta: bool = options['force_delta']
 
-        qs = TempSymbol.objects.all()
-        Exchange.objects.insert_from_temp(cursor, qs.distinct_exchanges())
-        self.stdout.write('Inserted new Exchanges...')
-        Market.objects.insert_from_temp(cursor, qs.distinct_markets())
-        self.stdout.write('Inserted new Markets...')
-        Security.objects.insert_from_temp(cursor, qs.distinct_securities())
-        self.stdout.write('Inserted new Securities...')
-        NaicsCode.objects.insert_from_temp(cursor, qs.distinct_naics())
-        self.stdout.write('Inserted new NAICS codes...')
-        SicCode.objects.insert_from_temp(cursor, qs.distinct_sic())
-        self.stdout.write('Inserted new SIC codes...')
-        Symbol.objects.insert_from_temp(cursor, qs.distinct_symbols())
-        self.stdout.write('Inserted related symbols...')
-
-        TempSymbol.objects.remove_data_file()
-        self.stdout.write('File removed...')
-
-        TempSymbol.objects.clear_table(cursor)
-        connection.close()
-        self.stdout.write(self.style.SUCCESS('Temp Symbols cleared'))
+        if not delta:
+            self.stdout.write('Clear original tables...')
+
+        pipeline = self.build_pipeline(workers, stream, delta, force, staging, force_delta)
+        started = time.perf_counter()
+
+        try:
+            pipeline.run(self.report)
+        finally:
+            if TempSymbol.objects.staging_table:
+                with connection.cursor() as cursor:
+                    TempSymbol.objects.drop_staging_table(cursor)
+
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write('Stage timings:')
+        for stage in pipeline.timings():
+            self.stdout.write(f'  {stage.name:<20} {stage.duration or 0:>9.3f}s')
+        self.stdout.write(f'  {"total":<20} {elapsed:>9.3f}s')
 
         self.stdout.write(self.style.SUCCESS('Import data complete'))
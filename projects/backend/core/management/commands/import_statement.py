@@ -0,0 +1,71 @@
+"""
+Django command to import the trades of a broker statement into a portfolio.
+"""
+
+import time
+import typing
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from vega.models import Order, Portfolio
+from vega.models._statements import PROFILES
+
+
+class Command(BaseCommand):
+    """Django command loading broker CSV or OFX statements as filled orders."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('portfolio', help='Code of the portfolio the trades belong to.')
+        parser.add_argument('statement', help='Path of the CSV or OFX statement.')
+        parser.add_argument(
+            '--profile',
+            choices=list(PROFILES),
+            default='generic',
+            help='Column mapping of the CSV statement, OFX statements are always generic.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ofx'],
+            help='Statement format, guessed from the file extension when omitted.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows written per INSERT / UPDATE statement.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        portfolio = Portfolio.objects.filter(code=options['portfolio']).first()
+
+        if portfolio is None:
+            raise CommandError(f'Unknown portfolio {options["portfolio"]}')
+
+        started = time.perf_counter()
+
+        try:
+            result = Order.objects.import_statement(
+                portfolio,
+                options['statement'],
+                options['profile'],
+                options['format'],
+                options['batch_size'],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            'Imported {fills} of {rows} statement rows, skipped {skipped}...'.format(**result)
+        )
+
+        if result['unresolved']:
+            codes = result['unresolved']
+            listed = ', '.join(sorted(codes, key=codes.get, reverse=True)[:10])
+            self.stdout.write(self.style.WARNING(f'  {len(codes)} unresolved symbols: {listed}'))
+
+        self.stdout.write(
+            'Wrote {orders} orders, opened {opened} of {positions} positions...'.format(**result)
+        )
+        self.stdout.write(self.style.SUCCESS(f'Statement import complete in {elapsed:.3f}s'))
@@ -0,0 +1,52 @@
+"""
+Django command to mark the open positions to the prices of a price file.
+"""
+
+import time
+import typing
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from vega.models import Position
+from vega.models._prices import PriceCache
+
+
+class Command(BaseCommand):
+    """Django command refreshing the unrealized pnl of open positions from a price feed."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            'prices', help='Path of a symbol_id,price CSV file, rewritten by the feed.'
+        )
+        parser.add_argument(
+            '--ttl',
+            type=float,
+            default=30.0,
+            help='Seconds a price is used for marking after it was read.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.0,
+            help='Seconds between marks, mark once when 0.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        cache = PriceCache(ttl=options['ttl'])
+
+        while True:
+            started = time.perf_counter()
+
+            try:
+                loaded = cache.load(options['prices'])
+            except OSError as exc:
+                raise CommandError(str(exc)) from exc
+
+            updated = Position.objects.mark_to_market(cache)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'Marked {updated} positions with {loaded} prices in {elapsed:.3f}s')
+
+            if not options['interval']:
+                break
+
+            time.sleep(max(options['interval'] - elapsed, 0))
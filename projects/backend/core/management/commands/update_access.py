@@ -0,0 +1,57 @@
+"""
+Django command to grant or revoke roles on many portfolios at once.
+"""
+
+import typing
+
+from core.patterns.management import MembershipCache
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from vega import constants
+from vega.models import Portfolio
+
+
+class Command(BaseCommand):
+    """Django command updating the allowed roles and record type of portfolios in bulk."""
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            'portfolios', nargs='*', help='Codes of the portfolios to update, all when omitted.'
+        )
+        parser.add_argument(
+            '--grant',
+            action='append',
+            choices=constants.RoleType.values,
+            default=[],
+            help='Role added to the allowed roles, may be repeated.',
+        )
+        parser.add_argument(
+            '--revoke',
+            action='append',
+            choices=constants.RoleType.values,
+            default=[],
+            help='Role removed from the allowed roles, may be repeated.',
+        )
+        parser.add_argument(
+            '--record-type',
+            choices=constants.RecordType.values,
+            help='Record type set on the portfolios.',
+        )
+
+    def handle(self, *args: typing.Any, **options: typing.Any) -> None:
+        """Entrypoint for command"""
+        if not (options['grant'] or options['revoke'] or options['record_type']):
+            raise CommandError('Nothing to update, pass --grant, --revoke or --record-type.')
+
+        queryset = Portfolio.objects.all()
+
+        if options['portfolios']:
+            queryset = queryset.filter(code__in=options['portfolios'])
+
+        changed = Portfolio.objects.update_access(
+            queryset, options['grant'], options['revoke'], options['record_type']
+        )
+
+        for portfolio_id in changed:
+            MembershipCache.invalidate(portfolio_id)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated the access of {len(changed)} portfolios'))
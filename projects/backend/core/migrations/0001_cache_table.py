@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+def drop_cache_table(apps, schema_editor):
+    for alias in settings.CACHES:
+        if settings.CACHES[alias]['BACKEND'].endswith('DatabaseCache'):
+            table = schema_editor.quote_name(settings.CACHES[alias]['LOCATION'])
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(create_cache_table, drop_cache_table),
+    ]
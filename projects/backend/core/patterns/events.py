@@ -1,73 +1,383 @@
-
 import datetime
+import functools
+import itertools
 import json
+import queue
 import threading
+import time
 import typing
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
-from vega.constants import ActionType, CollectionName
-from vega.models import Permission, Portfolio, Subscription
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
 from vega.models._ModelStubs import EventBridgeStub
 
+# limits of one PutEvents call
+MAX_ENTRIES = 10
+
+MAX_BYTES = 256 * 1024
+
+
+def entry_size(entry: dict) -> int:
+    """
+    Size of an entry as EventBridge counts it against the request limit.
+    """
+    size = 14 if entry.get('Time') else 0
+
+    for key in ('Source', 'DetailType', 'Detail'):
+        size += len((entry.get(key) or '').encode('utf-8'))
+
+    return size + sum(len(resource.encode('utf-8')) for resource in entry.get('Resources', []))
+
+
+def chunk_entries(
+    entries: typing.Iterable[dict], max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES
+) -> typing.Iterator[typing.List[dict]]:
+    """
+    Splits entries into the fewest consecutive chunks within the entry and byte limits.
+    """
+    chunk: typing.List[dict] = []
+    size = 0
+
+    for entry in entries:
+        entry_bytes = entry_size(entry)
+
+        if chunk and (len(chunk) == max_entries or size + entry_bytes > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+
+        chunk.append(entry)
+        size += entry_bytes
+
+    if chunk:
+        yield chunk
+
+
+class StubEventsClient:
+    """
+    Local stand-in for the boto3 `events` client.
+
+    Records every accepted entry.  `fail` decides per entry whether it is rejected, its
+    result is the error code to return (or None to accept), so partial failures and
+    retries can be exercised without AWS.
+    """
+
+    def __init__(
+        self,
+        fail: typing.Callable[[dict], str | None] | None = None,
+        delay: float = 0.0,
+    ) -> None:
+        self.fail = fail
+        self.delay = delay
+        self.calls: typing.List[typing.List[dict]] = []
+        self.accepted: typing.List[dict] = []
+        self._lock = threading.Lock()
+
+    def put_events(self, Entries: typing.List[dict], **kwargs: typing.Any) -> dict:
+        if len(Entries) > MAX_ENTRIES or sum(map(entry_size, Entries)) > MAX_BYTES:
+            raise ValueError('PutEvents request is over the entry or size limit')
+
+        time.sleep(self.delay)
+        results = []
+
+        with self._lock:
+            self.calls.append(list(Entries))
+
+            for entry in Entries:
+                error = self.fail(entry) if self.fail else None
+
+                if error:
+                    results.append({'ErrorCode': error, 'ErrorMessage': error})
+                else:
+                    self.accepted.append(entry)
+                    results.append({'EventId': str(uuid.uuid4())})
+
+        failed = sum(1 for result in results if 'ErrorCode' in result)
+
+        return {'FailedEntryCount': failed, 'Entries': results}
+
+
+class PublisherMetrics:
+    """
+    Counters and latencies of the publisher, safe to update from every worker.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.published = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.calls = 0
+        self.call_seconds = 0.0
+        self.delivery_seconds = 0.0
+        self.max_delivery_seconds = 0.0
+
+    def add(self, **counts: float) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def delivered(self, enqueued: typing.Iterable[float]) -> None:
+        now = time.monotonic()
+        latencies = [now - stamp for stamp in enqueued]
+
+        with self._lock:
+            self.published += len(latencies)
+            self.delivery_seconds += sum(latencies)
+            self.max_delivery_seconds = max([self.max_delivery_seconds, *latencies])
+
+    def snapshot(self, depth: int = 0) -> typing.Dict[str, float]:
+        """
+        Current counters, with the number of events waiting to be sent as `depth`.
+        """
+        with self._lock:
+            return {
+                'depth': depth,
+                'in_flight': self.in_flight,
+                'published': self.published,
+                'failed': self.failed,
+                'retried': self.retried,
+                'rejected': self.rejected,
+                'calls': self.calls,
+                'avg_call_seconds': self.call_seconds / self.calls if self.calls else 0.0,
+                'avg_delivery_seconds': (
+                    self.delivery_seconds / self.published if self.published else 0.0
+                ),
+                'max_delivery_seconds': self.max_delivery_seconds,
+            }
+
 
 class EventBridge(object):
-    _instance = None
+    """
+    Publishes events to EventBridge in batches, after the transaction that raised them.
 
-    _lock = threading.Lock()
+    Events saved inside a transaction are handed to the publisher by `on_commit`, so a
+    rollback (of the transaction or of a savepoint) drops them.  A dispatcher thread
+    collects the committed events, waits up to `linger` seconds for more and splits
+    them into chunks within the PutEvents limits of 10 entries and 256KB.  Chunks are
+    sent concurrently by a thread pool; only the entries the response reports as failed
+    are retried, with exponential backoff, before they are counted as failed.
 
-    _client = None
+    The client is created on first use unless one is passed to `configure`, which is
+    how tests run against `StubEventsClient`.
+    """
 
-    _events = None
+    _instance = None
+
+    _lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            print('Creating event bridge object')
-            cls._instance = super(EventBridge, cls).__new__(cls)
-            cls._client = boto3.client('events')
-            cls._events = []
+            with cls._lock:
+                if cls._instance is None:
+                    print('Creating event bridge object')
+                    instance = super(EventBridge, cls).__new__(cls)
+                    instance.configure()
+                    cls._instance = instance
 
         return cls._instance
-    
+
+    def configure(
+        self,
+        client: typing.Any = None,
+        workers: int = 4,
+        retries: int = 3,
+        backoff: float = 0.1,
+        linger: float = 0.05,
+        max_entries: int = MAX_ENTRIES,
+        max_bytes: int = MAX_BYTES,
+    ) -> None:
+        """
+        Sets the client and the batching options, replacing any running workers.
+        """
+        if getattr(self, '_executor', None):
+            self.shutdown()
+
+        self._client = client
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.linger = linger
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.metrics = PublisherMetrics()
+        self._queue: queue.Queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='eventbridge')
+        self._dispatcher: threading.Thread | None = None
+        self._idle = threading.Condition()
+
+    @property
+    def client(self) -> typing.Any:
+        if self._client is None:
+            self._client = boto3.client('events')
+
+        return self._client
+
     @staticmethod
     def build_event(source: str, detail_type: str, instance: EventBridgeStub) -> dict:
         return {
-            'Time': datetime.datetime.now(),
+            'Time': datetime.datetime.now(datetime.timezone.utc),
             'Source': source,
             'Resources': [],
             'DetailType': detail_type,
-            'Detail': {
-                'id': instance.getId()
-            },
+            'Detail': {'id': instance.getId()},
             'EventBusName': 'ambient',
-            'TraceHeader': uuid.uuid4()
+            'TraceHeader': str(uuid.uuid4()),
         }
 
     @staticmethod
     def created_event(source: str, detail_type: str, instance: EventBridgeStub) -> dict:
         return EventBridge.build_event(source, detail_type, instance)
-        
+
     @staticmethod
     def updated_event(source: str, detail_type: str, instance: EventBridgeStub) -> dict:
         return EventBridge.build_event(source, detail_type, instance)
-        
+
     @staticmethod
     def deleted_event(source: str, detail_type: str, instance: EventBridgeStub) -> dict:
         return EventBridge.build_event(source, detail_type, instance)
-        
-    def save_event(self, event: dict) -> None:
-        self._events.append(event)
-    
-    def send_events(self) -> list:
-        items = []
-        responses = []
-
-        for event in self._events:
-            if not isinstance(event['Detail'], str):
-                event['Detail'] = json.dumps(event['Detail'])
-                items.append(event)
-
-        if items.length > 0:
-            responses.append(self._client.put_events(items))
-
-        return responses
+
+    def save_event(self, event: dict, using: str = DEFAULT_DB_ALIAS) -> None:
+        """
+        Queues an event, once the current transaction (if any) commits.
+        """
+        entry = dict(event)
+
+        if not isinstance(entry['Detail'], str):
+            entry['Detail'] = json.dumps(entry['Detail'], default=str)
+
+        if connections[using].in_atomic_block:
+            transaction.on_commit(functools.partial(self.enqueue, entry), using=using)
+        else:
+            self.enqueue(entry)
+
+    def enqueue(self, entry: dict) -> None:
+        if entry_size(entry) > self.max_bytes:
+            self.metrics.add(rejected=1)
+            return
+
+        self.metrics.add(queued=1)
+        self._queue.put((entry, time.monotonic()))
+        self.start()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(
+                    target=self.dispatch, name='eventbridge-dispatcher', daemon=True
+                )
+                self._dispatcher.start()
+
+    def collect(self) -> typing.List[typing.Tuple[dict, float]]:
+        """
+        Blocks for the next event, then gathers the events queued within `linger`.
+        """
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return items
+
+    def dispatch(self) -> None:
+        while True:
+            collected = self.collect()
+            items = [item for item in collected if item is not None]
+
+            if not items:
+                return
+            if len(items) != len(collected):
+                # send the events collected with the stop marker before stopping
+                self._queue.put(None)
+
+            self.metrics.add(queued=-len(items), in_flight=len(items))
+            stamps = {id(entry): stamp for entry, stamp in items}
+            entries = (entry for entry, _ in items)
+
+            for chunk in chunk_entries(entries, self.max_entries, self.max_bytes):
+                pending = [(entry, stamps[id(entry)]) for entry in chunk]
+                self._executor.submit(self.send_chunk, pending)
+
+    def send_chunk(self, pending: typing.List[typing.Tuple[dict, float]]) -> None:
+        """
+        Sends one chunk, retrying only the entries that failed until `retries` runs out.
+        """
+        for attempt in itertools.count():
+            started = time.monotonic()
+
+            try:
+                response = self.client.put_events(Entries=[entry for entry, _ in pending])
+                results = response.get('Entries', [])
+            except Exception:
+                results = []
+
+            if len(results) != len(pending):
+                results = [{'ErrorCode': 'ClientError'}] * len(pending)
+
+            self.metrics.add(calls=1, call_seconds=time.monotonic() - started)
+            failed = [item for item, result in zip(pending, results) if 'ErrorCode' in result]
+            sent = [item[1] for item, result in zip(pending, results) if 'ErrorCode' not in result]
+            self.metrics.delivered(sent)
+            self.metrics.add(in_flight=-len(sent))
+
+            if not failed:
+                break
+            if attempt >= self.retries:
+                self.metrics.add(failed=len(failed), in_flight=-len(failed))
+                break
+
+            self.metrics.add(retried=len(failed))
+            time.sleep(self.backoff * 2**attempt)
+            pending = failed
+
+        with self._idle:
+            self._idle.notify_all()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() + self.metrics.in_flight
+
+    def stats(self) -> typing.Dict[str, float]:
+        return self.metrics.snapshot(self._queue.qsize())
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Waits until every queued event was sent or failed, returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._idle:
+            while self.metrics.queued or self.metrics.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                self._idle.wait(0.05 if remaining is None else min(remaining, 0.05))
+
+        return True
+
+    def send_events(self) -> typing.Dict[str, float]:
+        self.flush()
+
+        return self.stats()
+
+    def shutdown(self) -> None:
+        """
+        Sends the queued events and stops the dispatcher and the workers.
+        """
+        self.flush()
+
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            self._queue.put(None)
+            self._dispatcher.join()
+
+        self._executor.shutdown(wait=True)
@@ -1,27 +1,187 @@
-
-import datetime
-import json
+import contextvars
+import dataclasses
 import threading
+import time
 import typing
-import uuid
 
-import boto3
+from django.contrib.auth.models import AbstractBaseUser, AnonymousUser
+from django.core.cache import cache
+from django.db.models import signals
+from django.dispatch import receiver
+from vega import constants
 from vega.constants import ActionType, CollectionName
 from vega.models import Permission, Portfolio, Subscription
-from vega.models._ModelStubs import EventBridgeStub
+
+# row of each collection and bit of each action in a permission mask
+COLLECTION_ROWS = {collection: row for row, collection in enumerate(CollectionName.values)}
+
+ACTION_BITS = {action: 1 << bit for bit, action in enumerate(ActionType.values)}
+
+
+@dataclasses.dataclass(frozen=True)
+class PermissionMask:
+    """
+    Enabled actions of a set of permissions, one bitmask per collection.
+
+    Compiled once from the permissions of a membership, so every check is an index and
+    a bitwise and instead of a scan of the permissions and their action arrays.
+    """
+
+    rows: typing.Tuple[int, ...] = (0,) * len(COLLECTION_ROWS)
+
+    @classmethod
+    def compile(cls, permissions: typing.Iterable[Permission]) -> 'PermissionMask':
+        rows = [0] * len(COLLECTION_ROWS)
+
+        for perm in permissions:
+            if perm.enabled and perm.collection in COLLECTION_ROWS:
+                for action in perm.actions:
+                    rows[COLLECTION_ROWS[perm.collection]] |= ACTION_BITS.get(action, 0)
+
+        return cls(tuple(rows))
+
+    def allows(self, collections: typing.Iterable[CollectionName], action: ActionType) -> bool:
+        bit = ACTION_BITS.get(action, 0)
+
+        for collection in collections:
+            row = COLLECTION_ROWS.get(collection)
+
+            if row is not None and self.rows[row] & bit:
+                return True
+
+        return False
+
+
+@dataclasses.dataclass(frozen=True)
+class MembershipContext:
+    """
+    Portfolio, subscription and permissions of the user of the current request.
+    """
+
+    portfolio: Portfolio | None = None
+
+    subscription: Subscription | None = None
+
+    permissions: typing.Tuple[Permission, ...] = ()
+
+    mask: PermissionMask = dataclasses.field(init=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'mask', PermissionMask.compile(self.permissions))
+
+
+_membership: contextvars.ContextVar[MembershipContext] = contextvars.ContextVar(
+    'membership', default=MembershipContext()
+)
+
+
+class MembershipCache:
+    """
+    Versioned cache of the membership context per portfolio and user.
+
+    Every portfolio has a version number in the cache and the contexts of its users are
+    cached under it.  Invalidating a portfolio increments its version, so all of its
+    cached contexts are missed at once without knowing their keys.  The default cache is
+    the database cache of the settings, so an invalidation from any worker or management
+    command is seen by every process.  A missing version starts at the current time so
+    contexts cached under an evicted version are never read again.
+    """
+
+    timeout = 300
+
+    # layout of the cached contexts, changed whenever MembershipContext changes
+    schema = 2
+
+    # portfolio fields read from the context, other changes keep the cached contexts
+    portfolio_fields = {'allowed_roles', 'record_type'}
+
+    @staticmethod
+    def version_key(portfolio_id: int) -> str:
+        return f'membership:{portfolio_id}:version'
+
+    @classmethod
+    def version(cls, portfolio_id: int) -> int:
+        key = cls.version_key(portfolio_id)
+        cache.add(key, time.time_ns(), timeout=None)
+
+        return cache.get(key)
+
+    @classmethod
+    def key(cls, portfolio_id: int, user_id: int | None) -> str:
+        version = cls.version(portfolio_id)
+
+        return f'membership:{cls.schema}:{portfolio_id}:{user_id or 0}:{version}'
+
+    @classmethod
+    def invalidate(cls, portfolio_id: int) -> None:
+        try:
+            cache.incr(cls.version_key(portfolio_id))
+        except ValueError:
+            cache.add(cls.version_key(portfolio_id), time.time_ns(), timeout=None)
+
+    @staticmethod
+    def build(portfolio_id: int, user: AbstractBaseUser | AnonymousUser) -> MembershipContext:
+        portfolio = Portfolio.objects.filter(pk=portfolio_id).first()
+
+        if portfolio is None:
+            return MembershipContext()
+
+        subscription = None
+
+        if user.is_authenticated:
+            subscription = portfolio.subscriptions.filter(user_id=user.pk).first()
+
+        role_type = subscription.role if subscription else constants.RoleType.GUEST
+        permissions = tuple(portfolio.permissions.filter(role=role_type))
+
+        return MembershipContext(portfolio, subscription, permissions)
+
+    @classmethod
+    def load(cls, portfolio_id: int, user: AbstractBaseUser | AnonymousUser) -> MembershipContext:
+        """
+        Membership context of a user in a portfolio, queried only on a cache miss.
+        """
+        key = cls.key(portfolio_id, user.pk if user.is_authenticated else None)
+        context = cache.get(key)
+
+        if context is None:
+            context = cls.build(portfolio_id, user)
+            cache.set(key, context, timeout=cls.timeout)
+
+        return context
+
+
+@receiver(signals.post_save, sender=Permission)
+@receiver(signals.post_delete, sender=Permission)
+@receiver(signals.post_save, sender=Subscription)
+@receiver(signals.post_delete, sender=Subscription)
+def membership_changed(sender, instance: Permission | Subscription, **kwargs) -> None:
+    MembershipCache.invalidate(instance.portfolio_id)
+
+
+@receiver(signals.post_save, sender=Portfolio)
+@receiver(signals.post_delete, sender=Portfolio)
+def portfolio_changed(sender, instance: Portfolio, **kwargs) -> None:
+    update_fields = kwargs.get('update_fields')
+
+    if update_fields is None or MembershipCache.portfolio_fields.intersection(update_fields):
+        MembershipCache.invalidate(instance.pk)
 
 
 class MembershipManagement:
+    """
+    Membership of the current request, shared by the middleware and the admin.
+
+    The instance is a process wide singleton but holds no state itself, the values live
+    in a context variable.  Every request (thread or asyncio task) sees only the
+    context activated for it, so concurrent requests can not read each other's
+    permissions.
+    """
+
     _instance = None
 
     _lock = threading.Lock()
 
-    _values = {
-        'portfolio': None,
-        'subscription': None,
-        'permissions': []
-    }
-
     def __new__(cls):
         if cls._instance is None:
             print('Creating membership storage object')
@@ -33,40 +193,45 @@ class MembershipManagement:
                     cls._instance = super().__new__(cls)
         return cls._instance
 
+    @property
+    def context(self) -> MembershipContext:
+        return _membership.get()
+
+    def activate(self, context: MembershipContext) -> contextvars.Token:
+        return _membership.set(context)
+
+    def reset(self, token: contextvars.Token) -> None:
+        _membership.reset(token)
+
     def has_value(self, key: str) -> bool:
-        return key in self._values.keys
+        return getattr(self.context, key, None) is not None
 
-    @property
     def values(self, key: str) -> object:
-        return self._values[key]
+        return getattr(self.context, key)
 
     @property
     def portfolio(self) -> Portfolio:
-        return self._values['portfolio']
+        return self.context.portfolio
 
     @portfolio.setter
     def portfolio(self, value: Portfolio) -> None:
-        self._values['portfolio'] = value
+        self.activate(dataclasses.replace(self.context, portfolio=value))
 
     @property
     def subscription(self) -> Subscription:
-        return self._values['subscription']
+        return self.context.subscription
 
     @subscription.setter
     def subscription(self, value: Subscription) -> None:
-        self._values['subscription'] = value
+        self.activate(dataclasses.replace(self.context, subscription=value))
 
     @property
     def permissions(self) -> typing.List[Permission]:
-        return self._values['permissions']
+        return list(self.context.permissions)
 
     @permissions.setter
     def permissions(self, value: typing.List[Permission]) -> None:
-        self._values['permissions'] = value
+        self.activate(dataclasses.replace(self.context, permissions=tuple(value)))
 
     def has_permissions(self, collections: typing.List[CollectionName], action: ActionType) -> bool:
-        for perm in self.permissions:
-            if perm.collection in collections and action in perm.actions and perm.enabled:
-                return True
-
-        return False
+        return self.context.mask.allows(collections, action)
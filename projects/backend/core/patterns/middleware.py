@@ -2,13 +2,14 @@ import threading
 import traceback
 from urllib.parse import urlparse
 
-from core.patterns.management import MembershipManagement
+from core.patterns.management import (
+    MembershipCache,
+    MembershipContext,
+    MembershipManagement,
+)
 from django.contrib.admin.utils import unquote
-from django.db.models import Q
 from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect
 from django.urls import resolve
-from vega import constants
-from vega.models import Portfolio
 
 
 class PermissionMiddleware:
@@ -21,30 +22,16 @@ class PermissionMiddleware:
 
     def setStorage(self, id: str | None, request: HttpRequest) -> None:
         id = int(unquote(id))
-        portfolio: Portfolio = Portfolio.objects.get(pk=id) if id else None
-        subscription = None
-        permissions = []
-
-        if portfolio and request.user.is_authenticated:
-            user_query = Q(user__username=request.user.username)
-            try:
-                subscription = portfolio.subscriptions.get(user_query)
-            except:
-                pass
-
-        role_type = subscription.role if subscription else constants.Role_Type.GUEST
-
-        if portfolio:
-            role_query = Q(role=role_type)
-            permissions = list(portfolio.permissions.filter(role_query))
-
-        self.mgmt.portfolio = portfolio
-        self.mgmt.subscription = subscription
-        self.mgmt.permissions = permissions
+
+        if id:
+            self.mgmt.activate(MembershipCache.load(id, request.user))
+
         print('storage set $$$$$$$$$$$$$$$$$$$$$$$$$$')
 
     def __call__(self, request: HttpRequest) -> HttpResponse:
         print('setup storage=========================')
+        # Every request starts from an empty membership, restored once it is answered.
+        token = self.mgmt.activate(MembershipContext())
 
         try:
             matched = resolve(request.path_info)
@@ -88,7 +75,12 @@ class PermissionMiddleware:
             traceback.print_exc()
 
         print('before response')
-        response = self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            self.mgmt.reset(token)
+
         print('After response')
 
         return response
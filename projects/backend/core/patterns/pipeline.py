@@ -0,0 +1,120 @@
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+
+@dataclass
+class Stage:
+    name: str
+
+    action: typing.Callable[[CursorWrapper], typing.Any]
+
+    depends_on: typing.List[str] = field(default_factory=list)
+
+    message: str | None = None
+
+    result: typing.Any = None
+
+    started: float | None = None
+
+    duration: float | None = None
+
+
+class StagePipeline:
+    """
+    Runs a DAG of stages, executing every stage whose dependencies are done in parallel.
+
+    Each stage runs on a worker thread with its own database connection, which is closed
+    again when the stage finishes.  Completion callbacks always run on the calling thread.
+    """
+
+    def __init__(self, workers: int = 1, using: str = 'default') -> None:
+        self.workers = max(1, workers)
+        self.using = using
+        self.stages: typing.Dict[str, Stage] = {}
+
+    def add(
+        self,
+        name: str,
+        action: typing.Callable[[CursorWrapper], typing.Any],
+        depends_on: typing.List[str] | None = None,
+        message: str | None = None,
+    ) -> Stage:
+        if name in self.stages:
+            raise ValueError(f'Stage {name} is already defined')
+
+        stage = Stage(name, action, list(depends_on or []), message)
+        self.stages[name] = stage
+
+        return stage
+
+    def validate(self) -> None:
+        for stage in self.stages.values():
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f'Stage {stage.name} depends on unknown stage {dependency}')
+
+        visited: typing.Dict[str, bool] = {}
+
+        def visit(name: str) -> None:
+            if visited.get(name) is False:
+                raise ValueError(f'Stage {name} is part of a dependency cycle')
+            if name in visited:
+                return
+            visited[name] = False
+            for dependency in self.stages[name].depends_on:
+                visit(dependency)
+            visited[name] = True
+
+        for name in self.stages:
+            visit(name)
+
+    def execute(self, stage: Stage) -> None:
+        connection = connections[self.using]
+        stage.started = time.perf_counter()
+
+        try:
+            with connection.cursor() as cursor:
+                stage.result = stage.action(cursor)
+        finally:
+            stage.duration = time.perf_counter() - stage.started
+            connection.close()
+
+    def run(self, on_complete: typing.Callable[[Stage], None] | None = None) -> None:
+        self.validate()
+        done: typing.Set[str] = set()
+        waiting = dict(self.stages)
+        running: typing.Dict[Future, Stage] = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while waiting or running:
+                for name, stage in list(waiting.items()):
+                    if all(dependency in done for dependency in stage.depends_on):
+                        del waiting[name]
+                        running[executor.submit(self.execute, stage)] = stage
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    stage = running.pop(future)
+                    error = future.exception()
+
+                    if error:
+                        for pending in running:
+                            pending.cancel()
+                        raise error
+
+                    done.add(stage.name)
+
+                    if on_complete:
+                        on_complete(stage)
+
+    def timings(self) -> typing.List[Stage]:
+        return sorted(
+            (stage for stage in self.stages.values() if stage.started is not None),
+            key=lambda stage: stage.started or 0,
+        )
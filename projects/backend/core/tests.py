@@ -1,3 +1,167 @@
+import itertools
+import json
+import random
+from unittest import mock
+
+from core.management.commands.benchmark_permissions import scan
+from core.patterns.events import (
+    MAX_BYTES,
+    EventBridge,
+    StubEventsClient,
+    chunk_entries,
+    entry_size,
+)
+from core.patterns.management import MembershipCache, PermissionMask
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
 from django.test import TestCase
+from vega.constants import ActionType, CollectionName
+from vega.models import Permission
+
+
+def event(number: int, size: int = 10) -> dict:
+    return {
+        'Source': 'trackrecord',
+        'DetailType': 'created',
+        'Detail': json.dumps({'id': number, 'data': 'x' * size}),
+        'Resources': [],
+        'EventBusName': 'ambient',
+    }
+
+
+class EventBridgeTestCase(TestCase):
+    def setUp(self) -> None:
+        self.bridge = EventBridge()
+
+    def tearDown(self) -> None:
+        self.bridge.configure()
+
+    def test_chunks_stay_within_limits(self) -> None:
+        entries = [event(number, size=40 * 1024) for number in range(25)]
+        chunks = list(chunk_entries(entries))
+
+        self.assertEqual(sum(map(len, chunks)), 25)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 10)
+            self.assertLessEqual(sum(map(entry_size, chunk)), MAX_BYTES)
+
+        self.assertEqual(list(map(len, chunk_entries([event(n) for n in range(25)]))), [10, 10, 5])
+
+    def test_only_failed_entries_are_retried(self) -> None:
+        attempts = {}
+
+        def fail(entry: dict) -> str | None:
+            number = json.loads(entry['Detail'])['id']
+            attempts[number] = attempts.get(number, 0) + 1
+
+            return 'ThrottlingException' if number % 3 == 0 and attempts[number] < 3 else None
+
+        client = StubEventsClient(fail=fail)
+        self.bridge.configure(client=client, backoff=0, linger=0.01)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(30):
+                self.bridge.save_event(event(number))
+
+        self.assertTrue(self.bridge.flush(timeout=5))
+        stats = self.bridge.stats()
+        self.assertEqual(len(client.accepted), 30)
+        self.assertEqual(stats['published'], 30)
+        self.assertEqual(stats['retried'], 20)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['depth'], 0)
+        self.assertTrue(all(len(call) <= 10 for call in client.calls))
+
+    def test_events_are_sent_after_commit(self) -> None:
+        client = StubEventsClient()
+        self.bridge.configure(client=client, linger=0.01)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.bridge.save_event(event(1))
+
+            try:
+                with transaction.atomic():
+                    self.bridge.save_event(event(2))
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+            self.assertEqual(self.bridge.stats()['published'], 0)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(self.bridge.flush(timeout=5))
+        self.assertEqual([json.loads(entry['Detail'])['id'] for entry in client.accepted], [1])
+
+
+class MembershipCacheTestCase(TestCase):
+    def test_invalidation_from_another_cache_instance(self) -> None:
+        key = MembershipCache.key(1, None)
+
+        # stands in for the cache of another process, e.g. the update_access command
+        other = caches.create_connection('default')
+        self.assertIsNot(other, caches['default'])
+        # local memory caches of one location only share their storage within a process
+        self.assertNotIsInstance(other, LocMemCache)
+
+        with mock.patch('core.patterns.management.cache', other):
+            self.assertEqual(MembershipCache.key(1, None), key)
+            MembershipCache.invalidate(1)
+            invalidated = MembershipCache.key(1, None)
+
+        self.assertNotEqual(invalidated, key)
+        self.assertEqual(MembershipCache.key(1, None), invalidated)
+        self.assertEqual(MembershipCache.key(2, None), MembershipCache.key(2, None))
+
+
+class PermissionMaskTestCase(TestCase):
+    def test_disabled_permissions_grant_nothing(self) -> None:
+        permissions = [
+            Permission(collection=collection, actions=ActionType.values, enabled=False)
+            for collection in CollectionName.values
+        ]
+        mask = PermissionMask.compile(permissions)
+
+        self.assertEqual(mask, PermissionMask())
+        self.assertFalse(mask.allows(CollectionName.values, ActionType.VIEW))
+
+    def test_unknown_collections_and_actions_are_denied(self) -> None:
+        permissions = [
+            Permission(collection='unknown', actions=[ActionType.VIEW], enabled=True),
+            Permission(
+                collection=CollectionName.PORTFOLIO,
+                actions=['unknown', ActionType.VIEW],
+                enabled=True,
+            ),
+        ]
+        mask = PermissionMask.compile(permissions)
+
+        self.assertTrue(mask.allows([CollectionName.PORTFOLIO], ActionType.VIEW))
+        self.assertFalse(mask.allows(['unknown'], ActionType.VIEW))
+        self.assertFalse(mask.allows([CollectionName.PORTFOLIO], 'unknown'))
+        self.assertFalse(mask.allows([CollectionName.PORTFOLIO], ActionType.UPDATE))
+
+    def test_mask_agrees_with_scan(self) -> None:
+        generator = random.Random(7)
+        collections = [*CollectionName.values, 'unknown']
+        actions = [*ActionType.values, 'unknown']
+
+        for _ in range(50):
+            permissions = [
+                Permission(
+                    collection=generator.choice(collections),
+                    actions=generator.sample(actions, generator.randint(0, 3)),
+                    enabled=generator.random() < 0.7,
+                )
+                for _ in range(generator.randint(0, 8))
+            ]
+            mask = PermissionMask.compile(permissions)
 
-# Create your tests here.
+            # the scan grants unknown values found in the permissions, the mask never
+            for checked in itertools.combinations(CollectionName.values, 2):
+                for action in ActionType.values:
+                    self.assertEqual(
+                        mask.allows(checked, action),
+                        scan(permissions, list(checked), action),
+                        (checked, action),
+                    )
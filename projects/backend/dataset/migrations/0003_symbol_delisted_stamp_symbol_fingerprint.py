@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dataset', '0002_alter_exchange_options_alter_market_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='symbol',
+            name='delisted_stamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='symbol',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -2,7 +2,7 @@ import typing
 from functools import wraps
 from typing import Optional
 
-from core.patterns.management import MembershipManagement
+from core.patterns.management import MembershipCache, MembershipManagement
 from django import forms
 from django.contrib import admin
 from django.http import HttpRequest
@@ -57,8 +57,6 @@ class AuthorizationMixin:
             self.collections,
             constants.ActionType.VIEW
         )
-        
-        print(f'User can view {self.collections} is {test}')
 
         return test
 
@@ -78,7 +76,6 @@ class AuthorizationMixin:
             self.collections,
             constants.ActionType.CREATE
         )
-        print(f'User can add {self.collections} is {test}')
 
         return test
 
@@ -99,7 +96,6 @@ class AuthorizationMixin:
             self.collections,
             constants.ActionType.UPDATE
         )
-        print(f'User can update {self.collections} is {test}')
 
         return test
 
@@ -120,7 +116,6 @@ class AuthorizationMixin:
             self.collections,
             constants.ActionType.DELETE
         )
-        print(f'User can delete {self.collections} is {test}')
 
         return test
 
@@ -225,12 +220,9 @@ class OrderSubAdmin(AuthorizationMixin, SubAdmin):
 
     @inherit_docstring_from(SubAdmin)
     def save_model(self, request: HttpRequest, obj: Order, form: forms.ModelForm, change: bool):
-        Order.objects.update_status(obj)
-        Position.objects.set_position(obj)
-        super(OrderSubAdmin, self).save_model(request, obj, form, change)
-        Position.objects.update_status(obj.position)
-        obj.portfolio.positions.update_streaks()
-        Portfolio.objects.update_stats(obj.portfolio)
+        # Only the part of the equity curve after the position changed is rebuilt.
+        since, streaks = Order.objects.apply(obj)
+        Portfolio.objects.refresh(obj.portfolio, since, streaks)
 
 
 class PositionSubAdmin(AuthorizationMixin, SubAdmin):
@@ -308,6 +300,15 @@ class PortfolioAdmin(RootSubAdmin):
         'avg_loss_duration',
         'win_ratio',
         'total_cagr',
+        'max_drawdown',
+        'max_drawdown_duration',
+        'current_drawdown',
+        'sharpe_ratio',
+        'sortino_ratio',
+        'calmar_ratio',
+        'profit_factor',
+        'expectancy',
+        'payoff_ratio',
         'total_wins',
         'total_losses',
         'total_washes',
@@ -336,6 +337,15 @@ class PortfolioAdmin(RootSubAdmin):
                 'avg_loss_duration',
                 'win_ratio',
                 'total_cagr',
+                'max_drawdown',
+                'max_drawdown_duration',
+                'current_drawdown',
+                'sharpe_ratio',
+                'sortino_ratio',
+                'calmar_ratio',
+                'profit_factor',
+                'expectancy',
+                'payoff_ratio',
                 'total_wins',
                 'total_losses',
                 'total_washes',
@@ -355,21 +365,14 @@ class PortfolioAdmin(RootSubAdmin):
             subscription.user = request.user
             subscription.role = constants.RoleType.OWNER
             subscription.save()
-            items = manager.default_owner_permissions(obj)
-            items += manager.default_admin_permissions(obj)
-            items += manager.default_subscription_permissions(obj)
-            items += manager.default_guest_permissions(obj)
-            manager.bulk_create(items, None, True)
-
-        permissions = manager.all().filter(portfolio__id=obj.id)
-
-        for item in permissions:
-            is_order_record = obj.record_type == constants.RecordType.ORDER
-            is_order_group = item.group == constants.CollectionGroup.ORDERS
-            item.enabled = item.role in obj.allowed_roles
+            manager.provision([obj])
+        elif {'allowed_roles', 'record_type'}.intersection(form.changed_data):
+            manager.sync([obj.pk])
 
-            if not is_order_record and is_order_group:
-                item.enabled = False
+        # Permissions were written in bulk, without the signals invalidating the cache.
+        MembershipCache.invalidate(obj.pk)
 
-        manager.bulk_update(permissions, ['enabled'])
-        Portfolio.objects.update_stats(obj)
+        # The capital is the only field the figures depend on, the streaks only need
+        # their first numbering.
+        if not change or 'initial_capital' in form.changed_data:
+            Portfolio.objects.refresh(obj, streaks=not change)
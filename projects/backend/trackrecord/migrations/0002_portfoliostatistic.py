@@ -0,0 +1,41 @@
+# Generated by Django 5.0 on 2026-10-18 15:32
+
+import datetime
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackrecord', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result_type', models.CharField(choices=[('unknown', 'Unknown'), ('win', 'Win'), ('loss', 'Loss'), ('wash', 'Wash')], max_length=7)),
+                ('position_count', models.IntegerField(default=0)),
+                ('amount_sum', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=15)),
+                ('amount_sumsq', models.DecimalField(decimal_places=4, default=Decimal('0'), max_digits=24)),
+                ('amount_min', models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True)),
+                ('amount_max', models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True)),
+                ('duration_sum', models.DurationField(default=datetime.timedelta)),
+                ('duration_min', models.DurationField(blank=True, null=True)),
+                ('duration_max', models.DurationField(blank=True, null=True)),
+                ('is_stale', models.BooleanField(default=False)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', related_query_name='core.portfolio', to='trackrecord.portfolio')),
+            ],
+            options={
+                'abstract': False,
+                'base_manager_name': 'objects',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='portfoliostatistic',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'result_type'), name='unique_portfolio_result_type'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trackrecord', '0002_portfoliostatistic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='current_drawdown',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='portfolio',
+            name='max_drawdown',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=7, null=True),
+        ),
+        migrations.AddField(
+            model_name='portfolio',
+            name='max_drawdown_duration',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='portfolio',
+            name='total_cagr',
+            field=models.DecimalField(decimal_places=2, max_digits=9, null=True),
+        ),
+        migrations.CreateModel(
+            name='PortfolioEquity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stamp', models.DateField()),
+                ('realized_pnl', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=15)),
+                ('unreal_pnl', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=15)),
+                ('equity', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('peak', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('peak_stamp', models.DateField()),
+                ('drawdown', models.DecimalField(decimal_places=6, default=Decimal('0'), max_digits=9)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='equity', related_query_name='core.portfolio', to='trackrecord.portfolio')),
+            ],
+            options={
+                'ordering': ['stamp'],
+                'abstract': False,
+                'base_manager_name': 'objects',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='portfolioequity',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'stamp'), name='unique_portfolio_stamp'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 15:48
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built concurrently so the order and position tables stay writable.
+    atomic = False
+
+    dependencies = [
+        ('dataset', '0003_symbol_delisted_stamp_symbol_fingerprint'),
+        ('trackrecord', '0004_portfolio_risk_metrics'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('order_status', 'filled')), fields=['_position', 'order_action', 'filled_stamp'], include=('filled_price', 'filled_amount', 'fees'), name='filled_order_position_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='position',
+            index=models.Index(condition=models.Q(('position_status', 'closed')), fields=['_portfolio', 'exit_stamp', 'id'], name='closed_position_exit_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='position',
+            index=models.Index(condition=models.Q(('position_status', 'closed')), fields=['_portfolio', 'result_type'], include=('real_pnl', 'duration'), name='closed_position_result_idx'),
+        ),
+        # A conditional unique constraint is a unique index, built concurrently as well.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE UNIQUE INDEX CONCURRENTLY "unique_open_position" ON "trackrecord_position" ("_portfolio_id", "_symbol_id") WHERE "position_status" = \'open\';',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "unique_open_position";',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='position',
+                    constraint=models.UniqueConstraint(condition=models.Q(('position_status', 'open')), fields=('_portfolio', '_symbol'), name='unique_open_position'),
+                ),
+            ],
+        ),
+    ]
@@ -1,3 +1,347 @@
-from django.test import TestCase
+import datetime
+import os
+import random
+import tempfile
+import threading
+import typing
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from vega import constants
+from vega.models import (
+    Exchange,
+    Market,
+    Order,
+    Portfolio,
+    PortfolioEquity,
+    PortfolioStatistic,
+    Position,
+    Security,
+    Symbol,
+)
+
+
+def create_portfolio(code: str) -> typing.Tuple[typing.List[Symbol], Portfolio]:
+    """
+    Three symbols and an empty portfolio trading them.
+    """
+    exchange = Exchange.objects.create(code='TEST')
+    market = Market.objects.create(code='TEST')
+    security = Security.objects.create(code='TEST')
+    symbols = Symbol.objects.bulk_create(
+        [
+            Symbol(
+                code=f'SYM{n}',
+                search_index=f'(TEST):SYM{n}',
+                exchange=exchange,
+                market=market,
+                security=security,
+            )
+            for n in range(3)
+        ]
+    )
+    portfolio = Portfolio.objects.create(
+        code=code,
+        initial_capital=Decimal('10000'),
+        allowed_roles=[constants.RoleType.OWNER],
+        total_wins=0,
+        total_losses=0,
+        total_washes=0,
+        total_trades=0,
+        largest_wining_streak=0,
+        largest_loosing_streak=0,
+        largest_wash_streak=0,
+    )
+
+    return symbols, portfolio
+
+
+class ConcurrentOrderTests(TransactionTestCase):
+    """Orders applied to one portfolio from many threads at once."""
+
+    threads = 8
+
+    orders_per_thread = 25
+
+    def setUp(self) -> None:
+        self.symbols, self.portfolio = create_portfolio('STRESS')
+
+    def apply_orders(self, seed: int, errors: list) -> None:
+        rng = random.Random(seed)
+
+        try:
+            for _ in range(self.orders_per_thread):
+                stamp = datetime.datetime.now(datetime.timezone.utc)
+                price = Decimal(rng.randint(9000, 11000)) / 100
+                order = Order(
+                    _portfolio=self.portfolio,
+                    _symbol=rng.choice(self.symbols),
+                    order_action=rng.choice(constants.OrderAction.values),
+                    sent_stamp=stamp,
+                    sent_price=price,
+                    sent_amount=10,
+                    filled_stamp=stamp,
+                    filled_price=price,
+                    filled_amount=10,
+                    fees=Decimal('1.00'),
+                )
+                Order.objects.apply(order)
+
+            Portfolio.objects.refresh(self.portfolio)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_keep_positions_consistent(self) -> None:
+        errors: list = []
+        workers = [
+            threading.Thread(target=self.apply_orders, args=(seed, errors))
+            for seed in range(self.threads)
+        ]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), self.threads * self.orders_per_thread)
+        self.assertFalse(Order.objects.filter(_position=None).exists())
+
+        for symbol in self.symbols:
+            positions = Position.objects.get_queryset().open_positions()
+            self.assertLessEqual(positions.filter(_symbol=symbol).count(), 1)
+
+        # Every position is what its own orders make of it.
+        for position in Position.objects.all():
+            buys = position.orders.filter(order_action=constants.OrderAction.BUY).count()
+            sells = position.orders.filter(order_action=constants.OrderAction.SELL).count()
+            is_closed = position.position_status == constants.PositionStatus.CLOSED
+            self.assertEqual(is_closed, buys == sells, position.pk)
+
+        self.portfolio.refresh_from_db()
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+        self.assertEqual(
+            self.portfolio.total_trades,
+            Position.objects.get_queryset().closed_positions().count(),
+        )
+
+
+class IngestTests(TestCase):
+    """Fills bulk loaded into a portfolio and matched to its positions."""
+
+    start = datetime.datetime(2026, 1, 5, 15, tzinfo=datetime.timezone.utc)
+
+    def setUp(self) -> None:
+        self.symbols, self.portfolio = create_portfolio('INGEST')
+
+    def fill(self, action: str, amount: int, day: int, price: str = '10') -> dict:
+        return {
+            'symbol': 'SYM0',
+            'order_action': action,
+            'filled_stamp': self.start + datetime.timedelta(days=day),
+            'filled_price': Decimal(price),
+            'filled_amount': amount,
+        }
+
+    def positions(self) -> typing.List[typing.Tuple[str, str, int, int]]:
+        return list(
+            Position.objects.order_by('id').values_list(
+                'trend_type', 'position_status', 'entry_amount', 'exit_amount'
+            )
+        )
+
+    def assertConsistent(self) -> None:
+        self.portfolio.refresh_from_db()
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+        self.assertEqual(
+            self.portfolio.total_trades,
+            Position.objects.get_queryset().closed_positions().count(),
+        )
+
+    def test_round_trip_and_reentry(self) -> None:
+        buy, sell = constants.OrderAction.BUY, constants.OrderAction.SELL
+        fills = [self.fill(buy, 10, 0), self.fill(sell, 10, 1, '12'), self.fill(buy, 10, 2)]
+
+        rows = [dict(fill) for fill in fills]
+        result = Order.objects.ingest(self.portfolio, fills)
+
+        self.assertEqual(result, {'orders': 3, 'opened': 2, 'positions': 2})
+        self.assertEqual(fills, rows)
+        self.assertEqual(self.positions(), [('long', 'closed', 10, 10), ('long', 'open', 10, None)])
+
+        # The next load closes the open position and opens another one.
+        Order.objects.ingest(self.portfolio, [self.fill(sell, 10, 3, '13'), self.fill(buy, 10, 4)])
+
+        self.assertEqual(
+            self.positions(),
+            [('long', 'closed', 10, 10), ('long', 'closed', 10, 10), ('long', 'open', 10, None)],
+        )
+        self.assertConsistent()
+
+    def test_fill_crossing_zero_is_split(self) -> None:
+        buy, sell = constants.OrderAction.BUY, constants.OrderAction.SELL
+        fills = [self.fill(buy, 10, 0), self.fill(sell, 15, 1, '12'), self.fill(buy, 5, 2)]
+
+        Order.objects.ingest(self.portfolio, fills)
+
+        self.assertEqual(self.positions(), [('long', 'closed', 10, 10), ('short', 'closed', 5, 5)])
+        self.assertEqual(
+            list(
+                Order.objects.order_by('filled_stamp', 'id').values_list('filled_amount', flat=True)
+            ),
+            [10, 10, 5, 5],
+        )
+        self.assertConsistent()
+
+    def import_statement(self, rows: typing.List[str]) -> typing.Dict[str, typing.Any]:
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as statement:
+            statement.write('\n'.join(rows))
+
+        try:
+            return Order.objects.import_statement(self.portfolio, statement.name)
+        finally:
+            os.unlink(statement.name)
+
+    def test_statement_crossing_zero(self) -> None:
+        rows = [
+            'symbol,order_action,filled_stamp,filled_price,filled_amount,fees',
+            'SYM0,BUY,2026-01-05T15:00:00Z,10.00,10,1',
+            'SYM0,SELL,2026-01-06T15:00:00Z,12.00,15,1.5',
+            'SYM0,BUY,2026-01-07T15:00:00Z,11.00,5,0',
+        ]
+        result = self.import_statement(rows)
+
+        self.assertEqual((result['orders'], result['opened'], result['skipped']), (4, 2, 0))
+        self.assertEqual(self.positions(), [('long', 'closed', 10, 10), ('short', 'closed', 5, 5)])
+        self.assertConsistent()
+
+    def test_statement_prices_beyond_columns_are_skipped(self) -> None:
+        rows = [
+            'symbol,order_action,filled_stamp,filled_price,filled_amount,fees',
+            'SYM0,BUY,2026-01-05T15:00:00Z,10.00,10,1',
+            'SYM0,BUY,2026-01-06T15:00:00Z,12345678.00,10,1',
+            'SYM0,SELL,2026-01-07T15:00:00Z,12.00,10,9999999.996',
+            'SYM0,SELL,2026-01-08T15:00:00Z,11.00,5,0',
+        ]
+        result = self.import_statement(rows)
+
+        self.assertEqual((result['orders'], result['opened'], result['skipped']), (2, 1, 2))
+        self.assertEqual(self.positions(), [('long', 'open', 10, 5)])
+        self.assertConsistent()
+
+
+class ApplyOrderTests(TestCase):
+    """Single orders applied to the positions of a portfolio."""
+
+    def setUp(self) -> None:
+        self.symbols, self.portfolio = create_portfolio('APPLY')
+
+    def apply(
+        self, action: str, amount: int, day: int, fees: str, price: str = '10', symbol: int = 0
+    ) -> Order:
+        stamp = datetime.datetime(2026, 1, 5, 15, tzinfo=datetime.timezone.utc)
+        stamp += datetime.timedelta(days=day)
+        order = Order(
+            _portfolio=self.portfolio,
+            _symbol=self.symbols[symbol],
+            order_action=action,
+            sent_stamp=stamp,
+            sent_price=Decimal(price),
+            sent_amount=amount,
+            filled_stamp=stamp,
+            filled_price=Decimal(price),
+            filled_amount=amount,
+            fees=Decimal(fees),
+        )
+        self.change = Order.objects.apply(order)
+
+        return order
+
+    def figures(self) -> tuple:
+        self.portfolio.refresh_from_db()
+        curve = PortfolioEquity.objects.filter(portfolio=self.portfolio).order_by('stamp')
+        fields = ['total_cagr', 'max_drawdown', 'current_drawdown', 'largest_wining_streak']
+
+        return (
+            list(curve.values_list('stamp', 'equity', 'peak', 'peak_stamp', 'drawdown')),
+            list(Position.objects.order_by('id').values_list('streak_group', 'streak_index')),
+            [getattr(self.portfolio, field) for field in fields],
+        )
+
+    def test_exit_beyond_open_amount_is_split(self) -> None:
+        self.apply(constants.OrderAction.BUY, 10, 0, '1')
+        self.apply(constants.OrderAction.SELL, 15, 1, '1.50')
+
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list('filled_amount', 'fees')),
+            [(10, Decimal('1.00')), (10, Decimal('1.00')), (5, Decimal('0.50'))],
+        )
+        self.assertEqual(
+            list(
+                Position.objects.order_by('id').values_list(
+                    'trend_type', 'position_status', 'entry_amount'
+                )
+            ),
+            [('long', 'closed', 10), ('short', 'open', 5)],
+        )
+
+    def test_refresh_from_change_matches_full_refresh(self) -> None:
+        buy, sell = constants.OrderAction.BUY, constants.OrderAction.SELL
+        Portfolio.objects.refresh(self.portfolio)
+        trades = [
+            (buy, 0, '10', 0),
+            (sell, 3, '12', 0),
+            (buy, 4, '10', 1),
+            (buy, 6, '10', 0),
+            (sell, 9, '8', 0),
+            (sell, 11, '9', 1),
+        ]
+
+        for action, day, price, symbol in trades:
+            self.apply(action, 10, day, '1', price, symbol)
+            Portfolio.objects.refresh(self.portfolio, *self.change)
+            refreshed = self.figures()
+            Portfolio.objects.refresh(self.portfolio)
+
+            self.assertEqual(refreshed, self.figures(), (action, day))
+
+    def test_recompute_matches_applied_orders(self) -> None:
+        buy, sell = constants.OrderAction.BUY, constants.OrderAction.SELL
+        # a closed position, a partly exited one and one without exits
+        self.apply(buy, 10, 0, '1', '10', 0)
+        self.apply(buy, 5, 1, '0.50', '12', 0)
+        self.apply(sell, 15, 2, '1.50', '11', 0)
+        self.apply(sell, 10, 0, '1', '20', 1)
+        self.apply(buy, 4, 1, '0.40', '18', 1)
+        self.apply(buy, 6, 0, '0.60', '30', 2)
+        fields = ['position_status', 'entry_price', 'exit_price', 'real_pnl', 'unreal_pnl']
+        applied = list(Position.objects.order_by('id').values_list(*fields))
+
+        # marked at their last fill price, like the applied orders
+        marks = {self.symbols[1].pk: Decimal('18'), self.symbols[2].pk: Decimal('30')}
+        Position.objects.recompute(prices=marks)
+
+        self.assertEqual(list(Position.objects.order_by('id').values_list(*fields)), applied)
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+
+    def test_deletes_keep_statistics_consistent(self) -> None:
+        buy, sell = constants.OrderAction.BUY, constants.OrderAction.SELL
+        self.apply(buy, 10, 0, '1', '10', 0)
+        self.apply(sell, 10, 1, '1', '12', 0)
+        self.apply(buy, 10, 2, '1', '11', 0)
+        self.apply(buy, 5, 0, '1', '20', 1)
+        exit_order = self.apply(sell, 5, 1, '1', '18', 1)
+        self.apply(buy, 5, 3, '1', '30', 2)
+
+        exit_order.delete()
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+
+        Position.objects.filter(_symbol=self.symbols[0], position_status='closed').delete()
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+
+        Order.objects.filter(_symbol=self.symbols[2]).delete()
+        self.assertEqual(PortfolioStatistic.objects.inconsistencies(self.portfolio), {})
+        self.assertEqual(Position.objects.count(), 2)